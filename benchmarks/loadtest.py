@@ -0,0 +1,334 @@
+"""Drives mixed traffic through the tweens of a local app.
+
+An app with a number of assets is served by a threaded WSGI server on the
+loopback interface. Client threads then request a mix of html pages (with
+different sets of included assets), bundles, revalidations (304) and unknown
+files (404)::
+
+    python benchmarks/loadtest.py --requests 5000 --concurrency 8
+
+Requests per second, the latency percentiles per kind of request and the
+growth of the resident memory of the process are reported. Everything runs
+offline, so the numbers may be compared between releases. Use ``--min-rps``
+and ``--max-p99`` (milliseconds) to fail if the results are worse than a
+given budget.
+
+"""
+
+import argparse
+import http.client
+import itertools
+import os.path
+import random
+import re
+import resource
+import shutil
+import socketserver
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+
+#: The share of each kind of request in the mix
+MIX = (("page", 50), ("bundle", 30), ("revalidate", 15), ("missing", 5))
+
+#: The assets included by each page
+PAGES = 8
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+def create_app(assets, count):
+    import morepath
+
+    from more.webassets import WebassetsApp
+
+    class App(WebassetsApp):
+        pass
+
+    @App.webasset_path()
+    def get_path():
+        return assets
+
+    @App.webasset_output()
+    def get_output():
+        return os.path.join(assets, "bundles")
+
+    def register(index):
+        @App.webasset(f"asset{index}")
+        def get_asset():
+            yield f"file{index}.js"
+            yield f"file{index}.css"
+
+    for index in range(count):
+        register(index)
+
+    @App.path(path="/page/{number}")
+    class Page:
+        def __init__(self, number=0):
+            self.number = number
+
+    @App.html(model=Page)
+    def view_page(self, request):
+        for index in range(self.number, self.number + PAGES):
+            request.include(f"asset{index % count}")
+
+        return "<html><head></head><body>page</body></html>"
+
+    morepath.commit(App)
+    return App()
+
+
+def write_assets(assets, count):
+    for index in range(count):
+        with open(os.path.join(assets, f"file{index}.js"), "w") as f:
+            f.write(f"var file{index} = {index};\n" * 50)
+
+        with open(os.path.join(assets, f"file{index}.css"), "w") as f:
+            f.write(f".file{index} {{ z-index: {index}; }}\n" * 50)
+
+
+def rss():
+    """Returns the resident memory of this process in bytes."""
+
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        # the maximum is the best we can do elsewhere (kilobytes on linux,
+        # bytes on macOS, which only matters for the absolute numbers)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Client:
+    """Sends requests over a keep-alive connection, reconnecting as needed."""
+
+    def __init__(self, port):
+        self.port = port
+        self.connection = None
+
+    def request(self, path, headers=None):
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection("127.0.0.1", self.port)
+
+        try:
+            self.connection.request("GET", path, headers=headers or {})
+            response = self.connection.getresponse()
+            body = response.read()
+        except (http.client.HTTPException, OSError):
+            self.connection.close()
+            self.connection = None
+            raise
+
+        # wsgiref speaks HTTP/1.0 and closes the connection after each request
+        if response.will_close:
+            self.connection.close()
+            self.connection = None
+
+        return response.status, response.getheader("ETag"), body
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+
+def discover(client, count):
+    """Returns the bundle urls and their etags by requesting all pages."""
+
+    urls = set()
+
+    for number in range(0, count, PAGES):
+        status, _, body = client.request(f"/page/{number}")
+        assert status == 200, f"page {number} returned {status}"
+        urls.update(re.findall(r'(?:src|href)="([^"]+)"', body.decode("utf-8")))
+
+    etags = {}
+
+    for url in sorted(urls):
+        status, etag, _ = client.request(url)
+        assert status == 200, f"{url} returned {status}"
+        etags[url] = etag
+
+    return etags
+
+
+def plan(requests, count, etags, seed):
+    """Returns the list of requests to send, as (kind, path, headers)."""
+
+    rng = random.Random(seed)
+    kinds, weights = zip(*MIX)
+    urls = sorted(etags)
+    result = []
+
+    for kind in rng.choices(kinds, weights, k=requests):
+        if kind == "page":
+            result.append((kind, f"/page/{rng.randrange(count)}", None))
+        elif kind == "bundle":
+            result.append((kind, rng.choice(urls), None))
+        elif kind == "revalidate":
+            url = rng.choice(urls)
+            result.append((kind, url, {"If-None-Match": etags[url]}))
+        else:
+            path = f"/assets/missing{rng.randrange(count)}.js"
+            result.append((kind, path, None))
+
+    return result
+
+
+def drive(port, requests, concurrency):
+    """Sends the requests from the given number of threads.
+
+    Returns the latencies (seconds) by kind of request, the unexpected
+    responses and the total time spent.
+
+    """
+
+    expected = {"page": 200, "bundle": 200, "revalidate": 304, "missing": 404}
+    pending = iter(requests)
+    lock = threading.Lock()
+    latencies = {kind: [] for kind in expected}
+    errors = []
+
+    def work():
+        client = Client(port)
+
+        while True:
+            with lock:
+                item = next(pending, None)
+
+            if item is None:
+                break
+
+            kind, path, headers = item
+            start = time.perf_counter()
+
+            try:
+                status = client.request(path, headers)[0]
+            except (http.client.HTTPException, OSError) as e:
+                status = e
+
+            elapsed = time.perf_counter() - start
+
+            with lock:
+                latencies[kind].append(elapsed)
+
+                if status != expected[kind]:
+                    errors.append((path, status))
+
+        client.close()
+
+    threads = [threading.Thread(target=work) for _ in range(concurrency)]
+    start = time.perf_counter()
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    return latencies, errors, time.perf_counter() - start
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def report(latencies, elapsed, growth):
+    total = sum(len(values) for values in latencies.values())
+    everything = list(itertools.chain.from_iterable(latencies.values()))
+
+    print(f"{total} requests in {elapsed:.2f} s, {total / elapsed:.0f} requests/s")
+
+    for kind, values in itertools.chain(latencies.items(), [("all", everything)]):
+        if not values:
+            continue
+
+        print(
+            f"{kind:<11} {len(values):6d}  "
+            f"p50 {statistics.median(values) * 1000:7.2f} ms  "
+            f"p99 {percentile(values, 0.99) * 1000:7.2f} ms"
+        )
+
+    print(f"rss growth {growth / 1024 / 1024:.1f} MiB")
+
+    return total / elapsed, percentile(everything, 0.99) * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--assets", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--min-rps", type=float, default=None)
+    parser.add_argument("--max-p99", type=float, default=None)
+    args = parser.parse_args(argv)
+
+    assets = tempfile.mkdtemp()
+
+    try:
+        write_assets(assets, args.assets)
+        app = create_app(assets, args.assets)
+
+        server = make_server(
+            "127.0.0.1",
+            0,
+            app,
+            server_class=ThreadingServer,
+            handler_class=QuietHandler,
+        )
+        port = server.server_address[1]
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        try:
+            # build all bundles before measuring
+            client = Client(port)
+            etags = discover(client, args.assets)
+            client.close()
+
+            requests = plan(args.requests, args.assets, etags, args.seed)
+
+            before = rss()
+            latencies, errors, elapsed = drive(port, requests, args.concurrency)
+            growth = rss() - before
+        finally:
+            server.shutdown()
+            server.server_close()
+    finally:
+        shutil.rmtree(assets)
+
+    print(f"{args.assets} assets, {len(etags)} bundles, {args.concurrency} threads")
+    rps, p99 = report(latencies, elapsed, growth)
+
+    ok = True
+
+    for path, status in errors[:10]:
+        print(f"unexpected response for {path}: {status}")
+
+    if errors:
+        print(f"{len(errors)} unexpected responses")
+        ok = False
+
+    if args.min_rps is not None and rps < args.min_rps:
+        ok = False
+
+    if args.max_p99 is not None and p99 > args.max_p99:
+        ok = False
+
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""Measures how long it takes to import more.webassets and commit an app.
+
+Each run happens in a fresh interpreter, so the numbers include the cost of
+all the imports::
+
+    python benchmarks/startup.py --assets 200 --runs 20
+
+Use ``--max-import`` and ``--max-commit`` (milliseconds) to fail if the
+median exceeds a given budget, e.g. on CI.
+
+"""
+
+import argparse
+import json
+import os.path
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+
+CHILD = """
+import json
+import sys
+import time
+
+start = time.perf_counter()
+
+import morepath
+from more.webassets import WebassetsApp
+
+imported = time.perf_counter()
+
+assets, count = sys.argv[1], int(sys.argv[2])
+
+class App(WebassetsApp):
+    pass
+
+@App.webasset_path()
+def get_path():
+    return assets
+
+def register(index):
+    @App.webasset(f"asset{index}")
+    def get_asset():
+        yield f"file{index}.js"
+
+for index in range(count):
+    register(index)
+
+morepath.commit(App)
+App()
+
+committed = time.perf_counter()
+
+print(json.dumps({
+    "import": (imported - start) * 1000,
+    "commit": (committed - imported) * 1000,
+    "webassets_imported": "webassets" in sys.modules,
+}))
+"""
+
+
+def run(assets, count):
+    output = subprocess.check_output(
+        [sys.executable, "-c", CHILD, assets, str(count)], universal_newlines=True
+    )
+    return json.loads(output)
+
+
+def report(name, values, budget):
+    median = statistics.median(values)
+
+    print(
+        f"{name:<8} median {median:8.2f} ms  "
+        f"min {min(values):8.2f} ms  max {max(values):8.2f} ms"
+    )
+
+    return budget is None or median <= budget
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--assets", type=int, default=100)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--max-import", type=float, default=None)
+    parser.add_argument("--max-commit", type=float, default=None)
+    args = parser.parse_args(argv)
+
+    assets = tempfile.mkdtemp()
+
+    try:
+        for index in range(args.assets):
+            with open(os.path.join(assets, f"file{index}.js"), "w") as f:
+                f.write(f"var file{index} = {index};")
+
+        results = [run(assets, args.assets) for _ in range(args.runs)]
+    finally:
+        shutil.rmtree(assets)
+
+    print(f"{args.runs} runs, {args.assets} assets")
+
+    ok = report("import", [r["import"] for r in results], args.max_import)
+    ok &= report("commit", [r["commit"] for r in results], args.max_commit)
+
+    if any(r["webassets_imported"] for r in results):
+        print("webassets was imported during startup")
+        ok = False
+
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
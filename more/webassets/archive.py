@@ -0,0 +1,247 @@
+"""Packs the published files into a single, memory-mapped archive.
+
+Serving many small files means opening many files. An archive contains all
+published files of an environment (and gzip compressed variants of the
+text files), together with an index of their offsets, sizes, ETags and
+content types::
+
+    more-webassets archive myproject.app:App
+
+The archive is written to the output directory, named after the hash of its
+content (e.g. ``bundles.1a2b3c4d5e6f7a8b.pack``). Archives are never changed
+once written. A pointer file (``archive.json``) names the current archive,
+it is replaced atomically when a new archive is written.
+
+When the app starts (outside of debug mode), the publisher maps the current
+archive into memory and serves the files from it, without opening them.
+Files which are not in the archive, or whose version differs from the one
+in the requested url (because the bundles were built again in the
+meantime), are served from the output directory as usual.
+
+Archives written while the app is running are used after the next reload
+(see :mod:`more.webassets.reload`), the publisher then switches to the new
+archive at once. How the files are passed to the server is configured
+through :class:`more.webassets.directives.WebassetArchive`.
+
+The format of an archive is the magic ``MWA1``, the length of the index as
+a 4 byte big-endian integer, the index (json) and the data of the files.
+The offsets in the index are relative to the start of the data.
+
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import mmap
+import os.path
+import struct
+
+from more.webassets.manifest import build_manifest
+
+
+#: The first bytes of each archive
+MAGIC = b"MWA1"
+
+#: The name of the file pointing to the current archive
+ARCHIVE_POINTER = "archive.json"
+
+#: The content types whose files are stored with a gzip compressed variant
+COMPRESSIBLE = (
+    "application/javascript",
+    "application/json",
+    "image/svg+xml",
+    "text/",
+)
+
+
+def is_compressible(content_type):
+    return content_type.startswith(COMPRESSIBLE)
+
+
+def pack_files(files):
+    """Returns the archive of the given files (a dict of data by path)."""
+
+    index = {}
+    chunks = []
+    offset = 0
+
+    def add(data):
+        nonlocal offset
+
+        chunks.append(data)
+        offset += len(data)
+
+        return offset - len(data), len(data)
+
+    for path in sorted(files):
+        data = files[path]
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+        entry = {
+            "content_type": content_type,
+            "etag": hashlib.md5(data).hexdigest(),
+            "data": add(data),
+            "gzip": None,
+        }
+
+        if is_compressible(content_type):
+            # the archive is the same for the same files (no timestamp)
+            buffer = io.BytesIO()
+
+            with gzip.GzipFile(
+                fileobj=buffer, mode="wb", compresslevel=9, mtime=0
+            ) as f:
+                f.write(data)
+
+            compressed = buffer.getvalue()
+
+            if len(compressed) < len(data):
+                entry["gzip"] = add(compressed)
+
+        index[path] = entry
+
+    header = json.dumps(index, sort_keys=True).encode("utf-8")
+
+    return b"".join((MAGIC, struct.pack(">I", len(header)), header, *chunks))
+
+
+def write_archive(registry, environment=None):
+    """Builds all the assets of the registry, packs the published files and
+    writes the archive to the output directory. Returns the path of the
+    archive.
+
+    The previous archive is kept, so processes still using it may continue
+    to do so. Older archives are removed.
+
+    """
+
+    if environment is None:
+        environment = registry.get_environment()
+        environment.debug = False
+
+    directory = environment.directory
+    manifest = build_manifest(registry, environment)
+    files = {}
+
+    for path in manifest["files"]:
+        with open(os.path.join(directory, path), "rb") as f:
+            files[path] = f.read()
+
+    archive = pack_files(files)
+    name = f"bundles.{hashlib.sha256(archive).hexdigest()[:16]}.pack"
+    path = os.path.join(directory, name)
+
+    if not os.path.isfile(path):
+        with open(f"{path}.{os.getpid()}.tmp", "wb") as f:
+            f.write(archive)
+
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+
+    previous = read_archive_pointer(directory)
+    keep = {name, previous}
+
+    pointer = os.path.join(directory, ARCHIVE_POINTER)
+
+    with open(f"{pointer}.{os.getpid()}.tmp", "w", encoding="utf-8") as f:
+        json.dump({"name": name}, f)
+
+    os.replace(f"{pointer}.{os.getpid()}.tmp", pointer)
+
+    for other in os.listdir(directory):
+        if other.startswith("bundles.") and other.endswith(".pack"):
+            if other not in keep:
+                os.remove(os.path.join(directory, other))
+
+    return path
+
+
+def read_archive_pointer(directory):
+    """Returns the name of the current archive in the given directory (or
+    None if there is none).
+
+    """
+
+    try:
+        with open(os.path.join(directory, ARCHIVE_POINTER), encoding="utf-8") as f:
+            return json.load(f)["name"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def open_archive(directory, zero_copy=False, current=None):
+    """Opens the current archive in the given directory (or returns None if
+    there is none).
+
+    If the ``current`` archive is still the one the directory points to, it
+    is returned instead of mapping the archive again.
+
+    """
+
+    name = read_archive_pointer(directory)
+
+    if name is None:
+        return None
+
+    path = os.path.join(directory, name)
+
+    if current is not None and current.path == path:
+        if current.zero_copy == zero_copy:
+            return current
+
+    try:
+        return Archive(path, zero_copy)
+    except (OSError, ValueError):
+        return None
+
+
+class ArchivedFile:
+    """Represents a file in an :class:`Archive`."""
+
+    __slots__ = ("content_type", "etag", "data", "gzip")
+
+    def __init__(self, content_type, etag, data, gzip=None):
+        self.content_type = content_type
+        self.etag = etag
+
+        #: The offset and size of the data, and of its gzip variant (if any)
+        self.data = tuple(data)
+        self.gzip = gzip and tuple(gzip)
+
+
+class Archive:
+    """A memory-mapped archive written by :func:`write_archive`.
+
+    The files are returned as slices of the mapped archive. WSGI requires
+    responses to consist of bytes, so the slices are copied once, unless
+    ``zero_copy`` is true (for servers accepting any bytes-like object).
+
+    """
+
+    def __init__(self, path, zero_copy=False):
+        self.path = path
+        self.zero_copy = zero_copy
+
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.mmap[:4] != MAGIC:
+            raise ValueError(f"{path} is not an archive")
+
+        length = struct.unpack(">I", self.mmap[4:8])[0]
+        index = json.loads(self.mmap[8 : 8 + length].decode("utf-8"))
+
+        self.start = 8 + length
+        self.view = memoryview(self.mmap)
+
+        #: The :class:`ArchivedFile` objects keyed by their path
+        self.files = {path: ArchivedFile(**entry) for path, entry in index.items()}
+
+    def body(self, location):
+        """Returns the data at the given location (offset and size)."""
+
+        offset, size = location
+        data = self.view[self.start + offset : self.start + offset + size]
+
+        return data if self.zero_copy else data.tobytes()
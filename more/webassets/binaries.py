@@ -0,0 +1,126 @@
+"""Publishes binary files (images, fonts) under content-hashed names.
+
+Binary files are not bundled. Instead, each file is copied to the output
+directory under a name containing the hash of its content (for example
+``logo.png`` becomes ``logo.1a2b3c4d.png``). As the name changes with the
+content, the files may be cached forever, like the bundles.
+
+Stylesheets refer to those files through ``url(...)``. The references to
+registered binary files are rewritten to the hashed names when the css
+bundles are built (see :class:`more.webassets.filters.HashedUrlFilter`).
+
+"""
+
+import os.path
+import re
+import shutil
+import threading
+
+from more.webassets.tweens import file_signature
+from more.webassets.versions import hash_file
+
+
+#: Matches the url(...) references in stylesheets
+URL = re.compile(r"""url\(\s*(['"]?)([^'"()\s]+)\1\s*\)""")
+
+
+def hashed_name(path, digest, length=8):
+    """Returns the name of the given file with the digest in front of the
+    extension.
+
+    """
+
+    stem, extension = os.path.splitext(os.path.basename(path))
+    return f"{stem}.{digest[:length]}{extension}"
+
+
+class HashedFiles:
+    """Copies the given binary files to the directory under hashed names.
+
+    The files are copied when their name is first requested and again if
+    their content changes. The ``hash`` function returns the hex digest of a
+    file (for example :meth:`more.webassets.versions.VersionCache.hash`).
+
+    """
+
+    def __init__(self, directory, paths, hash=hash_file):
+        self.directory = directory
+        self.paths = tuple(paths)
+        self.known = frozenset(self.paths)
+        self.hash = hash
+        self.lock = threading.Lock()
+
+        #: The hashed name and signature of each file, keyed by path
+        self.cache = {}
+
+        #: The paths of the files, keyed by their basename (the name under
+        #: which they are registered as assets)
+        self.by_basename = {os.path.basename(p): p for p in reversed(self.paths)}
+
+    def name(self, path):
+        """Returns the hashed name of the given file, copying it if needed."""
+
+        signature = file_signature(path)
+        cached = self.cache.get(path)
+
+        if cached and cached[1] == signature:
+            return cached[0]
+
+        name = hashed_name(path, self.hash(path))
+        target = os.path.join(self.directory, name)
+
+        with self.lock:
+            # the name changes with the content, existing copies are current
+            if not os.path.isfile(target):
+                os.makedirs(self.directory, exist_ok=True)
+                shutil.copyfile(path, f"{target}.{os.getpid()}.tmp")
+                os.replace(f"{target}.{os.getpid()}.tmp", target)
+
+            self.cache[path] = (name, signature)
+
+        return name
+
+    def names(self):
+        """Returns the hashed names of all files, keyed by path."""
+
+        return {path: self.name(path) for path in self.paths}
+
+    def resolve(self, reference, source_path=None):
+        """Returns the path of the file the given url reference points to.
+
+        Relative references are first looked up relative to the source file
+        and then by their basename. Returns None for absolute urls, data uris
+        and unknown files.
+
+        """
+
+        if ":" in reference or reference.startswith("/"):
+            return None
+
+        reference = reference.split("#")[0].split("?")[0]
+
+        if source_path:
+            path = os.path.normpath(
+                os.path.join(os.path.dirname(source_path), reference)
+            )
+
+            if path in self.known:
+                return path
+
+        return self.by_basename.get(os.path.basename(reference))
+
+    def rewrite(self, css, source_path=None):
+        """Rewrites the url references to known files in the given css."""
+
+        def replace(match):
+            quote, reference = match.groups()
+            path = self.resolve(reference, source_path)
+
+            if path is None:
+                return match.group(0)
+
+            # keep the query and the fragment (e.g. font.eot?#iefix)
+            suffix = reference[len(reference.split("#")[0].split("?")[0]) :]
+            return f"url({quote}{self.name(path)}{suffix}{quote})"
+
+        return URL.sub(replace, css)
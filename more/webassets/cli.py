@@ -0,0 +1,161 @@
+"""The ``more-webassets`` command line tool.
+
+The applications are given as ``module:App`` and are committed before
+running the command. For example::
+
+    more-webassets export myproject.app:App ./public
+    more-webassets report myproject.app:App
+    more-webassets archive myproject.app:App
+    more-webassets snapshot myproject.app:App
+
+"""
+
+import argparse
+import importlib
+import json
+import morepath
+import os
+import sys
+
+
+def load_app(spec):
+    """Imports, commits and instantiates the app given as ``module:App``."""
+
+    module, _, name = spec.partition(":")
+
+    if not name:
+        raise argparse.ArgumentTypeError(f"expected module:App, got {spec}")
+
+    try:
+        app_class = getattr(importlib.import_module(module), name)
+    except (ImportError, AttributeError) as e:
+        raise argparse.ArgumentTypeError(f"could not load {spec}: {e}")
+
+    morepath.commit(app_class)
+
+    return app_class()
+
+
+def check_budgets(registry, report=None):
+    """Checks the budgets of the registry, exiting if one is exceeded."""
+
+    from more.webassets.report import BudgetExceeded, build_report
+    from more.webassets.report import check_budgets
+
+    if not registry.budgets:
+        return
+
+    try:
+        check_budgets(registry, report or build_report(registry))
+    except BudgetExceeded as e:
+        for violation in e.violations:
+            print(violation, file=sys.stderr)
+
+        sys.exit(1)
+
+
+def export_command(args):
+    from more.webassets.manifest import export
+
+    registry = args.app.config.webasset_registry
+    check_budgets(registry)
+
+    manifest = export(registry, args.target)
+
+    for path in sorted(manifest["files"]):
+        print(path)
+
+
+def report_command(args):
+    from more.webassets.report import build_report, format_report
+
+    registry = args.app.config.webasset_registry
+    report = build_report(registry)
+
+    if args.json:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    else:
+        print(format_report(report, registry.budgets))
+
+    check_budgets(registry, report)
+
+
+def archive_command(args):
+    from more.webassets.archive import write_archive
+
+    registry = args.app.config.webasset_registry
+    check_budgets(registry)
+
+    print(write_archive(registry))
+
+
+def snapshot_command(args):
+    from more.webassets.snapshot import write_snapshot
+
+    # the snapshot is created from scratch, not from an existing one
+    previous = os.environ.get("MORE_WEBASSETS_IGNORE_SNAPSHOT")
+    os.environ["MORE_WEBASSETS_IGNORE_SNAPSHOT"] = "1"
+
+    try:
+        registry = load_app(args.app).config.webasset_registry
+    except argparse.ArgumentTypeError as e:
+        print(e, file=sys.stderr)
+        sys.exit(2)
+    finally:
+        if previous is None:
+            del os.environ["MORE_WEBASSETS_IGNORE_SNAPSHOT"]
+        else:
+            os.environ["MORE_WEBASSETS_IGNORE_SNAPSHOT"] = previous
+
+    target = args.target or registry.snapshot_path
+
+    if not target:
+        print("no target given and no webasset_snapshot defined", file=sys.stderr)
+        sys.exit(1)
+
+    snapshot = write_snapshot(registry, target)
+    print(f"{target}: {len(snapshot['results'])} directive results")
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog="more-webassets", description="Manages the webassets of an app."
+    )
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    commands.required = True
+
+    export = commands.add_parser(
+        "export", help="build the bundles and copy them to a directory"
+    )
+    export.add_argument("app", type=load_app, help="the app (module:App)")
+    export.add_argument("target", help="the target directory")
+    export.set_defaults(func=export_command)
+
+    report = commands.add_parser(
+        "report", help="build the bundles and report their size"
+    )
+    report.add_argument("app", type=load_app, help="the app (module:App)")
+    report.add_argument("--json", action="store_true", help="output json")
+    report.set_defaults(func=report_command)
+
+    archive = commands.add_parser(
+        "archive", help="build the bundles and pack them into an archive"
+    )
+    archive.add_argument("app", type=load_app, help="the app (module:App)")
+    archive.set_defaults(func=archive_command)
+
+    snapshot = commands.add_parser(
+        "snapshot", help="store the results of the directives in a snapshot"
+    )
+    snapshot.add_argument("app", help="the app (module:App)")
+    snapshot.add_argument(
+        "target", nargs="?", help="the snapshot file (defaults to the app's)"
+    )
+    snapshot.set_defaults(func=snapshot_command)
+
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    args.func(args)
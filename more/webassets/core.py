@@ -7,6 +7,10 @@ from morepath.core import excview_tween_factory
 from . import directives
 
 
+#: The hints which may be passed to :meth:`IncludeRequest.include`
+HINTS = {"async", "defer", "lazy", "module", "nonblocking"}
+
+
 class IncludeRequest(Request):
     """Adds the ability to include webassets bundles on the request.
 
@@ -30,9 +34,92 @@ class IncludeRequest(Request):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.included_assets = OrderedSet()
+        self.asset_hints = {}
+        self.prefetched_assets = OrderedSet()
+        self.prefetch_hints = {}
+        self.included_profiles = OrderedSet()
+
+    def include(self, resource, *hints, variant=None):
+        """Includes the given resource, optionally with loading hints.
+
+        By default, scripts block the parsing of the page and stylesheets
+        block its rendering. The hints change how the bundles are loaded:
+
+        * ``defer``: the scripts are executed after the page is parsed.
+        * ``async``: the scripts are executed as soon as they are loaded.
+        * ``module``: the scripts are ES modules (deferred by the browser).
+        * ``nonblocking``: the stylesheets do not block the rendering.
+        * ``lazy``: nothing is loaded until a script asks for it::
+
+            moreWebassets.load('editor').then(function() { ... });
+
+        For example::
+
+            request.include('editor', 'lazy')
+            request.include('analytics', 'async')
+
+        If a resource is included multiple times, only the hints given each
+        time are used (a resource included once without ``defer`` is not
+        deferred). The ``module`` hint describes the scripts, so it is kept
+        if it is given once.
+
+        Assets with variants are included in their default variant, unless
+        another one is given::
+
+            request.include('theme', variant='dark')
+
+        """
+
+        unknown = set(hints) - HINTS
+        assert not unknown, f"unknown hints {', '.join(sorted(unknown))}"
+
+        if variant is not None:
+            resource = self.app.config.webasset_registry.variants[resource][variant]
+
+        hints = frozenset(hints)
+
+        if resource in self.included_assets:
+            previous = self.asset_hints[resource]
+            hints = hints & previous | (hints | previous) & {"module"}
 
-    def include(self, resource):
         self.included_assets.add(resource)
+        self.asset_hints[resource] = hints
+
+    def include_profile(self, name):
+        """Includes the given profile (see
+        :class:`more.webassets.directives.WebassetProfile`).
+
+        The tags of a profile are rendered once and reused for all
+        responses, so including a profile costs about as much as a dict
+        lookup. The bundles of profiles are loaded before the bundles of the
+        resources included with :meth:`include`.
+
+        """
+
+        self.included_profiles.add(name)
+
+    def prefetch(self, resource, *hints):
+        """Lets the browser fetch the given resource during idle time.
+
+        Use this for assets needed by the next page. The bundles are not
+        executed or applied. Bundles already included on the current page
+        are not prefetched. Scripts which are ES modules should be passed the
+        ``module`` hint, so they are preloaded as modules::
+
+            request.prefetch('checkout')
+            request.prefetch('checkout-app', 'module')
+
+        """
+
+        assert set(hints) <= {"module"}, "only the module hint is supported"
+
+        hints = frozenset(hints)
+
+        if resource in self.prefetched_assets:
+            hints |= self.prefetch_hints[resource]
+
+        self.prefetched_assets.add(resource)
+        self.prefetch_hints[resource] = hints
 
 
 class WebassetsApp(App):
@@ -40,6 +127,8 @@ class WebassetsApp(App):
 
     request_class = IncludeRequest
 
+    webasset_snapshot = directive(directives.WebassetSnapshot)
+
     webasset_path = directive(directives.WebassetPath)
 
     webasset_output = directive(directives.WebassetOutput)
@@ -48,10 +137,43 @@ class WebassetsApp(App):
 
     webasset_mapping = directive(directives.WebassetMapping)
 
+    webasset_prune = directive(directives.WebassetPrune)
+
+    webasset_legacy_browser = directive(directives.WebassetLegacyBrowser)
+
     webasset_url = directive(directives.WebassetUrl)
 
+    webasset_base_url = directive(directives.WebassetBaseUrl)
+
+    webasset_budget = directive(directives.WebassetBudget)
+
+    webasset_offload = directive(directives.WebassetOffload)
+
+    webasset_service_worker = directive(directives.WebassetServiceWorker)
+
+    webasset_archive = directive(directives.WebassetArchive)
+
     webasset = directive(directives.Webasset)
 
+    webasset_profile = directive(directives.WebassetProfile)
+
+    def reload_webassets(self, wait=False):
+        """Rebuilds the bundles in the background and swaps them in once they
+        are done, without interrupting the requests in the meantime.
+
+        Returns the thread of the reload, or None if no request has been
+        handled yet (then there is nothing to reload). See
+        :mod:`more.webassets.reload`.
+
+        """
+
+        reloader = self.config.webasset_registry.reloader
+
+        if reloader is None:
+            return None
+
+        return reloader.reload(wait=wait)
+
 
 @WebassetsApp.tween_factory(over=excview_tween_factory)
 def webassets_injector_tween(app, handler):
@@ -62,9 +184,62 @@ def webassets_injector_tween(app, handler):
 
     """
 
-    env = app.config.webasset_registry.get_environment()
-
-    injector_tween = InjectorTween(env, handler)
-    publisher_tween = PublisherTween(env, injector_tween)
+    registry = app.config.webasset_registry
+    env = registry.get_environment()
+
+    # the service worker would hide changes in debug mode
+    scope = not env.debug and registry.service_worker or None
+
+    # the filters don't run in debug mode, so both builds are the same
+    if env.debug or not registry.legacy_filters:
+        legacy = None
+    else:
+        legacy = registry.legacy_browser or True
+
+    injector_tween = InjectorTween(
+        env,
+        handler,
+        base_url=registry.base_url,
+        check_interval=env.check_interval,
+        service_worker=scope,
+        legacy=legacy,
+        variants={
+            resource: tuple(resources.values())
+            for resources in registry.variants.values()
+            for resource in resources.values()
+        },
+        profiles=registry.profiles,
+    )
+
+    if scope:
+        from more.webassets.serviceworker import ServiceWorker
+
+        service_worker = ServiceWorker(
+            registry, env, injector_tween.prefix, scope, injector_tween
+        )
+    else:
+        service_worker = None
+
+    if env.debug:
+        archive = None
+    else:
+        from more.webassets.archive import open_archive
+
+        archive = open_archive(env.directory, registry.archive_zero_copy)
+
+    publisher_tween = PublisherTween(
+        env,
+        injector_tween,
+        offload=registry.offload,
+        service_worker=service_worker,
+        archive=archive,
+    )
+
+    if registry.reloader is None:
+        from more.webassets.reload import Reloader
+
+        registry.reloader = Reloader(registry)
+
+    registry.reloader.attach(injector_tween, publisher_tween)
 
     return publisher_tween
@@ -1,11 +1,29 @@
-import atexit
 import inspect
 import os.path
-import shutil
-import tempfile
 
 from dectate import Action
-from webassets import Bundle, Environment
+
+
+#: The headers supported by :class:`WebassetOffload`
+OFFLOAD_HEADERS = ("X-Accel-Redirect", "X-Sendfile")
+
+#: The sizes which may be limited by :class:`WebassetBudget`
+BUDGET_MEASURES = ("raw", "minified", "compressed")
+
+#: Appended to the names of the legacy variants of the assets (see
+#: :class:`WebassetFilter`)
+LEGACY_SUFFIX = ".legacy"
+
+#: Separates the name of an asset from the name of its variant (see
+#: :class:`Webasset`)
+VARIANT_SEPARATOR = "@"
+
+#: The seconds between the checks for changed source files in debug mode,
+#: unless ``MORE_WEBASSETS_CHECK_INTERVAL`` is set
+DEFAULT_CHECK_INTERVAL = 1.0
+
+#: The hints which may be given to :class:`WebassetProfile`
+PROFILE_HINTS = ("async", "defer", "module", "nonblocking")
 
 
 class Asset:
@@ -14,12 +32,14 @@ class Asset:
 
     """
 
-    __slots__ = ("name", "assets", "filters")
+    __slots__ = ("name", "assets", "filters", "chunk_size", "variants")
 
-    def __init__(self, name, assets, filters):
+    def __init__(self, name, assets, filters, chunk_size=None, variants=None):
         self.name = name
         self.assets = assets
         self.filters = filters
+        self.chunk_size = chunk_size
+        self.variants = variants
 
     def __eq__(self, other):
         return (
@@ -63,6 +83,21 @@ class Asset:
             return self.assets[0].split(".")[-1]
 
 
+class Budget:
+    """Represents the size budget of an asset."""
+
+    __slots__ = ("name", "limit", "measure", "warn")
+
+    def __init__(self, name, limit, measure="compressed", warn=False):
+        self.name = name
+        self.limit = limit
+        self.measure = measure
+        self.warn = warn
+
+    def is_exceeded_by(self, size):
+        return size > self.limit
+
+
 class WebassetRegistry:
     """A registry managing webasset bundles registered through directives."""
 
@@ -77,12 +112,46 @@ class WebassetRegistry:
         #: The extension the filter at self.filters[key] produces
         self.filter_product = {}
 
+        #: The extensions whose filters are applied to each file on its own
+        self.incremental = set()
+
+        #: The filters replacing the default filters in the legacy builds
+        #: (see :class:`WebassetFilter`)
+        self.legacy_filters = {}
+
+        #: A function telling legacy browsers apart by their user agent (see
+        #: :class:`WebassetLegacyBrowser`)
+        self.legacy_browser = None
+
+        #: The paths containing third-party files (see :class:`WebassetPath`)
+        self.vendor_paths = set()
+
         #: :class:`Asset` objects keyed by their name
         self.assets = {}
 
-        #: The output path for all bundles (a temporary directory by default)
-        self.output_path = temporary_directory = tempfile.mkdtemp()
-        atexit.register(shutil.rmtree, temporary_directory)
+        #: :class:`Budget` objects keyed by the name of the asset
+        self.budgets = {}
+
+        #: The hints of the profiles, keyed by the name of the profile (see
+        #: :class:`WebassetProfile`)
+        self.profiles = {}
+
+        #: The resources of the variants of each asset, keyed by the name of
+        #: the asset and the name of the variant (see :class:`Webasset`)
+        self.variants = {}
+
+        #: The templates of the variables prepended to the source files of
+        #: the variants, keyed by extension
+        self.preludes = {
+            "less": "@{name}: {value};\n",
+            "sass": "${name}: {value}\n",
+            "scss": "${name}: {value};\n",
+            "styl": "{name} = {value}\n",
+        }
+
+        #: The output path set through :class:`WebassetOutput` (see
+        #: :attr:`output_path`)
+        self._output_path = None
 
         #: A cache of created bundles
         self.cached_bundles = {}
@@ -90,6 +159,21 @@ class WebassetRegistry:
         #: The url passed to the webasset environment
         self.url = "assets"
 
+        #: The absolute url (e.g. of a CDN) used for the injected urls instead
+        #: of the path prefix (None if the bundles are served by the app)
+        self.base_url = None
+
+        #: The scope of the generated service worker (None if disabled)
+        self.service_worker = None
+
+        #: The header and the path prefix used to offload serving bundles to
+        #: the web server in front of the application (None if disabled)
+        self.offload = None
+
+        #: True if the files of the archive are served as slices of the
+        #: mapped archive, without copying them (see :class:`WebassetArchive`)
+        self.archive_zero_copy = False
+
         #: more.webasset only publishes js/css files - other file extensions
         #: need to be compiled into either and mapped accordingly
         self.mapping = {
@@ -103,7 +187,100 @@ class WebassetRegistry:
             "ts": "js",
         }
 
-    def register_path(self, path):
+        #: Files with these extensions (images, fonts) are not bundled, they
+        #: are published as they are under content-hashed names
+        self.binary_extensions = {
+            "avif",
+            "bmp",
+            "eot",
+            "gif",
+            "ico",
+            "jpeg",
+            "jpg",
+            "otf",
+            "png",
+            "svg",
+            "ttf",
+            "webp",
+            "woff",
+            "woff2",
+        }
+
+        #: The directive results loaded from a snapshot, keyed by fingerprint
+        #: (see :mod:`more.webassets.snapshot`)
+        self.snapshot = {}
+
+        #: The results of the directives performed, keyed by fingerprint
+        self.results = {}
+
+        #: The path of the snapshot set through :class:`WebassetSnapshot`
+        self.snapshot_path = None
+
+        #: Removes the unused rules from the stylesheets (see
+        #: :class:`WebassetPrune`)
+        self.pruner = None
+
+        #: The hashed copies of the binary files, created together with the
+        #: environment (see :mod:`more.webassets.binaries`)
+        self.hashed_files = None
+
+        #: Rebuilds the bundles while the app is running, created together
+        #: with the tweens (see :mod:`more.webassets.reload`)
+        self.reloader = None
+
+    @property
+    def output_path(self):
+        """The output path for all bundles.
+
+        Defaults to a temporary directory, which is only created once it is
+        needed. Apps which never build a bundle (e.g. in scripts or tests)
+        don't create it at all.
+
+        """
+
+        if self._output_path is None:
+            import atexit
+            import shutil
+            import tempfile
+
+            self._output_path = tempfile.mkdtemp()
+            atexit.register(shutil.rmtree, self._output_path, True)
+
+        return self._output_path
+
+    @output_path.setter
+    def output_path(self, path):
+        self._output_path = path
+
+    def load_snapshot(self, path):
+        """Loads the directive results stored in the snapshot at the given
+        path (if it exists).
+
+        """
+        from more.webassets.snapshot import read_snapshot
+
+        self.snapshot_path = path
+        self.snapshot = read_snapshot(path)
+
+    def cached_result(self, key, compute):
+        """Returns the stored result for the given fingerprint, or computes
+        it. Either way, the result is recorded for the next snapshot.
+
+        Results with a fingerprint of None are always computed.
+
+        """
+
+        if key is not None and key in self.snapshot:
+            result = self.snapshot[key]
+        else:
+            result = compute()
+
+        if key is not None:
+            self.results[key] = result
+
+        return result
+
+    def register_path(self, path, vendor=False):
         """Registers the given path as a path to be searched for files.
 
         The paths are prepended, so each new path has higher precedence than
@@ -113,21 +290,69 @@ class WebassetRegistry:
         assert os.path.isabs(path), "absolute paths only"
         self.paths.insert(0, os.path.normpath(path))
 
-    def register_filter(self, name, filter, produces=None):
+        if vendor:
+            self.vendor_paths.add(os.path.normpath(path))
+
+    def register_filter(
+        self, name, filter, produces=None, incremental=False, legacy=False
+    ):
         """Registers a filter, overriding any existing filter of the same
         name.
 
+        Legacy filters are only used by the legacy builds. They do not
+        change how the other filters work.
+
         """
+        if legacy:
+            self.legacy_filters[name] = filter
+            self.filter_product.setdefault(name, produces or name)
+            return
+
         self.filters[name] = filter
         self.filter_product[name] = produces or name
 
-    def register_asset(self, name, assets, filters=None):
-        """Registers a new asset."""
+        if incremental:
+            self.incremental.add(name)
+        else:
+            self.incremental.discard(name)
+
+    def register_asset(
+        self, name, assets, filters=None, chunk_size=None, files=None, variants=None
+    ):
+        """Registers a new asset.
+
+        The paths of the files may be passed as a dict (by entry), in which
+        case they are not searched for.
+
+        The variants are passed as a dict of variables by variant name. The
+        first variant is the default, it is registered under the name of the
+        asset. The others are registered as ``asset@variant``.
+
+        """
 
         assert "." not in name, f"asset names may not contain dots ({name})"
 
         # keep track of asset bundles
-        self.assets[name] = Asset(name=name, assets=assets, filters=filters)
+        self.assets[name] = Asset(
+            name=name,
+            assets=assets,
+            filters=filters,
+            chunk_size=chunk_size,
+            variants=variants,
+        )
+
+        if variants:
+            for variant in variants:
+                assert (
+                    variant.replace("-", "").replace("_", "").isalnum()
+                ), f"invalid variant name {variant}"
+
+            self.variants[name] = {
+                variant: index and f"{name}{VARIANT_SEPARATOR}{variant}" or name
+                for index, variant in enumerate(variants)
+            }
+        else:
+            self.variants.pop(name, None)
 
         # and have one additional asset for each file
         for asset in assets:
@@ -135,7 +360,10 @@ class WebassetRegistry:
 
             # files are entries with an extension
             if "." in basename:
-                path = os.path.normpath(self.find_file(asset))
+                if files and asset in files:
+                    path = files[asset]
+                else:
+                    path = os.path.normpath(self.find_file(asset))
 
                 self.assets[basename] = Asset(
                     name=basename, assets=(path,), filters=filters
@@ -143,6 +371,87 @@ class WebassetRegistry:
             else:
                 assert asset in self.assets, f"unknown asset {asset}"
 
+    def register_profile(self, name, assets, hints=()):
+        """Registers a profile, an asset combining the given assets, which
+        is included with the given hints.
+
+        """
+
+        assert (
+            name not in self.assets or name in self.profiles
+        ), f"the profile {name} has the name of an asset"
+
+        self.register_asset(name, assets)
+        self.profiles[name] = frozenset(hints)
+
+    def resources(self, environment):
+        """Returns the names of the resources pages may include (and the
+        names of their assets) for the given environment.
+
+        These are the assets and profiles, the other variants of the assets
+        and the legacy builds of all of them. The assets registered for the
+        files of an asset (see :meth:`register_asset`) are not included,
+        they are built as parts of the latter.
+
+        """
+
+        resources = {}
+
+        for name in self.assets:
+            # only the assets of files have dots in their name
+            if "." in name:
+                continue
+
+            for resource in self.variants.get(name, {None: name}).values():
+                resources[resource] = name
+
+                if f"{resource}{LEGACY_SUFFIX}" in environment:
+                    resources[f"{resource}{LEGACY_SUFFIX}"] = name
+
+        return resources
+
+    def asset_files(self, name):
+        """Returns the paths of all files of the given asset, in order."""
+
+        asset = self.assets[name]
+
+        if asset.is_single_file:
+            # assets consisting of a single file refer to it by name
+            if not os.path.isabs(asset.path):
+                return self.asset_files(os.path.basename(asset.path))
+
+            return [asset.path]
+
+        files = []
+
+        for sub in asset.assets:
+            for path in self.asset_files(sub):
+                if path not in files:
+                    files.append(path)
+
+        return files
+
+    def is_binary(self, name):
+        """Returns True if the given asset consists of binary files only."""
+
+        asset = self.assets[name]
+
+        if asset.is_pure:
+            return asset.extension in self.binary_extensions
+
+        return all(self.is_binary(a) for a in asset.assets)
+
+    def binary_files(self):
+        """Returns the paths of all registered binary files."""
+
+        return tuple(
+            asset.path
+            for asset in self.assets.values()
+            if asset.is_single_file
+            and os.path.isabs(asset.path)
+            and asset.extension in self.binary_extensions
+        )
+
     def find_file(self, name):
         """Searches for the given file by name using the current paths."""
 
@@ -178,34 +487,239 @@ class WebassetRegistry:
 
         return result
 
-    def get_bundles(self, name, filters=None):
-        """Yields all the bundles for the given name (an asset)."""
+    def get_bundles(
+        self, name, filters=None, legacy=False, variant=None, variables=None
+    ):
+        """Yields all the bundles for the given name (an asset).
+
+        If ``legacy`` is true, yields the script bundles of the legacy build.
+
+        If a ``variant`` is given, the variables are prepended to the source
+        files which support them (see :attr:`preludes`). Only the bundles of
+        those files have the variant in their name, the others are shared by
+        all variants. Assets with variants use their default variant if none
+        is given.
+
+        """
+
+        from webassets import Bundle
 
         assert name in self.assets, f"unknown asset {name}"
-        assert self.output_path, "no webasset_output path set"
 
         asset = self.assets[name]
 
+        if variant is None and asset.variants:
+            variant, variables = next(iter(asset.variants.items()))
+
         overriding_filters = self.merge_filters(asset.filters, filters)
         all_filters = self.merge_filters(self.filters, asset.filters, filters)
 
+        if legacy:
+            all_filters = self.merge_filters(all_filters, self.legacy_filters)
+
         if asset.is_pure:
+            # binary files are published as they are
+            if asset.extension in self.binary_extensions:
+                return
+
             if asset.is_single_file:
                 files = (asset.path,)
             else:
-                files = (a.path for a in (self.assets[a] for a in asset.assets))
+                files = tuple(a.path for a in (self.assets[a] for a in asset.assets))
 
             extension = self.mapping.get(asset.extension, asset.extension)
             assert extension in ("js", "css")
 
-            yield Bundle(
-                *files,
-                filters=self.get_asset_filters(asset, all_filters),
-                output=f"{name}.bundle.{extension}",
-            )
+            # stylesheets are the same for all browsers
+            if legacy and extension != "js":
+                return
+
+            bundle_filters = self.get_asset_filters(asset, all_filters)
+            depends = ()
+
+            # point the stylesheets to the hashed binary files
+            if extension == "css" and self.hashed_files:
+                from more.webassets.filters import HashedUrlFilter
+
+                bundle_filters = [HashedUrlFilter(self.hashed_files)] + bundle_filters
+                depends = self.hashed_files.paths
+
+            # the variables go in front of the sources, before any compiler,
+            # the other files are the same for all variants
+            varies = bool(variables) and asset.extension in self.preludes
+
+            if varies:
+                from more.webassets.filters import PreludeFilter
+
+                template = self.preludes[asset.extension]
+                prelude = "".join(
+                    template.format(name=key, value=value)
+                    for key, value in variables.items()
+                )
+                bundle_filters = [PreludeFilter(prelude)] + bundle_filters
+
+            # the stylesheets change with the classes used by the templates
+            if extension == "css" and self.pruner:
+                depends = (*depends, *self.pruner.files())
+
+            # vendor files change less often than the others, so they are
+            # published on their own (see WebassetPath)
+            parts = self.partition_files(files)
+
+            for label, vendor, part in parts:
+                if asset.chunk_size and len(part) > 1:
+                    chunks = self.split_files(part, asset.chunk_size)
+                else:
+                    chunks = (part,)
+
+                for index, chunk in enumerate(chunks, start=1):
+                    segments = [name]
+
+                    if label:
+                        segments.append(label)
+
+                    if len(chunks) > 1:
+                        segments.append(str(index))
+
+                    if varies:
+                        segments.append(variant)
+
+                    if legacy:
+                        segments.append(LEGACY_SUFFIX.lstrip("."))
+
+                    output = ".".join((*segments, f"bundle.{extension}"))
+                    chunk_filters = bundle_filters
+
+                    if extension == "css" and self.pruner:
+                        from more.webassets.filters import PruneFilter
+
+                        chunk_filters = [
+                            *bundle_filters,
+                            PruneFilter(self.pruner, output),
+                        ]
+
+                    bundle = Bundle(
+                        *chunk, filters=chunk_filters, output=output, depends=depends
+                    )
+
+                    # parts and chunks are published on their own (see
+                    # merge_bundles)
+                    bundle.standalone = len(parts) > 1 or len(chunks) > 1
+                    bundle.vendor = vendor
+                    bundle.varies = varies
+
+                    yield bundle
         else:
             for sub in (self.assets[a] for a in asset.assets):
-                yield from self.get_bundles(sub.name, overriding_filters)
+                yield from self.get_bundles(
+                    sub.name, overriding_filters, legacy, variant, variables
+                )
+
+    def is_vendor_file(self, path):
+        """Returns True if the given file is found in a vendor path."""
+
+        if not self.vendor_paths:
+            return False
+
+        path = self.find_file(path)
+
+        return any(
+            path.startswith(os.path.join(vendor_path, ""))
+            for vendor_path in self.vendor_paths
+        )
+
+    def partition_files(self, files):
+        """Partitions the given files into consecutive runs of vendor and
+        other files.
+
+        Returns a tuple of label, vendor flag and files for each run. The
+        label is empty if there is only one run.
+
+        """
+
+        runs = []
+
+        for path in files:
+            vendor = self.is_vendor_file(path)
+
+            if not runs or runs[-1][0] != vendor:
+                runs.append((vendor, []))
+
+            runs[-1][1].append(path)
+
+        if len(runs) == 1:
+            return (("", runs[0][0], tuple(runs[0][1])),)
+
+        counts = {True: 0, False: 0}
+        total = {v: sum(1 for r in runs if r[0] == v) for v in counts}
+        parts = []
+
+        for vendor, run in runs:
+            counts[vendor] += 1
+            label = vendor and "vendor" or "app"
+
+            if total[vendor] > 1:
+                label += str(counts[vendor])
+
+            parts.append((label, vendor, tuple(run)))
+
+        return tuple(parts)
+
+    def split_files(self, files, chunk_size):
+        """Splits the given files into chunks of about the given size
+        (in bytes). Files are never split, so chunks may be larger if a
+        single file is larger than the chunk size.
+
+        """
+
+        chunks = [[]]
+        size = 0
+
+        for path in files:
+            file_size = os.path.getsize(self.find_file(path))
+
+            if chunks[-1] and size + file_size > chunk_size:
+                chunks.append([])
+                size = 0
+
+            chunks[-1].append(path)
+            size += file_size
+
+        return tuple(tuple(chunk) for chunk in chunks)
+
+    def merge_bundles(self, name, bundles, extension):
+        """Merges the bundles of the given extension into as few bundles as
+        possible, keeping their order.
+
+        Bundles marked as ``standalone`` (like the chunks of a bundle) are
+        not merged with others. Neither are bundles of vendor files merged
+        with bundles of other files.
+
+        """
+
+        from webassets import Bundle
+
+        groups = []
+
+        for bundle in bundles:
+            if not bundle.output.endswith(f".{extension}"):
+                continue
+
+            standalone = getattr(bundle, "standalone", False)
+            vendor = getattr(bundle, "vendor", False)
+
+            if standalone or not groups or groups[-1][0] or groups[-1][1] != vendor:
+                groups.append((standalone, vendor, []))
+
+            groups[-1][2].append(bundle)
+
+        for index, (_, _, group) in enumerate(groups, start=1):
+            if len(group) == 1:
+                yield group[0]
+            elif len(groups) == 1:
+                yield Bundle(*group, output=f"{name}.bundle.{extension}")
+            else:
+                yield Bundle(*group, output=f"{name}.{index}.bundle.{extension}")
 
     def get_asset_filters(self, asset, filters):
         """Returns the filters used for the given asset."""
@@ -213,75 +727,161 @@ class WebassetRegistry:
         if not asset.is_pure:
             return None
 
-        def append_filter(item):
-            str_classes = ("".__class__, b"".__class__, "".__class__)
+        def as_chain(item):
+            # lists and tuples are chains of filters, everything else (names
+            # and filter instances) is a single filter
+            if item is None:
+                return []
 
-            if isinstance(item, str_classes):
-                bundle_filters.append(item)
-            else:
-                bundle_filters.extend(item)
+            if isinstance(item, (list, tuple)):
+                return list(item)
 
-        bundle_filters = []
+            return [item]
 
-        if filters.get(asset.extension) is not None:
-            append_filter(filters[asset.extension])
+        bundle_filters = as_chain(filters.get(asset.extension))
 
         # include the filters for the resulting file to produce a chain
         # of filters (for example React JSX -> Javascript -> Minified)
         product = self.filter_product.get(asset.extension)
 
-        if product and product != asset.extension and product in filters:
-            append_filter(filters[product])
+        if product and product != asset.extension:
+            product_filters = as_chain(filters.get(product))
+        else:
+            product_filters = []
+
+        # incremental filters are applied to each file on its own and cached,
+        # the others are applied to the whole bundle (e.g. minifiers)
+        if bundle_filters and asset.extension in self.incremental:
+            from more.webassets.filters import IncrementalFilter
+
+            if product_filters and product in self.incremental:
+                bundle_filters.extend(product_filters)
+                product_filters = []
 
-        return bundle_filters
+            bundle_filters = [IncrementalFilter(bundle_filters)]
 
-    def get_environment(self):
-        """Returns the webassets environment, registering all the bundles."""
+        return bundle_filters + product_filters
+
+    def get_environment(self, directory=None):
+        """Returns the webassets environment, registering all the bundles.
+
+        The bundles are written to the output path, unless another directory
+        is given.
+
+        """
+
+        from more.webassets.versions import CachedHashVersion, VersionCache
+        from webassets import Environment
 
         debug = os.environ.get("MORE_WEBASSETS_DEBUG", "").lower().strip() in (
             "true",
             "1",
         )
 
+        # an invalid interval should not keep the app from starting
+        try:
+            check_interval = float(
+                os.environ.get("MORE_WEBASSETS_CHECK_INTERVAL", DEFAULT_CHECK_INTERVAL)
+            )
+        except ValueError:
+            check_interval = DEFAULT_CHECK_INTERVAL
+
+        directory = directory or self.output_path
+        cache = VersionCache(directory)
+
         env = Environment(
-            directory=self.output_path,
+            directory=directory,
             load_path=self.paths,
             url=self.url,
             debug=debug,
+            versions=CachedHashVersion(cache),
         )
 
+        binary_files = self.binary_files()
+
+        if binary_files:
+            from more.webassets.binaries import HashedFiles
+
+            self.hashed_files = HashedFiles(directory, binary_files, cache.hash)
+        else:
+            self.hashed_files = None
+
+        # the publisher serves the binary files as well
+        env.hashed_files = self.hashed_files
+
+        # the injector checks the sources for changes at this interval
+        env.check_interval = check_interval
+
         for asset in self.assets:
-            bundles = tuple(self.get_bundles(asset))
+            variants = self.assets[asset].variants or {None: None}
+
+            for variant, variables in variants.items():
+                self.register_bundles(env, asset, variant, variables)
 
-            js = tuple(b for b in bundles if b.output.endswith(".js"))
-            css = tuple(b for b in bundles if b.output.endswith(".css"))
+        return env
 
-            if js:
-                js_bundle = (
-                    len(js) == 1 and js[0] or Bundle(*js, output=f"{asset}.bundle.js")
+    def register_bundles(self, env, asset, variant=None, variables=None):
+        """Registers the bundles of the given asset (or of one of its
+        variants) with the environment.
+
+        """
+
+        bundles = tuple(self.get_bundles(asset, variant=variant, variables=variables))
+
+        # assets of binary files only have no bundles
+        if not bundles:
+            return
+
+        name = variant and self.variants[asset][variant] or asset
+
+        def output(extension):
+            # bundles which are the same for all variants are shared by them
+            varies = any(
+                getattr(bundle, "varies", False)
+                for bundle in bundles
+                if bundle.output.endswith(f".{extension}")
+            )
+
+            return varies and f"{asset}.{variant}" or asset
+
+        self.register_chain(
+            env,
+            name,
+            [
+                *self.merge_bundles(output("js"), bundles, "js"),
+                *self.merge_bundles(output("css"), bundles, "css"),
+            ],
+        )
+
+        # the scripts are built a second time with the legacy filters
+        if self.legacy_filters:
+            legacy = tuple(
+                self.get_bundles(
+                    asset, legacy=True, variant=variant, variables=variables
                 )
-            else:
-                js_bundle = None
+            )
+
+            if legacy:
+                merged = f"{output('js')}{LEGACY_SUFFIX}"
 
-            if css:
-                css_bundle = (
-                    len(css) == 1
-                    and css[0]
-                    or Bundle(*css, output=f"{asset}.bundle.css")
+                self.register_chain(
+                    env,
+                    f"{name}{LEGACY_SUFFIX}",
+                    list(self.merge_bundles(merged, legacy, "js")),
                 )
-            else:
-                css_bundle = None
-
-            if js_bundle and css_bundle:
-                js_bundle.next_bundle = asset + "_1"
-                env.register(asset, js_bundle)
-                env.register(asset + "_1", css_bundle)
-            elif js_bundle:
-                env.register(asset, js_bundle)
-            else:
-                env.register(asset, css_bundle)
 
-        return env
+    def register_chain(self, env, name, chain):
+        """Registers the given bundles under the given name, linking each
+        bundle to the next one.
+
+        """
+
+        # the injector follows the chain to find all bundles of the asset
+        for index, bundle in enumerate(chain):
+            if index + 1 < len(chain):
+                bundle.next_bundle = f"{name}_{index + 1}"
+
+            env.register(index and f"{name}_{index}" or name, bundle)
 
 
 class PathMixin:
@@ -292,6 +892,32 @@ class PathMixin:
             return os.path.join(os.path.dirname(self.code_info.path), path)
 
 
+class WebassetSnapshot(Action, PathMixin):
+    """Loads the directive results stored in a snapshot.
+
+    The function returns the path of the snapshot, which is created by
+    ``more-webassets snapshot``::
+
+        @App.webasset_snapshot()
+        def get_snapshot_path():
+            return 'assets/snapshot.json'
+
+    The ``webasset_path`` and ``webasset`` directives which did not change
+    since the snapshot was created then use its results, instead of
+    searching the paths for the files (see :mod:`more.webassets.snapshot`).
+    Missing or outdated snapshots are ignored.
+
+    """
+
+    config = {"webasset_registry": WebassetRegistry}
+
+    def identifier(self, webasset_registry):
+        return self.__class__
+
+    def perform(self, obj, webasset_registry):
+        webasset_registry.load_snapshot(self.absolute_path(obj()))
+
+
 class WebassetPath(Action, PathMixin):
     """Registers a path with more.webassets.
 
@@ -312,10 +938,27 @@ class WebassetPath(Action, PathMixin):
     Therefore paths registered first are searched last and paths registered
     by a parent class are search after paths registered by the child class.
 
+    Paths containing third-party libraries may be marked as vendor paths::
+
+        @App.webasset_path(vendor=True)
+        def get_vendor_path():
+            return 'assets/vendor'
+
+    Vendor files change less often than the application's own files. Assets
+    containing both are published as separate bundles (e.g.
+    ``app.vendor.bundle.js`` and ``app.app.bundle.js``), so the vendor
+    bundle stays cached when the other files change.
+
     """
 
     config = {"webasset_registry": WebassetRegistry}
 
+    # the snapshot is loaded before all other directives
+    depends = [WebassetSnapshot]
+
+    def __init__(self, vendor=False):
+        self.vendor = vendor
+
     def identifier(self, webasset_registry):
         return object()
 
@@ -328,10 +971,19 @@ class WebassetPath(Action, PathMixin):
             )
 
     def perform(self, obj, webasset_registry):
-        path = self.absolute_path(obj())
-        assert os.path.isdir(path), f"'{path}' does not exist"
+        from more.webassets.snapshot import fingerprint
+
+        def resolve():
+            path = self.absolute_path(obj())
+            assert os.path.isdir(path), f"'{path}' does not exist"
+
+            return path
+
+        path = webasset_registry.cached_result(
+            fingerprint(obj, "webasset_path", self.code_info.path), resolve
+        )
 
-        webasset_registry.register_path(self.absolute_path(obj()))
+        webasset_registry.register_path(path, self.vendor)
 
 
 class WebassetOutput(Action, PathMixin):
@@ -375,19 +1027,131 @@ class WebassetFilter(Action):
     into whatever filter is registered for the resulting extension. This can
     be used to chain filters (i.e. Coffeescript -> Javascript -> Minified).
 
+    Filters which work on the whole bundle (like most minifiers and
+    compilers) filter all files again if one of them changes. If the filter
+    gives the same result when applied to each file on its own, it may be
+    marked as ``incremental``::
+
+        @App.webasset_filter('jsx', produces='js', incremental=True)
+        def get_jsx_filter():
+            return 'babel'
+
+        @App.webasset_filter('js')
+        def get_js_filter():
+            return 'rjsmin'
+
+    Each jsx file is then compiled on its own and the result is cached, so
+    only changed files are compiled again. The filters of the produced
+    extension (here the minifier) are still applied to the whole bundle,
+    unless they are marked as incremental as well.
+
+    Filters marked as ``legacy`` are used for a second build of the scripts,
+    meant for browsers without support for ES modules::
+
+        @App.webasset_filter('js')
+        def get_js_filter():
+            return 'rjsmin'
+
+        @App.webasset_filter('js', legacy=True)
+        def get_legacy_js_filter():
+            return ['babel', 'rjsmin']
+
+    The legacy bundles are published next to the others (e.g.
+    ``app.legacy.bundle.js``). Pages load the other bundles as modules and
+    the legacy bundles with ``nomodule``, so each browser runs one of them.
+    If a :class:`WebassetLegacyBrowser` function is defined, the pages
+    contain the variant for the requesting browser only.
+
     """
 
     group_class = WebassetPath
 
-    def __init__(self, name, produces=None):
+    def __init__(self, name, produces=None, incremental=False, legacy=False):
         self.name = name
         self.produces = produces
+        self.incremental = incremental
+        self.legacy = legacy
 
     def identifier(self, webasset_registry):
+        if self.legacy:
+            return self.name, LEGACY_SUFFIX
+
         return self.name
 
     def perform(self, obj, webasset_registry):
-        webasset_registry.register_filter(self.name, obj(), self.produces)
+        webasset_registry.register_filter(
+            self.name, obj(), self.produces, self.incremental, self.legacy
+        )
+
+
+class WebassetLegacyBrowser(Action):
+    """Defines a function which returns True for the user agents of legacy
+    browsers.
+
+    Instead of loading the scripts of both builds (see
+    :class:`WebassetFilter`), the pages then only load the scripts of the
+    requesting browser's build::
+
+        @App.webasset_legacy_browser()
+        def get_legacy_browser():
+            return lambda user_agent: 'Trident/' in user_agent
+
+    The scripts are loaded as usual, not as modules. The results of the
+    function are cached by user agent.
+
+    """
+
+    group_class = WebassetPath
+
+    def identifier(self, webasset_registry):
+        return self.__class__
+
+    def perform(self, obj, webasset_registry):
+        webasset_registry.legacy_browser = obj()
+
+
+class WebassetPrune(Action, PathMixin):
+    """Removes the css rules which match nothing in the templates.
+
+    The function returns the directories (or files) to scan for class and
+    id names, relative to the code file. Names which are not found in the
+    templates, like the ones created at runtime, may be allowed as names or
+    glob patterns::
+
+        @App.webasset_prune(allow=('is-*', 'js-*'))
+        def get_prune_paths():
+            return ('templates', 'views')
+
+    Files with one of the given ``extensions`` are scanned (by default html,
+    Chameleon, Jinja2, Mako, xml, javascript and python files). The bytes
+    saved are part of the weight report (see :mod:`more.webassets.pruning`).
+
+    Like all filters, the pruning does not happen in debug mode.
+
+    """
+
+    group_class = WebassetPath
+
+    def __init__(self, allow=(), extensions=None):
+        self.allow = tuple(allow)
+        self.extensions = extensions
+
+    def identifier(self, webasset_registry):
+        return self.__class__
+
+    def perform(self, obj, webasset_registry):
+        from more.webassets.pruning import PRUNE_EXTENSIONS, Pruner
+
+        paths = obj()
+
+        if isinstance(paths, str):
+            paths = (paths,)
+
+        webasset_registry.pruner = Pruner(
+            [self.absolute_path(path) for path in paths],
+            self.allow,
+            self.extensions or PRUNE_EXTENSIONS,
+        )
 
 
 class WebassetMapping(Action):
@@ -443,6 +1207,170 @@ class WebassetUrl(Action):
         webasset_registry.url = obj()
 
 
+class WebassetBaseUrl(Action):
+    """Defines an absolute url prepended to the injected bundle urls.
+
+    Use this to have the bundles loaded from a CDN or an object store which
+    mirrors the exported bundles (see :func:`more.webassets.manifest.export`)::
+
+        @App.webasset_base_url()
+        def get_webasset_base_url():
+            return 'https://cdn.example.org'
+
+    The injected urls then look like this::
+
+        https://cdn.example.org/assets/jquery.bundle.js?1234
+
+    The bundles are still served by the application under the path defined
+    through :class:`WebassetUrl`, which may be used by the CDN as origin.
+
+    """
+
+    group_class = WebassetPath
+
+    def identifier(self, webasset_registry):
+        return self.__class__
+
+    def perform(self, obj, webasset_registry):
+        webasset_registry.base_url = obj()
+
+
+class WebassetBudget(Action):
+    """Defines the maximum size of an asset in bytes.
+
+    Budgets are checked when the weight report is created or the bundles are
+    exported (see :mod:`more.webassets.report`). By default, the compressed
+    (gzip) size of the asset is limited and exceeding it is an error::
+
+        @App.webasset_budget('vendor')
+        def get_vendor_budget():
+            return 200 * 1024
+
+    The ``measure`` may also be ``raw`` (the size of the source files) or
+    ``minified`` (the size of the bundles). Budgets with ``warn=True`` only
+    lead to a warning::
+
+        @App.webasset_budget('widgets', measure='minified', warn=True)
+        def get_widgets_budget():
+            return 500 * 1024
+
+    """
+
+    group_class = WebassetPath
+
+    def __init__(self, name, measure="compressed", warn=False):
+        assert measure in BUDGET_MEASURES, f"unknown measure {measure}"
+
+        self.name = name
+        self.measure = measure
+        self.warn = warn
+
+    def identifier(self, webasset_registry):
+        return self.__class__, self.name
+
+    def perform(self, obj, webasset_registry):
+        webasset_registry.budgets[self.name] = Budget(
+            self.name, obj(), self.measure, self.warn
+        )
+
+
+class WebassetOffload(Action):
+    """Lets the web server in front of the application send the bundles.
+
+    Instead of reading the bundles and returning them, the publisher returns
+    an empty response with a header telling the web server which file to
+    send. Supported are ``X-Accel-Redirect`` (nginx, the default) and
+    ``X-Sendfile`` (Apache, lighttpd).
+
+    The function returns the prefix under which the output directory is
+    available to the web server. For nginx this is an internal location::
+
+        @App.webasset_offload()
+        def get_offload_prefix():
+            return '/internal-assets'
+
+        # location /internal-assets/ {
+        #     internal;
+        #     alias /path/to/assets/bundles/;
+        # }
+
+    For X-Sendfile the prefix is a path on the filesystem. If the function
+    returns None, the output directory is used::
+
+        @App.webasset_offload('X-Sendfile')
+        def get_offload_prefix():
+            return None
+
+    The publisher still makes sure that only published files are requested
+    and it still sets the cache headers.
+
+    """
+
+    group_class = WebassetPath
+
+    def __init__(self, header="X-Accel-Redirect"):
+        assert header in OFFLOAD_HEADERS, f"unknown offload header {header}"
+        self.header = header
+
+    def identifier(self, webasset_registry):
+        return self.__class__
+
+    def perform(self, obj, webasset_registry):
+        webasset_registry.offload = (self.header, obj())
+
+
+class WebassetServiceWorker(Action):
+    """Generates a service worker which precaches the bundles.
+
+    The function returns the scope of the service worker (the pages it
+    controls)::
+
+        @App.webasset_service_worker()
+        def get_service_worker_scope():
+            return '/'
+
+    The worker is served under the webasset url (e.g.
+    ``/assets/service-worker.js``) and registered by the injected pages. It
+    answers requests for the bundles from its cache, so repeated visits don't
+    request them at all (see :mod:`more.webassets.serviceworker`).
+
+    The worker is neither served nor registered in debug mode.
+
+    """
+
+    group_class = WebassetPath
+
+    def identifier(self, webasset_registry):
+        return self.__class__
+
+    def perform(self, obj, webasset_registry):
+        webasset_registry.service_worker = obj() or "/"
+
+
+class WebassetArchive(Action):
+    """Configures how the files of the archive written by
+    ``more-webassets archive`` are served (see :mod:`more.webassets.archive`).
+
+    WSGI requires the body of a response to consist of bytes, so the files
+    are copied out of the mapped archive for each response. Servers which
+    accept any bytes-like object may be passed slices of the archive
+    instead, without copying them. The function returns True in that case::
+
+        @App.webasset_archive()
+        def get_zero_copy():
+            return True
+
+    """
+
+    group_class = WebassetPath
+
+    def identifier(self, webasset_registry):
+        return self.__class__
+
+    def perform(self, obj, webasset_registry):
+        webasset_registry.archive_zero_copy = bool(obj())
+
+
 class Webasset(Action):
     """Registers an asset which may then be included in the page.
 
@@ -486,6 +1414,41 @@ class Webasset(Action):
             yield 'react'
             yield 'widget.jsx'
 
+    Large bundles may be split into chunks of about the given size in bytes
+    (of the source files). The chunks are published and injected in order,
+    so they may be downloaded in parallel and a change only invalidates the
+    chunk containing the changed file::
+
+        @App.webasset('app', chunk_size=200 * 1024)
+        def get_app_asset():
+            yield 'router.js'
+            yield 'views.js'
+            yield 'widgets.js'
+
+    Files are never split. Chunks only keep their order if the scripts are
+    not included with the ``async`` hint.
+
+    Assets may be built in multiple variants (e.g. themes), each with its
+    own variables. The variables are prepended to the sass, scss, less and
+    stylus files of the asset, before they are compiled::
+
+        @App.webasset('theme', variants={
+            'light': {'background': 'white'},
+            'dark': {'background': 'black'},
+        })
+        def get_theme_asset():
+            yield 'theme.scss'
+
+    A list of names sets a single variable (``$variant: dark;``). The first
+    variant is the default, the others are chosen when the asset is
+    included (see :meth:`more.webassets.core.IncludeRequest.include`)::
+
+        request.include('theme', variant='dark')
+
+    The variants are built together, in parallel. The bundles they share
+    (e.g. the scripts) are only built once, and variants using filters
+    which change the working directory (e.g. pyscss) take turns.
+
     Note that webassets may not contain path separators. You're supposed to
     register all paths which should be searched, and then you only work
     with filenames.
@@ -501,15 +1464,89 @@ class Webasset(Action):
     ]
     group_class = WebassetPath
 
-    def __init__(self, name, filters=None):
+    def __init__(self, name, filters=None, chunk_size=None, variants=None):
         self.name = name
         self.filters = filters
+        self.chunk_size = chunk_size
+
+        if variants is not None and not isinstance(variants, dict):
+            variants = {variant: {"variant": variant} for variant in variants}
+
+        self.variants = variants
 
     def identifier(self, webasset_registry):
         return self.name
 
     def perform(self, obj, webasset_registry):
+        from more.webassets.snapshot import fingerprint
+
         assert inspect.isgeneratorfunction(obj), "webasset expects a generator"
+
+        def resolve():
+            assets = tuple(asset for asset in obj())
+            files = {
+                asset: os.path.normpath(webasset_registry.find_file(asset))
+                for asset in assets
+                if "." in os.path.basename(asset)
+            }
+
+            return {"assets": list(assets), "files": files}
+
+        # the files found depend on the registered paths
+        result = webasset_registry.cached_result(
+            fingerprint(obj, "webasset", self.name, tuple(webasset_registry.paths)),
+            resolve,
+        )
+
         webasset_registry.register_asset(
-            self.name, tuple(asset for asset in obj()), self.filters
+            self.name,
+            tuple(result["assets"]),
+            self.filters,
+            self.chunk_size,
+            result["files"],
+            self.variants,
         )
+
+
+class WebassetProfile(Action):
+    """Registers a profile, a set of assets which many pages include.
+
+    For example::
+
+        @App.webasset_profile('default', 'defer')
+        def get_default_profile():
+            yield 'jquery'
+            yield 'common'
+            yield 'theme'
+
+    The assets of a profile are combined into as few bundles as possible
+    (usually one for the scripts and one for the stylesheets) and the tags
+    loading them are only rendered once. Pages include the profile with
+    :meth:`more.webassets.core.IncludeRequest.include_profile`::
+
+        request.include_profile('default')
+
+    The hints given to the directive apply to all bundles of the profile.
+    Profiles are registered after all assets, their names may not be used
+    by any asset.
+
+    """
+
+    config = {"webasset_registry": WebassetRegistry}
+
+    depends = [WebassetPath]
+
+    def __init__(self, name, *hints):
+        unknown = set(hints) - set(PROFILE_HINTS)
+        assert not unknown, f"unknown hints {', '.join(sorted(unknown))}"
+
+        self.name = name
+        self.hints = hints
+
+    def identifier(self, webasset_registry):
+        return self.name
+
+    def perform(self, obj, webasset_registry):
+        assert inspect.isgeneratorfunction(obj), "webasset_profile expects a generator"
+
+        webasset_registry.register_profile(self.name, tuple(obj()), self.hints)
@@ -0,0 +1,170 @@
+"""Filters used by more.webassets to build the bundles."""
+
+import hashlib
+
+from webassets.filter import Filter, get_filter
+from webassets.merge import FilterTool, MemoryHunk
+
+
+class IncrementalFilter(Filter):
+    """Applies a chain of filters to each file of a bundle on its own.
+
+    Webassets applies the ``output`` method of a filter to the whole bundle,
+    so changing a single file leads to the whole bundle being filtered again.
+    This filter runs the complete chain (``input`` and ``output`` methods)
+    for each file as an ``input`` filter and caches the result, keyed by the
+    content and the path of the file and the chain of filters (some filters
+    depend on the path, e.g. to rewrite relative urls). Rebuilding a bundle
+    therefore only filters the files which changed.
+
+    The results are stored in the cache of the environment. If the cache is
+    disabled, they are kept in memory.
+
+    """
+
+    name = "incremental"
+
+    def __init__(self, filters):
+        super().__init__()
+        self.filters = [get_filter(f) for f in filters]
+        self.memory = {}
+
+    def unique(self):
+        return tuple(f.id() for f in self.filters)
+
+    def set_context(self, ctx):
+        super().set_context(ctx)
+
+        for f in self.filters:
+            f.set_context(ctx)
+
+    def setup(self):
+        super().setup()
+
+        for f in self.filters:
+            f.setup()
+
+    @property
+    def cache(self):
+        return self.ctx and self.ctx.cache or None
+
+    def get_additional_cache_keys(self, **kwargs):
+        # the results depend on the path, so do the ones cached by webassets
+        return [kwargs.get("source_path"), kwargs.get("output_path")]
+
+    def input(self, _in, out, **kwargs):
+        data = _in.read()
+        key = (
+            "incremental",
+            self.unique(),
+            hashlib.sha1(data.encode("utf-8")).hexdigest(),
+            *self.get_additional_cache_keys(**kwargs),
+        )
+
+        result = self.cache.get(key) if self.cache else self.memory.get(key)
+
+        if result is None:
+            result = self.apply(data, kwargs)
+
+            if self.cache:
+                self.cache.set(key, result)
+            else:
+                self.memory[key] = result
+
+        out.write(result)
+
+    def apply(self, data, kwargs):
+        """Runs the whole chain on the given data (uncached)."""
+
+        tool = FilterTool(cache=None, kwargs=kwargs)
+        hunk = MemoryHunk(data)
+
+        for method in ("input", "output"):
+            hunk = tool.apply(hunk, self.filters, method)
+
+        return hunk.data()
+
+
+class HashedUrlFilter(Filter):
+    """Rewrites the ``url(...)`` references to binary files in stylesheets.
+
+    References to the files of the given
+    :class:`more.webassets.binaries.HashedFiles` are replaced by their hashed
+    names. As the bundles and the hashed files share the output directory,
+    the references are relative to the bundle.
+
+    """
+
+    name = "hashed_urls"
+
+    def __init__(self, files):
+        super().__init__()
+        self.files = files
+
+    def unique(self):
+        # the bundles change if the content of the referenced files changes
+        return tuple(sorted(self.files.names().items()))
+
+    def input(self, _in, out, source_path=None, **kwargs):
+        out.write(self.files.rewrite(_in.read(), source_path))
+
+
+class PreludeFilter(Filter):
+    """Prepends the given prelude to each file (e.g. the variables of a
+    variant of an asset).
+
+    Run as an ``input`` filter in front of the compiler, so each file is
+    compiled with the prelude.
+
+    """
+
+    name = "prelude"
+
+    def __init__(self, prelude):
+        super().__init__()
+        self.prelude = prelude
+
+    def unique(self):
+        return self.prelude
+
+    def input(self, _in, out, **kwargs):
+        out.write(self.prelude)
+        out.write(_in.read())
+
+
+class PruneFilter(Filter):
+    """Removes the unused rules from a css bundle (see
+    :mod:`more.webassets.pruning`).
+
+    Runs as an ``output`` filter, after the stylesheets have been compiled.
+    The bytes saved are recorded under the given name of the bundle.
+
+    """
+
+    name = "prune"
+
+    def __init__(self, pruner, bundle):
+        super().__init__()
+        self.pruner = pruner
+        self.bundle = bundle
+
+    def unique(self):
+        # the bundle changes if the words in the templates change
+        words = "\n".join(sorted(self.pruner.words()))
+        digest = hashlib.sha1(words.encode("utf-8")).hexdigest()
+
+        return self.bundle, self.pruner.allow, digest
+
+    def output(self, _in, out, **kwargs):
+        css = _in.read()
+        pruned = self.pruner.prune(css)
+
+        if self.ctx and self.ctx.directory:
+            self.pruner.record(
+                self.ctx.directory,
+                self.bundle,
+                len(css.encode("utf-8")),
+                len(pruned.encode("utf-8")),
+            )
+
+        out.write(pruned)
@@ -0,0 +1,123 @@
+"""Build manifests describe the bundles of an environment once they are built.
+
+A manifest is a json file stored in the output directory. It contains the
+url prefix of the environment, the urls of each resource pages may include
+(see :meth:`more.webassets.directives.WebassetRegistry.resources`) and the
+files which may be published, together with their version and size::
+
+    {
+        "url": "assets",
+        "assets": {
+            "common": ["assets/common.bundle.js?ddc71aa3"]
+        },
+        "files": {
+            "common.bundle.js": {"version": "ddc71aa3", "size": 39}
+        }
+    }
+
+"""
+
+import json
+import os.path
+import shutil
+
+from more.webassets.tweens import bundle_urls, published_files, save_versions
+
+
+#: The name of the manifest file inside the output directory
+MANIFEST = "manifest.json"
+
+
+def build_manifest(registry, environment):
+    """Builds all the assets of the registry and returns the manifest."""
+
+    # all resources pages may include are built, including the variants and
+    # the legacy builds (assets of binary files only have no bundles)
+    assets = {
+        resource: bundle_urls(environment, resource)
+        for resource in registry.resources(environment)
+        if resource in environment
+    }
+    versions = {}
+
+    for urls in assets.values():
+        for url in urls:
+            path, _, version = url.partition("?")
+            versions[path] = version
+
+    prefix = environment.url.strip("/") + "/"
+    files = {}
+
+    for path in sorted(published_files(environment)):
+        target = os.path.join(environment.directory, path)
+
+        if not os.path.isfile(target):
+            continue
+
+        files[path] = {
+            "version": versions.get(prefix + path, ""),
+            "size": os.path.getsize(target),
+        }
+
+    save_versions(environment)
+
+    return {"url": environment.url, "assets": assets, "files": files}
+
+
+def write_manifest(manifest, directory):
+    """Writes the manifest to the given directory, returning its path."""
+
+    path = os.path.join(directory, MANIFEST)
+
+    # write to a temporary file first, so readers never see half a manifest
+    temporary = f"{path}.{os.getpid()}.tmp"
+
+    with open(temporary, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    os.replace(temporary, path)
+
+    return path
+
+
+def read_manifest(path):
+    """Reads the manifest at the given path (either the file itself or the
+    directory containing it).
+
+    """
+
+    if os.path.isdir(path):
+        path = os.path.join(path, MANIFEST)
+
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def export(registry, target):
+    """Builds all the assets of the registry and copies the published files
+    and the manifest to the given target directory.
+
+    The files are stored below the url of the environment, so the target
+    directory may be synced as is to an object store or a CDN origin::
+
+        target/assets/common.bundle.js
+        target/assets/manifest.json
+
+    Returns the manifest.
+
+    """
+
+    environment = registry.get_environment()
+    manifest = build_manifest(registry, environment)
+
+    directory = os.path.join(target, environment.url.strip("/"))
+    os.makedirs(directory, exist_ok=True)
+
+    for path in manifest["files"]:
+        destination = os.path.join(directory, path)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.copy2(os.path.join(environment.directory, path), destination)
+
+    write_manifest(manifest, directory)
+
+    return manifest
@@ -0,0 +1,355 @@
+"""Removes the css rules whose selectors match nothing in the templates.
+
+The templates (and the Python sources rendering them) are scanned for
+words. A selector which refers to a class or an id which is not among those
+words cannot match any element rendered by the application, so it is
+removed. Rules without any remaining selector are removed as well::
+
+    @App.webasset_prune(allow=('is-*', 'js-*'))
+    def get_prune_paths():
+        return ('templates', 'views')
+
+Classes which are created at runtime (e.g. by concatenating strings) are
+not found by the scan, they have to be allowed explicitly (as names or as
+glob patterns).
+
+The rules are parsed with a small tokenizer which understands comments,
+strings, nested blocks and escaped names. Rules of at-rules other than
+``@media``, ``@supports``, ``@layer``, ``@container`` and ``@document``
+(e.g. ``@font-face`` or ``@keyframes``) are kept as they are. Selectors
+with classes or ids in functional pseudo-classes (e.g. ``:not(.hidden)``)
+only need the classes and ids outside of those to be found.
+
+The bytes saved for each bundle are written to ``pruning.json`` in the
+output directory, they are part of the weight report.
+
+"""
+
+import fnmatch
+import json
+import os.path
+import re
+import threading
+
+from more.webassets.tweens import file_signature
+
+
+#: The extensions of the files scanned for class and id names
+PRUNE_EXTENSIONS = (
+    ".htm",
+    ".html",
+    ".j2",
+    ".jinja2",
+    ".js",
+    ".mako",
+    ".pt",
+    ".py",
+    ".xml",
+)
+
+#: The at-rules containing style rules, which are pruned as well
+NESTING_AT_RULES = {"container", "document", "layer", "media", "supports"}
+
+#: The name of the file holding the bytes saved per bundle
+PRUNING_REPORT = "pruning.json"
+
+#: The words of the scanned files, with and without the variant prefixes
+#: of utility classes (e.g. 'md:flex' and 'w-1/2')
+WORDS = re.compile(r"[\w-]+")
+UTILITY_WORDS = re.compile(r"[\w\-:/.]+")
+
+#: The class and id names referenced by a selector
+NAMES = re.compile(r"([.#])((?:[\w-]|\\.)+)")
+
+#: Escaped characters in names (e.g. 'md\:flex')
+ESCAPE = re.compile(r"\\(.)")
+
+
+def strip_comments(css):
+    """Removes the comments from the given css (but not from strings)."""
+
+    result = []
+    index = 0
+    quote = None
+
+    while index < len(css):
+        char = css[index]
+
+        if quote:
+            if char == "\\":
+                result.append(css[index : index + 2])
+                index += 2
+                continue
+
+            if char == quote:
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif css.startswith("/*", index):
+            end = css.find("*/", index + 2)
+            index = len(css) if end == -1 else end + 2
+            continue
+
+        result.append(char)
+        index += 1
+
+    return "".join(result)
+
+
+def split_rules(css):
+    """Yields the top-level statements of the given css (without comments).
+
+    Rules are yielded as tuples of prelude and block content, statements
+    without block (e.g. ``@import``) with a block content of None.
+
+    """
+
+    index = 0
+    start = 0
+    depth = 0
+    quote = None
+    prelude = None
+
+    while index < len(css):
+        char = css[index]
+
+        if quote:
+            if char == "\\":
+                index += 1
+            elif char == quote:
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif char == "{":
+            if depth == 0:
+                prelude = css[start:index]
+                start = index + 1
+
+            depth += 1
+        elif char == "}":
+            depth -= 1
+
+            if depth == 0:
+                yield prelude, css[start:index]
+                start = index + 1
+            elif depth < 0:
+                depth = 0
+                start = index + 1
+        elif char == ";" and depth == 0:
+            yield css[start : index + 1], None
+            start = index + 1
+
+        index += 1
+
+    if css[start:].strip():
+        yield css[start:], None
+
+
+def split_selectors(prelude):
+    """Splits the given selector list at the commas outside of parentheses
+    and brackets.
+
+    """
+
+    selectors = []
+    depth = 0
+    start = 0
+
+    for index, char in enumerate(prelude):
+        if char in "([":
+            depth += 1
+        elif char in ")]":
+            depth -= 1
+        elif char == "," and depth == 0:
+            selectors.append(prelude[start:index])
+            start = index + 1
+
+    selectors.append(prelude[start:])
+
+    return [selector.strip() for selector in selectors]
+
+
+def without_arguments(selector):
+    """Removes the parts of the selector in parentheses and brackets."""
+
+    result = []
+    depth = 0
+
+    for char in selector:
+        if char in "([":
+            depth += 1
+        elif char in ")]":
+            depth -= 1
+        elif depth == 0:
+            result.append(char)
+
+    return "".join(result)
+
+
+def selector_names(selector):
+    """Returns the class and id names the given selector requires."""
+
+    return {
+        ESCAPE.sub(r"\1", name)
+        for _, name in NAMES.findall(without_arguments(selector))
+    }
+
+
+def prune_css(css, keep):
+    """Returns the given css without the selectors referring to class or id
+    names for which ``keep`` returns False.
+
+    """
+
+    def prune(css):
+        rules = []
+
+        for prelude, block in split_rules(css):
+            if block is None:
+                rules.append(prelude.strip())
+                continue
+
+            prelude = prelude.strip()
+
+            if prelude.startswith("@"):
+                name = prelude[1:].split(None, 1)[0].split("(")[0].lower()
+
+                if name in NESTING_AT_RULES:
+                    block = prune(block)
+
+                    if not block:
+                        continue
+
+                rules.append(f"{prelude}{{{block}}}")
+                continue
+
+            selectors = split_selectors(prelude)
+            kept = [s for s in selectors if all(map(keep, selector_names(s)))]
+
+            if not kept:
+                continue
+
+            if len(kept) < len(selectors):
+                prelude = ",".join(kept)
+
+            rules.append(f"{prelude}{{{block}}}")
+
+        return "\n".join(rule for rule in rules if rule)
+
+    return prune(strip_comments(css))
+
+
+class Pruner:
+    """Collects the words of the files in the given paths and decides which
+    class and id names to keep.
+
+    The ``allow`` patterns are names or glob patterns of names which are
+    always kept. The files are scanned again if they change.
+
+    """
+
+    def __init__(self, paths, allow=(), extensions=PRUNE_EXTENSIONS):
+        self.paths = tuple(paths)
+        self.allow = tuple(allow)
+        self.extensions = tuple(extensions)
+        self.lock = threading.Lock()
+
+        #: The words of each scanned file, together with its signature
+        self.cache = {}
+
+        patterns = "|".join(fnmatch.translate(p) for p in self.allow)
+        self.allowed = re.compile(patterns).match if patterns else None
+
+    def files(self):
+        """Returns the paths of all files to scan."""
+
+        files = []
+
+        for path in self.paths:
+            if os.path.isfile(path):
+                files.append(path)
+                continue
+
+            for root, directories, names in os.walk(path):
+                directories.sort()
+
+                for name in sorted(names):
+                    if name.endswith(self.extensions):
+                        files.append(os.path.join(root, name))
+
+        return files
+
+    def scan(self, path):
+        """Returns the words found in the given file."""
+
+        signature = file_signature(path)
+        cached = self.cache.get(path)
+
+        if cached and cached[0] == signature:
+            return cached[1]
+
+        with open(path, encoding="utf-8", errors="replace") as f:
+            text = f.read()
+
+        words = frozenset(WORDS.findall(text)) | frozenset(UTILITY_WORDS.findall(text))
+
+        with self.lock:
+            self.cache[path] = (signature, words)
+
+        return words
+
+    def words(self):
+        """Returns the words found in all files."""
+
+        words = set()
+
+        for path in self.files():
+            words |= self.scan(path)
+
+        return words
+
+    def keep(self, words=None):
+        """Returns a function which returns True for names to keep."""
+
+        words = self.words() if words is None else words
+        allowed = self.allowed
+
+        def keep(name):
+            return name in words or bool(allowed and allowed(name))
+
+        return keep
+
+    def prune(self, css, words=None):
+        """Returns the given css without the unused rules."""
+
+        return prune_css(css, self.keep(words))
+
+    def record(self, directory, bundle, original, pruned):
+        """Records the bytes saved by pruning the given bundle."""
+
+        path = os.path.join(directory, PRUNING_REPORT)
+
+        with self.lock:
+            report = read_pruning_report(directory)
+            report[bundle] = {"original": original, "pruned": pruned}
+
+            os.makedirs(directory, exist_ok=True)
+            temporary = f"{path}.{os.getpid()}.tmp"
+
+            with open(temporary, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+
+            os.replace(temporary, path)
+
+
+def read_pruning_report(directory):
+    """Returns the bytes saved per bundle by the pruning done when the
+    bundles in the given directory were built.
+
+    """
+
+    try:
+        with open(os.path.join(directory, PRUNING_REPORT), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
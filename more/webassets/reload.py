@@ -0,0 +1,236 @@
+"""Rebuilds the bundles while the app is running, without downtime.
+
+A reload creates a new environment writing to a new directory below the
+output path (``releases/<pid>-<n>``) and builds all its bundles in a
+background thread. Requests are served by the current environment in the meantime.
+Once the build is done, the new environment is swapped into the tweens::
+
+    app.reload_webassets()
+
+The files of the previous environment are still served for a grace period,
+so pages rendered just before the swap can load the bundles they refer to.
+The directory of the previous environment is removed after that period, by
+the next reload.
+
+The directories left behind by processes which are no longer running are
+removed by the first reload of each process.
+
+The publishers switch to the current archive of the output path as well
+(see :mod:`more.webassets.archive`), so ``more-webassets archive`` followed
+by a reload puts a new archive into use.
+
+Reloads may be triggered by a signal as well (``SIGHUP`` by default)::
+
+    from more.webassets.reload import reload_on_signal
+    reload_on_signal(app)
+
+"""
+
+import os.path
+import shutil
+import signal
+import threading
+import time
+
+from more.webassets.archive import open_archive
+from more.webassets.tweens import WORKING_DIRECTORY_LOCK
+from more.webassets.tweens import bundle_urls, published_files, save_versions
+
+
+#: The directory below the output path holding the reloaded bundles
+RELEASES = "releases"
+
+
+class Reloader:
+    """Builds new environments and swaps them into the attached tweens.
+
+    Only one reload runs at a time; a reload requested while another one
+    is running starts once the latter is done.
+
+    """
+
+    def __init__(self, registry, grace_period=300):
+        self.registry = registry
+        self.grace_period = grace_period
+        self.lock = threading.Lock()
+
+        #: The injector and publisher tween of each app instance
+        self.tweens = []
+
+        #: The number of the last release
+        self.release = 0
+
+        #: The directory of the current release (None for the output path)
+        self.directory = None
+
+        #: The directories of the previous releases, together with the time
+        #: after which they may be removed
+        self.retired = []
+
+        #: The exception raised by the last reload (None if it succeeded)
+        self.error = None
+
+    def attach(self, injector, publisher):
+        self.tweens.append((injector, publisher))
+
+    def reload(self, wait=False):
+        """Reloads the bundles in a background thread and returns the thread.
+
+        If ``wait`` is true, waits for the reload to finish and raises the
+        exception of a failed reload. Otherwise the exception is kept in
+        :attr:`error` and the current bundles remain in use.
+
+        """
+
+        thread = threading.Thread(
+            target=self.run, name="more-webassets-reload", daemon=True
+        )
+        thread.start()
+
+        if wait:
+            thread.join()
+
+            if self.error is not None:
+                raise self.error
+
+        return thread
+
+    def run(self):
+        try:
+            self.rebuild()
+        except Exception as e:
+            self.error = e
+        else:
+            self.error = None
+
+    def rebuild(self):
+        """Builds a new environment and swaps it into the tweens. Returns
+        the new environment.
+
+        """
+
+        with self.lock:
+            if self.release == 0:
+                self.remove_orphans()
+
+            self.release += 1
+
+            # processes sharing the output path have their own releases
+            directory = os.path.join(
+                self.registry.output_path, RELEASES, f"{os.getpid()}-{self.release}"
+            )
+
+            # a directory left over by an earlier process is not trusted
+            shutil.rmtree(directory, ignore_errors=True)
+
+            try:
+                environment = self.registry.get_environment(directory)
+
+                # build everything before the environment is used (some
+                # compilers change the working directory of the process, the
+                # injector does not run those in the meantime)
+                with WORKING_DIRECTORY_LOCK:
+                    urls = {
+                        name: tuple(bundle_urls(environment, name))
+                        for name in self.registry.resources(environment)
+                        if name in environment
+                    }
+
+                published = published_files(environment)
+                save_versions(environment)
+            except Exception:
+                shutil.rmtree(directory, ignore_errors=True)
+                raise
+
+            # the publisher goes first, so the new urls can be served as
+            # soon as the injector renders them
+            for injector, publisher in self.tweens:
+                publisher.swap(environment, published, self.grace_period)
+
+                # in debug mode, the urls are resolved again on their first
+                # use, so the injector watches their source files
+                injector.swap(environment, None if environment.debug else urls)
+
+                # an archive written since the last reload is used from now on
+                if not environment.debug:
+                    publisher.use_archive(
+                        open_archive(
+                            self.registry.output_path,
+                            self.registry.archive_zero_copy,
+                            publisher.archive,
+                        )
+                    )
+
+            now = time.monotonic()
+
+            if self.directory:
+                self.retired.append((self.directory, now + self.grace_period))
+
+            self.directory = directory
+            self.remove_expired(now)
+
+            return environment
+
+    def remove_orphans(self):
+        """Removes the release directories of processes which are no longer
+        running (e.g. the ones of the previous deployment).
+
+        """
+
+        releases = os.path.join(self.registry.output_path, RELEASES)
+
+        try:
+            names = os.listdir(releases)
+        except OSError:
+            return
+
+        for name in names:
+            pid, _, release = name.partition("-")
+
+            if not (pid.isdigit() and release.isdigit()):
+                continue
+
+            if int(pid) != os.getpid() and not is_running(int(pid)):
+                shutil.rmtree(os.path.join(releases, name), ignore_errors=True)
+
+    def remove_expired(self, now=None):
+        """Removes the directories of releases whose grace period is over."""
+
+        now = time.monotonic() if now is None else now
+
+        for directory, until in self.retired:
+            if until <= now:
+                shutil.rmtree(directory, ignore_errors=True)
+
+        self.retired = [entry for entry in self.retired if entry[1] > now]
+
+
+def is_running(pid):
+    """Returns True if a process with the given id is running."""
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # running, but owned by another user
+
+    return True
+
+
+def reload_on_signal(app, signum=None):
+    """Reloads the bundles of the given app whenever the process receives
+    the given signal (SIGHUP by default).
+
+    Signal handlers may only be installed by the main thread. There is no
+    SIGHUP on Windows, another signal has to be given there.
+
+    """
+
+    if signum is None:
+        signum = signal.SIGHUP
+
+    def handle(signum, frame):
+        app.reload_webassets()
+
+    signal.signal(signum, handle)
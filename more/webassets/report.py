@@ -0,0 +1,223 @@
+"""Reports the weight of the assets and checks their budgets.
+
+The report lists the following sizes of each asset (and of each variant
+and legacy build, see
+:meth:`more.webassets.directives.WebassetRegistry.resources`):
+
+* ``raw``: the size of the source files.
+* ``minified``: the size of the built bundles (after all filters).
+* ``compressed``: the size of the built bundles compressed with gzip.
+
+Each asset also lists its files with their size and their share of the raw
+size. Files which are part of multiple assets (which don't include one
+another) are reported as duplicates. If the stylesheets are pruned (see
+:mod:`more.webassets.pruning`), the bytes saved per bundle are listed as
+well::
+
+    more-webassets report myproject.app:App
+
+"""
+
+import gzip
+import os.path
+import warnings
+
+from more.webassets.tweens import bundle_urls
+
+
+class BudgetExceeded(Exception):
+    """Raised if the size of an asset exceeds its budget."""
+
+    def __init__(self, violations):
+        self.violations = violations
+        super().__init__("\n".join(violations))
+
+
+class BudgetWarning(UserWarning):
+    """Issued if the size of an asset exceeds its (warn only) budget."""
+
+
+def bundle_paths(environment, name):
+    """Returns the paths of the built bundles of the given asset."""
+
+    prefix = environment.url.strip("/") + "/"
+    paths = []
+
+    for url in bundle_urls(environment, name):
+        path = url.split("?")[0]
+
+        if path.startswith(prefix):
+            path = path[len(prefix) :]
+
+        paths.append(os.path.join(environment.directory, path))
+
+    return paths
+
+
+def contains(registry, parent, child):
+    """Returns true if the given parent asset includes the given child."""
+
+    for sub in registry.assets[parent].assets:
+        if sub == child or sub in registry.assets and contains(registry, sub, child):
+            return True
+
+    return False
+
+
+def build_report(registry, environment=None):
+    """Builds all assets and returns their weight report."""
+
+    if environment is None:
+        environment = registry.get_environment()
+        environment.debug = False
+
+    assets = {}
+    containers = {}
+
+    # the variants and legacy builds are reported on their own
+    for resource, name in registry.resources(environment).items():
+        files = registry.asset_files(name)
+        raw = {path: os.path.getsize(path) for path in files}
+        total = sum(raw.values())
+
+        minified = compressed = 0
+
+        if resource in environment:
+            paths = bundle_paths(environment, resource)
+        else:
+            # binary files are published as they are
+            names = environment.hashed_files.names()
+            paths = [os.path.join(environment.directory, names[p]) for p in files]
+
+        for path in paths:
+            with open(path, "rb") as f:
+                data = f.read()
+
+            minified += len(data)
+            compressed += len(gzip.compress(data))
+
+        assets[resource] = {
+            "raw": total,
+            "minified": minified,
+            "compressed": compressed,
+            "files": [
+                {
+                    "path": path,
+                    "size": raw[path],
+                    "share": total and raw[path] / total or 0.0,
+                }
+                for path in files
+            ],
+        }
+
+        # single file assets are included by the asset defining them, and
+        # the variants and legacy builds contain the files of their asset
+        if resource == name and not registry.assets[name].is_single_file:
+            for path in files:
+                containers.setdefault(path, []).append(name)
+
+    duplicates = {}
+
+    for path, names in containers.items():
+        outermost = [
+            name
+            for name in names
+            if not any(contains(registry, other, name) for other in names)
+        ]
+
+        if len(outermost) > 1:
+            duplicates[path] = outermost
+
+    report = {"assets": assets, "duplicates": duplicates}
+
+    if registry.pruner:
+        from more.webassets.pruning import read_pruning_report
+
+        report["pruned"] = read_pruning_report(environment.directory)
+
+    return report
+
+
+def check_budgets(registry, report):
+    """Checks the budgets of the registry against the given report.
+
+    Raises :class:`BudgetExceeded` with all violations of budgets which are
+    not ``warn`` only. The others issue a :class:`BudgetWarning`.
+
+    """
+
+    errors = []
+
+    for name, budget in sorted(registry.budgets.items()):
+        assert name in report["assets"], f"budget for unknown asset {name}"
+
+        size = report["assets"][name][budget.measure]
+
+        if not budget.is_exceeded_by(size):
+            continue
+
+        message = (
+            f"{name}: {budget.measure} size of {format_size(size)} exceeds "
+            f"the budget of {format_size(budget.limit)}"
+        )
+
+        if budget.warn:
+            warnings.warn(message, BudgetWarning)
+        else:
+            errors.append(message)
+
+    if errors:
+        raise BudgetExceeded(errors)
+
+
+def format_size(size):
+    if size < 1024:
+        return f"{size} B"
+
+    return f"{size / 1024:.1f} KiB"
+
+
+def format_report(report, budgets=None):
+    """Returns the report as human readable text."""
+
+    budgets = budgets or {}
+    lines = []
+
+    for name, asset in sorted(report["assets"].items()):
+        line = (
+            f"{name}: raw {format_size(asset['raw'])}, "
+            f"minified {format_size(asset['minified'])}, "
+            f"compressed {format_size(asset['compressed'])}"
+        )
+
+        if name in budgets:
+            budget = budgets[name]
+            line += f" (budget {format_size(budget.limit)} {budget.measure})"
+
+        lines.append(line)
+
+        for entry in asset["files"]:
+            lines.append(
+                f"    {entry['path']}: {format_size(entry['size'])} "
+                f"({entry['share']:.1%})"
+            )
+
+    if report["duplicates"]:
+        lines.append("")
+        lines.append("duplicates:")
+
+        for path, names in sorted(report["duplicates"].items()):
+            lines.append(f"    {path}: {', '.join(names)}")
+
+    if report.get("pruned"):
+        lines.append("")
+        lines.append("pruned:")
+
+        for bundle, sizes in sorted(report["pruned"].items()):
+            saved = sizes["original"] - sizes["pruned"]
+            lines.append(
+                f"    {bundle}: {format_size(sizes['original'])} -> "
+                f"{format_size(sizes['pruned'])} (saved {format_size(saved)})"
+            )
+
+    return "\n".join(lines)
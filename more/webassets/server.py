@@ -0,0 +1,177 @@
+"""A standalone WSGI application serving the published bundles.
+
+Requests for assets usually pass through the whole Morepath tween stack
+before they reach :class:`more.webassets.tweens.PublisherTween`. The
+:class:`AssetServer` only serves the files of a build manifest, so it may be
+put in front of the application or run in a separate process::
+
+    from more.webassets.server import AssetServer
+
+    app = App()
+    wsgi = AssetServer.from_app(app, fallback=app)
+
+Requests which do not start with the asset url are passed to the fallback
+application, if there is one.
+
+"""
+
+import email.utils
+import mimetypes
+import os.path
+import time
+
+from more.webassets.tweens import FOREVER
+from more.webassets.tweens import has_insecure_path_element, is_subpath
+
+
+#: The size of the blocks in which files are sent if the server does not
+#: provide a ``wsgi.file_wrapper``
+BLOCK_SIZE = 64 * 1024
+
+
+class AssetServer:
+    """Serves the given files from the given directory below the given url.
+
+    ``files`` is the ``files`` mapping of a build manifest (see
+    :mod:`more.webassets.manifest`). All the headers are precomputed, so
+    serving an asset costs a dictionary lookup and opening the file.
+
+    """
+
+    def __init__(self, directory, files, url="assets", fallback=None):
+        self.directory = directory
+        self.prefix = "/" + url.strip("/") + "/"
+        self.fallback = fallback
+        self.files = {}
+
+        for path, info in files.items():
+            if has_insecure_path_element(path):
+                continue
+
+            target = os.path.join(directory, path)
+
+            if not is_subpath(directory, os.path.abspath(target)):
+                continue
+
+            if os.path.islink(target) or not os.path.isfile(target):
+                continue
+
+            headers = self.headers(target, info)
+            etag = dict(headers)["ETag"]
+
+            self.files[self.prefix + path] = (target, etag, headers)
+
+    @classmethod
+    def from_manifest(cls, path, fallback=None):
+        """Creates the server from the manifest at the given path (either the
+        manifest file or the directory containing it).
+
+        """
+        from more.webassets.manifest import read_manifest
+
+        directory = path if os.path.isdir(path) else os.path.dirname(path)
+        manifest = read_manifest(path)
+
+        return cls(directory, manifest["files"], manifest["url"], fallback)
+
+    @classmethod
+    def from_app(cls, app, fallback=None):
+        """Creates the server from a committed :class:`WebassetsApp`,
+        building all its bundles and writing a manifest.
+
+        """
+        from more.webassets.manifest import build_manifest, write_manifest
+
+        registry = app.config.webasset_registry
+        environment = registry.get_environment()
+
+        manifest = build_manifest(registry, environment)
+        write_manifest(manifest, environment.directory)
+
+        return cls(environment.directory, manifest["files"], manifest["url"], fallback)
+
+    def headers(self, path, info):
+        """Returns the response headers for the given file."""
+
+        content_type, encoding = mimetypes.guess_type(path)
+        size = os.path.getsize(path)
+
+        if info.get("version"):
+            etag = '"{}"'.format(info["version"])
+        else:
+            etag = f'"{size}-{int(os.path.getmtime(path))}"'
+
+        headers = [
+            ("Content-Type", content_type or "application/octet-stream"),
+            ("Content-Length", str(size)),
+            ("ETag", etag),
+            ("Cache-Control", f"max-age={int(FOREVER)}"),
+            ("Expires", email.utils.formatdate(time.time() + FOREVER, usegmt=True)),
+        ]
+
+        if encoding:
+            headers.append(("Content-Encoding", encoding))
+
+        return headers
+
+    def not_found(self, environ, start_response):
+        if self.fallback is not None:
+            return self.fallback(environ, start_response)
+
+        start_response("404 Not Found", [("Content-Type", "text/plain")])
+        return [b"Not Found"]
+
+    def __call__(self, environ, start_response):
+        path = environ.get("SCRIPT_NAME", "") + environ.get("PATH_INFO", "")
+
+        if not path.startswith(self.prefix):
+            return self.not_found(environ, start_response)
+
+        # no need to unquote the path, none of the published files contain
+        # characters which would be quoted (the lookup fails otherwise)
+        entry = self.files.get(path)
+
+        if entry is None:
+            return self.not_found(environ, start_response)
+
+        method = environ["REQUEST_METHOD"]
+
+        if method not in ("GET", "HEAD"):
+            start_response(
+                "405 Method Not Allowed",
+                [("Allow", "GET, HEAD"), ("Content-Type", "text/plain")],
+            )
+            return [b"Method Not Allowed"]
+
+        target, etag, headers = entry
+
+        if environ.get("HTTP_IF_NONE_MATCH") == etag:
+            start_response("304 Not Modified", [("ETag", etag)])
+            return []
+
+        if method == "HEAD":
+            start_response("200 OK", headers)
+            return []
+
+        try:
+            f = open(target, "rb")
+        except OSError:
+            return self.not_found(environ, start_response)
+
+        start_response("200 OK", headers)
+
+        if "wsgi.file_wrapper" in environ:
+            return environ["wsgi.file_wrapper"](f, BLOCK_SIZE)
+
+        return iter_file(f)
+
+
+def iter_file(f):
+    """Yields the contents of the given file in blocks, closing it after."""
+
+    with f:
+        block = f.read(BLOCK_SIZE)
+
+        while block:
+            yield block
+            block = f.read(BLOCK_SIZE)
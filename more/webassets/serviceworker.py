@@ -0,0 +1,244 @@
+"""Generates a service worker precaching the published bundles.
+
+The service worker and its precache manifest are created from the urls of
+the bundles (and of the hashed binary files) pages may load. The manifest
+lists the urls grouped by asset (or variant, or legacy build), together
+with a version derived from all the urls::
+
+    {
+        "version": "1a2b3c4d5e6f",
+        "assets": {
+            "common": ["/assets/common.bundle.js?ddc71aa3"]
+        }
+    }
+
+The worker caches all listed urls when it is installed and answers requests
+for them from the cache, without going to the network. As the urls contain
+the hash of their content, they never have to be revalidated. Once the
+bundles change, so does the worker, and the new worker removes the caches
+of the old one when it is activated.
+
+"""
+
+import hashlib
+import json
+import os.path
+import threading
+import webob
+
+from more.webassets.tweens import WORKING_DIRECTORY_LOCK, bundle_urls
+
+
+#: The name of the service worker script in the output directory
+SERVICE_WORKER = "service-worker.js"
+
+#: The name of the precache manifest in the output directory
+PRECACHE_MANIFEST = "precache-manifest.json"
+
+#: The script of the service worker, the manifest is inserted at __MANIFEST__
+TEMPLATE = """\
+var MANIFEST = __MANIFEST__;
+var PREFIX = "more-webassets-";
+var CACHE = PREFIX + MANIFEST.version;
+var URLS = new Set();
+
+Object.keys(MANIFEST.assets).forEach(function(name) {
+  MANIFEST.assets[name].forEach(function(url) { URLS.add(url); });
+});
+
+self.addEventListener("install", function(event) {
+  event.waitUntil(caches.open(CACHE).then(function(cache) {
+    return cache.addAll(Array.from(URLS));
+  }).then(function() {
+    return self.skipWaiting();
+  }));
+});
+
+self.addEventListener("activate", function(event) {
+  event.waitUntil(caches.keys().then(function(keys) {
+    return Promise.all(keys.filter(function(key) {
+      return key.indexOf(PREFIX) === 0 && key !== CACHE;
+    }).map(function(key) {
+      return caches.delete(key);
+    }));
+  }).then(function() {
+    return self.clients.claim();
+  }));
+});
+
+self.addEventListener("fetch", function(event) {
+  var url = new URL(event.request.url);
+  var local = url.origin === self.location.origin;
+  var key = local ? url.pathname + url.search : url.href;
+
+  if (event.request.method !== "GET" || !URLS.has(key)) {
+    return;
+  }
+
+  event.respondWith(caches.open(CACHE).then(function(cache) {
+    return cache.match(event.request).then(function(cached) {
+      return cached || fetch(event.request).then(function(response) {
+        if (response.ok) {
+          cache.put(event.request, response.clone());
+        }
+        return response;
+      });
+    });
+  }));
+});
+"""
+
+
+def build_precache_manifest(registry, environment, prefix="/"):
+    """Builds all the assets of the registry and returns the precache
+    manifest. The urls are prefixed like the injected urls.
+
+    """
+
+    assets = {}
+    hashed_files = getattr(environment, "hashed_files", None)
+
+    # only the bundles pages may load are precached, not the ones of the
+    # files they are made of
+    for resource, name in sorted(registry.resources(environment).items()):
+        if resource in environment:
+            urls = bundle_urls(environment, resource)
+        elif hashed_files:
+            # binary files are published as they are
+            names = hashed_files.names()
+            urls = [
+                f"{environment.url.strip('/')}/{names[path]}"
+                for path in registry.asset_files(name)
+            ]
+        else:
+            continue
+
+        assets[resource] = [prefix + url for url in urls]
+
+    urls = sorted({url for urls in assets.values() for url in urls})
+    version = hashlib.md5("\n".join(urls).encode("utf-8")).hexdigest()[:12]
+
+    return {"version": version, "assets": assets}
+
+
+def render_service_worker(manifest):
+    """Returns the script of the service worker for the given manifest."""
+
+    # the manifest ends up in a script, which must not be able to close it
+    data = json.dumps(manifest, sort_keys=True).replace("</", "<\\/")
+    return TEMPLATE.replace("__MANIFEST__", data)
+
+
+def write_file(path, content):
+    # write to a temporary file first, so readers never see half a file
+    temporary = f"{path}.{os.getpid()}.tmp"
+
+    with open(temporary, "w", encoding="utf-8") as f:
+        f.write(content)
+
+    os.replace(temporary, path)
+
+
+def write_service_worker(registry, environment, prefix="/"):
+    """Writes the service worker and the precache manifest to the output
+    directory. Returns the manifest.
+
+    """
+
+    manifest = build_precache_manifest(registry, environment, prefix)
+    directory = environment.directory
+
+    write_file(
+        os.path.join(directory, PRECACHE_MANIFEST),
+        json.dumps(manifest, indent=2, sort_keys=True),
+    )
+    write_file(os.path.join(directory, SERVICE_WORKER), render_service_worker(manifest))
+
+    return manifest
+
+
+class ServiceWorker:
+    """Serves the service worker and its precache manifest.
+
+    Both are created when they are first requested, which builds all the
+    bundles. The worker is served with ``Cache-Control: no-cache``, so the
+    browser notices new versions right away, and with a
+    ``Service-Worker-Allowed`` header for the given scope.
+
+    If an ``injector`` is given, the bundles are built while holding its
+    locks, so the injector does not build them at the same time.
+
+    """
+
+    #: The names of the files served by the service worker
+    names = (SERVICE_WORKER, PRECACHE_MANIFEST)
+
+    def __init__(self, registry, environment, prefix="/", scope="/", injector=None):
+        self.registry = registry
+        self.environment = environment
+        self.prefix = prefix
+        self.scope = scope
+        self.injector = injector
+        self.lock = threading.Lock()
+        self.files = None
+
+    def replace(self, environment):
+        """Returns a service worker for the given (new) environment."""
+
+        return self.__class__(
+            self.registry, environment, self.prefix, self.scope, self.injector
+        )
+
+    def building(self):
+        """Returns the context holding the locks needed to build all the
+        bundles (see :meth:`more.webassets.tweens.InjectorTween.building`).
+
+        """
+
+        if self.injector is None:
+            return WORKING_DIRECTORY_LOCK
+
+        resources = [
+            resource
+            for resource in self.registry.resources(self.environment)
+            if resource in self.environment
+        ]
+
+        return self.injector.building(self.environment, resources)
+
+    def build(self):
+        with self.lock:
+            if self.files is None:
+                with self.building():
+                    manifest = write_service_worker(
+                        self.registry, self.environment, self.prefix
+                    )
+
+                script = render_service_worker(manifest)
+
+                self.files = {
+                    SERVICE_WORKER: (
+                        "application/javascript",
+                        script.encode("utf-8"),
+                        manifest["version"],
+                    ),
+                    PRECACHE_MANIFEST: (
+                        "application/json",
+                        json.dumps(manifest, sort_keys=True).encode("utf-8"),
+                        manifest["version"],
+                    ),
+                }
+
+        return self.files
+
+    def __call__(self, request, name):
+        content_type, body, version = self.build()[name]
+
+        response = webob.Response(
+            body=body, content_type=content_type, conditional_response=True
+        )
+        response.etag = version
+        response.cache_control.no_cache = True
+        response.headers["Service-Worker-Allowed"] = self.scope
+
+        return request.get_response(response)
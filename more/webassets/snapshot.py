@@ -0,0 +1,137 @@
+"""Snapshots of the registry, which speed up the startup of applications.
+
+Committing an app performs all the directives. The ``webasset`` directives
+run the asset generators and search the paths for each file, the
+``webasset_path`` directives check that the paths exist. A snapshot stores
+the results of those directives in a json file, keyed by a fingerprint of
+each directive function (its code and the values it refers to) and of its
+arguments::
+
+    more-webassets snapshot myproject.app:App assets/snapshot.json
+
+If the snapshot is registered through the ``webasset_snapshot`` directive,
+the directives whose fingerprint is found in it use the stored results
+instead of touching the filesystem. Directives which changed are performed
+as usual.
+
+The snapshot is meant to be created during the deployment. It does not
+notice files which are moved after it has been created.
+
+"""
+
+import hashlib
+import json
+import marshal
+import os
+import sys
+import types
+
+
+#: The version of the snapshot format
+VERSION = 1
+
+#: The types of values which are part of a fingerprint by their repr
+SIMPLE_TYPES = (str, bytes, int, float, bool, type(None), tuple, frozenset)
+
+
+def describe_value(value):
+    """Returns a stable description of the given value or raises a
+    ValueError if there is none.
+
+    """
+
+    if isinstance(value, types.ModuleType):
+        return f"module:{value.__name__}"
+
+    if isinstance(value, (types.FunctionType, types.BuiltinFunctionType, type)):
+        return f"object:{getattr(value, '__module__', '')}.{value.__qualname__}"
+
+    if isinstance(value, SIMPLE_TYPES):
+        text = repr(value)
+
+        # objects without a repr of their own contain their memory address
+        if " at 0x" in text:
+            raise ValueError(text)
+
+        return text
+
+    raise ValueError(f"{type(value)} has no stable description")
+
+
+def fingerprint(function, *args):
+    """Returns a fingerprint of the given function and arguments.
+
+    The fingerprint covers the code of the function, the values of its
+    closure and of the globals it refers to. Returns None if one of those
+    has no stable description (then the result may not be stored).
+
+    """
+
+    code = function.__code__
+    parts = [marshal.dumps(code)]
+
+    try:
+        for cell in function.__closure__ or ():
+            parts.append(describe_value(cell.cell_contents).encode("utf-8"))
+
+        for name in code.co_names:
+            if name in function.__globals__:
+                value = function.__globals__[name]
+                parts.append(f"{name}={describe_value(value)}".encode())
+
+        for arg in args:
+            parts.append(describe_value(arg).encode("utf-8"))
+    except ValueError:
+        return None
+
+    return hashlib.sha1(b"\0".join(parts)).hexdigest()
+
+
+def read_snapshot(path):
+    """Returns the stored directive results of the snapshot at the given
+    path, or an empty dict if it does not exist or is not compatible.
+
+    Snapshots are ignored if ``MORE_WEBASSETS_IGNORE_SNAPSHOT`` is set.
+
+    """
+
+    if os.environ.get("MORE_WEBASSETS_IGNORE_SNAPSHOT"):
+        return {}
+
+    try:
+        with open(path, encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    if snapshot.get("version") != VERSION:
+        return {}
+
+    # the fingerprints of the code differ between python versions
+    if snapshot.get("python") != list(sys.version_info[:2]):
+        return {}
+
+    return snapshot.get("results", {})
+
+
+def write_snapshot(registry, path):
+    """Writes the snapshot of the given (committed) registry to the path."""
+
+    snapshot = {
+        "version": VERSION,
+        "python": list(sys.version_info[:2]),
+        "results": registry.results,
+    }
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+
+    # write to a temporary file first, so readers never see half a snapshot
+    temporary = f"{path}.{os.getpid()}.tmp"
+
+    with open(temporary, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, indent=2, sort_keys=True)
+
+    os.replace(temporary, path)
+
+    return snapshot
@@ -0,0 +1,175 @@
+import gzip
+import morepath
+import os
+import re
+
+from datetime import datetime
+from more.webassets.archive import ARCHIVE_POINTER, Archive, pack_files
+from more.webassets.archive import open_archive, write_archive
+from more.webassets.cli import main
+from more.webassets.tests.test_webassets import spawn_test_app
+from webob import Request
+from webtest import TestApp as Client
+
+
+def test_pack_files(tempdir):
+    path = os.path.join(tempdir, "test.pack")
+    script = b"var a = 1;" * 100
+
+    with open(path, "wb") as f:
+        f.write(pack_files({"a.js": script, "logo.png": b"\x89PNG"}))
+
+    archive = Archive(path)
+    entry = archive.files["a.js"]
+
+    assert entry.content_type.endswith("/javascript")
+    assert archive.body(entry.data) == script
+    assert gzip.decompress(archive.body(entry.gzip)) == script
+
+    # binary files are not compressed
+    entry = archive.files["logo.png"]
+    assert entry.gzip is None
+    assert archive.body(entry.data) == b"\x89PNG"
+
+    # the slices may be passed on without copying them
+    archive = Archive(path, zero_copy=True)
+    body = archive.body(archive.files["logo.png"].data)
+    assert isinstance(body, memoryview)
+    assert body == b"\x89PNG"
+
+
+def test_serve_archive(tempdir):
+    app = spawn_test_app(tempdir)
+    registry = app.config.webasset_registry
+    output = os.path.join(tempdir, "output")
+
+    with open(os.path.join(tempdir, "common", "extra.js"), "w") as f:
+        f.write("var extra = [%s];" % ", ".join(["'extra'"] * 100))
+
+    path = write_archive(registry)
+    assert re.match(r"^bundles\.[0-9a-f]{16}\.pack$", os.path.basename(path))
+    assert open_archive(output).path == path
+
+    # the archive is identified by its content
+    assert write_archive(registry) == path
+
+    client = Client(app.__class__())
+    url = "/assets/common.bundle.js?ddc71aa3"
+
+    # the files are served from the archive, not from the output directory
+    os.remove(os.path.join(output, "common.bundle.js"))
+
+    response = client.get(url)
+    assert response.body == b"var $=function(){};var _=function(){};"
+    assert response.content_type.endswith("/javascript")
+    assert response.etag.startswith("ddc71aa3")
+    assert response.expires.year == datetime.utcnow().year + 10
+
+    # the bundle is too small to be compressed
+    plain = Request.blank(url, headers={"Accept-Encoding": "gzip"})
+    plain = plain.get_response(client.app)
+    assert plain.content_encoding is None
+
+    extra = re.search(r'src="([^"]+)"', client.get("?bundle=extra").text).group(1)
+    response = client.get(extra)
+    assert response.content_encoding is None
+
+    # webtest decodes the responses, webob does not
+    request = Request.blank(extra, headers={"Accept-Encoding": "gzip, br"})
+    compressed = request.get_response(client.app)
+    assert compressed.content_encoding == "gzip"
+    assert compressed.vary == ("Accept-Encoding",)
+    assert gzip.decompress(compressed.body) == response.body
+
+    client.get(url, headers={"If-None-Match": plain.etag}, status=304)
+
+    # other versions are looked up in the output directory
+    client.get("/assets/common.bundle.js?12345678", status=404)
+
+    # without an archive, the deleted file is missing
+    os.remove(os.path.join(output, ARCHIVE_POINTER))
+    Client(app.__class__()).get(url, status=404)
+
+
+def test_archive_debug_mode(tempdir, monkeypatch):
+    app = spawn_test_app(tempdir)
+    write_archive(app.config.webasset_registry)
+
+    monkeypatch.setenv("MORE_WEBASSETS_DEBUG", "1")
+    # the tweens are created with the first request
+    Client(app.__class__()).get("?bundle=common")
+
+    publisher = app.config.webasset_registry.reloader.tweens[-1][1]
+    assert publisher.archive is None
+
+
+def test_archive_command(tempdir, capsys, monkeypatch):
+    app = spawn_test_app(tempdir)
+
+    monkeypatch.setattr("more.webassets.cli.load_app", lambda spec: app)
+
+    main(["archive", "myapp:App"])
+
+    path = capsys.readouterr().out.strip()
+    assert os.path.isfile(path)
+    assert open_archive(os.path.join(tempdir, "output")).path == path
+
+
+def test_archive_zero_copy(tempdir):
+    App = spawn_test_app(tempdir).__class__
+
+    @App.webasset_archive()
+    def get_zero_copy():
+        return True
+
+    morepath.commit(App)
+
+    app = App()
+    write_archive(app.config.webasset_registry)
+
+    # webtest only accepts bytes, webob accepts any bytes-like object
+    request = Request.blank("/assets/common.bundle.js?ddc71aa3")
+    response = request.get_response(app)
+    assert response.body == b"var $=function(){};var _=function(){};"
+
+    publisher = app.config.webasset_registry.reloader.tweens[-1][1]
+    assert publisher.archive.zero_copy
+
+
+def test_archive_reload(tempdir):
+    app = spawn_test_app(tempdir)
+    registry = app.config.webasset_registry
+
+    client = Client(app)
+    client.get("?bundle=common")
+
+    publisher = registry.reloader.tweens[-1][1]
+    assert publisher.archive is None
+
+    # a reload switches to the archive written in the meantime
+    path = write_archive(registry)
+    app.reload_webassets(wait=True)
+    assert publisher.archive.path == path
+
+    # the archive is not mapped again if it did not change
+    archive = publisher.archive
+    app.reload_webassets(wait=True)
+    assert publisher.archive is archive
+
+    jquery = os.path.join(tempdir, "common", "jquery.js")
+
+    with open(jquery, "w") as f:
+        f.write("var $ = function(){ return 1; };")
+
+    # make sure the bundle is older than its source
+    modified = os.path.getmtime(jquery) + 10
+    os.utime(jquery, (modified, modified))
+
+    new = write_archive(registry)
+    assert new != path
+
+    app.reload_webassets(wait=True)
+    assert publisher.archive.path == new
+
+    url = re.search(r'src="([^"]+)"', client.get("?bundle=common").text).group(1)
+    assert b"return 1" in client.get(url).body
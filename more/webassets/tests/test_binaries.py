@@ -0,0 +1,166 @@
+import morepath
+import os
+import re
+import time
+
+from datetime import datetime
+from more.webassets import WebassetsApp
+from more.webassets.binaries import HashedFiles, hashed_name
+from more.webassets.manifest import build_manifest
+from webtest import TestApp as Client
+
+
+def write(path, content):
+    with open(path, "wb") as f:
+        f.write(content)
+
+    # make sure the timestamp based updater notices the change
+    future = time.time() + len(content)
+    os.utime(path, (future, future))
+
+
+def prepare_fixtures(directory):
+    for name in ("css", "img", "fonts", "out"):
+        os.mkdir(os.path.join(directory, name))
+
+    write(os.path.join(directory, "img", "logo.png"), b"\x89PNG logo")
+    write(os.path.join(directory, "fonts", "icons.woff"), b"wOFF icons")
+    write(
+        os.path.join(directory, "css", "theme.css"),
+        b"\n".join(
+            (
+                b".logo { background: url(../img/logo.png); }",
+                b'@font-face { src: url("icons.woff?#iefix"); }',
+                b".cdn { background: url(https://example.org/logo.png); }",
+                b".inline { background: url(data:image/png;base64,AAAA); }",
+                b".unknown { background: url('missing.png'); }",
+            )
+        ),
+    )
+
+
+def spawn_binary_app(tempdir):
+    prepare_fixtures(tempdir)
+
+    class App(WebassetsApp):
+        pass
+
+    @App.webasset_path()
+    def get_css_path():
+        return os.path.join(tempdir, "css")
+
+    @App.webasset_path()
+    def get_image_path():
+        return os.path.join(tempdir, "img")
+
+    @App.webasset_path()
+    def get_font_path():
+        return os.path.join(tempdir, "fonts")
+
+    @App.webasset_output()
+    def get_output_path():
+        return os.path.join(tempdir, "out")
+
+    @App.webasset("images")
+    def get_images():
+        yield "logo.png"
+        yield "icons.woff"
+
+    @App.webasset("theme")
+    def get_theme():
+        yield "images"
+        yield "theme.css"
+
+    @App.path(path="")
+    class Root:
+        pass
+
+    @App.html(model=Root)
+    def index(self, request):
+        request.include("theme")
+        return "<html><head></head><body></body></html>"
+
+    morepath.commit(App)
+
+    return App()
+
+
+def test_hashed_name():
+    assert hashed_name("/a/logo.png", "1234567890") == "logo.12345678.png"
+    assert hashed_name("/a/fa.min.woff2", "abcdef1234") == "fa.min.abcdef12.woff2"
+
+
+def test_hashed_files_resolve(tempdir):
+    prepare_fixtures(tempdir)
+
+    logo = os.path.join(tempdir, "img", "logo.png")
+    css = os.path.join(tempdir, "css", "theme.css")
+    files = HashedFiles(os.path.join(tempdir, "out"), (logo,))
+
+    assert files.resolve("../img/logo.png", css) == logo
+    assert files.resolve("logo.png?v=1#top", css) == logo
+    assert files.resolve("logo.png") == logo
+    assert files.resolve("/img/logo.png", css) is None
+    assert files.resolve("https://example.org/logo.png", css) is None
+    assert files.resolve("missing.png", css) is None
+
+
+def test_binary_assets(tempdir):
+    app = spawn_binary_app(tempdir)
+    client = Client(app)
+
+    page = client.get("/").text
+    urls = re.findall(r'href="([^"]+)"', page)
+    assert len(urls) == 1
+    assert urls[0].startswith("/assets/theme.css.bundle.css?")
+
+    css = client.get(urls[0]).text
+    references = re.findall(r"url\(([^)]+)\)", css)
+
+    logo, icons = references[:2]
+    assert re.match(r"^logo\.[0-9a-f]{8}\.png$", logo)
+    assert re.match(r'^"icons\.[0-9a-f]{8}\.woff\?#iefix"$', icons)
+    assert references[2:] == [
+        "https://example.org/logo.png",
+        "data:image/png;base64,AAAA",
+        "'missing.png'",
+    ]
+
+    # the hashed files are served with the same cache headers as the bundles
+    response = client.get("/assets/" + logo)
+    assert response.body == b"\x89PNG logo"
+    assert response.content_type == "image/png"
+    assert response.expires.year == datetime.utcnow().year + 10
+
+    # the source files are not
+    client.get("/assets/logo.png", status=404)
+
+    # changing an image changes its name and the stylesheet referring to it
+    write(os.path.join(tempdir, "img", "logo.png"), b"\x89PNG new logo")
+
+    client = Client(app.__class__())
+    new_urls = re.findall(r'href="([^"]+)"', client.get("/").text)
+    assert new_urls != urls
+
+    new_logo = re.findall(r"url\(([^)]+)\)", client.get(new_urls[0]).text)[0]
+    assert new_logo != logo
+    assert client.get("/assets/" + new_logo).body == b"\x89PNG new logo"
+
+
+def test_binary_assets_manifest(tempdir):
+    app = spawn_binary_app(tempdir)
+    registry = app.config.webasset_registry
+    env = registry.get_environment()
+    env.debug = False
+
+    manifest = build_manifest(registry, env)
+
+    assert "images" not in manifest["assets"]
+    assert "logo.png" not in manifest["assets"]
+    assert len(manifest["assets"]["theme"]) == 1
+
+    names = sorted(manifest["files"])
+    assert len(names) == 3
+    assert names[0].startswith("icons.") and names[0].endswith(".woff")
+    assert names[1].startswith("logo.") and names[1].endswith(".png")
+    assert names[2] == "theme.css.bundle.css"
@@ -0,0 +1,74 @@
+import morepath
+import os.path
+import pytest
+
+from more.webassets import WebassetsApp
+from more.webassets.cli import main
+from more.webassets.manifest import read_manifest
+from webtest import TestApp as Client
+
+
+class ExportApp(WebassetsApp):
+    pass
+
+
+@ExportApp.webasset_path()
+def get_path():
+    return "fixtures"
+
+
+@ExportApp.webasset("common")
+def get_common_asset():
+    yield "jquery.js"
+    yield "extra.css"
+
+
+def test_export(tempdir, capsys):
+    main(["export", "more.webassets.tests.test_cli:ExportApp", tempdir])
+
+    exported = os.path.join(tempdir, "assets")
+    manifest = read_manifest(exported)
+
+    assert sorted(os.listdir(exported)) == [
+        "extra.css.bundle.css",
+        "jquery.js.bundle.js",
+        "manifest.json",
+    ]
+
+    assert sorted(manifest["files"]) == sorted(capsys.readouterr().out.split())
+    assert manifest["assets"]["common"][0].startswith("assets/jquery.js.bundle.js?")
+
+    with open(os.path.join(exported, "jquery.js.bundle.js")) as f:
+        assert "fake jquery" in f.read()
+
+
+def test_export_invalid_app(tempdir):
+    with pytest.raises(SystemExit):
+        main(["export", "more.webassets.tests.test_cli", tempdir])
+
+    with pytest.raises(SystemExit):
+        main(["export", "more.webassets.tests.test_cli:Missing", tempdir])
+
+
+def test_base_url(tempdir):
+    class App(ExportApp):
+        pass
+
+    @App.webasset_base_url()
+    def get_base_url():
+        return "https://cdn.example.org/"
+
+    @App.path("")
+    class Root:
+        pass
+
+    @App.html(model=Root)
+    def index(self, request):
+        request.include("common")
+        return "<html><head></head><body></body></html>"
+
+    morepath.commit(App)
+
+    page = Client(App()).get("/").text
+    assert 'src="https://cdn.example.org/assets/jquery.js.bundle.js?' in page
+    assert 'href="https://cdn.example.org/assets/extra.css.bundle.css?' in page
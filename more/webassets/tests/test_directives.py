@@ -1,5 +1,8 @@
 import morepath
 import os.path
+import subprocess
+import sys
+import tempfile
 
 from more.webassets import WebassetsApp
 from more.webassets.directives import Asset
@@ -482,3 +485,38 @@ def test_webasset_environment(tempdir, fixtures_path):
     assert e["common_1"].contents[1].output == e["css"].contents[1].output
     assert e["common_1"].contents[1].contents == e["css"].contents[1].contents
     assert len(e["common_1"].urls()) == 1
+
+
+def test_import_does_not_load_webassets():
+    code = "import sys, more.webassets; print('webassets' in sys.modules)"
+    output = subprocess.check_output(
+        [sys.executable, "-c", code], universal_newlines=True
+    )
+
+    assert output.strip() == "False"
+
+
+def test_output_path_is_created_lazily(fixtures_path, monkeypatch):
+    class App(WebassetsApp):
+        pass
+
+    @App.webasset_path()
+    def get_path():
+        return fixtures_path
+
+    @App.webasset("common")
+    def get_common_assets():
+        yield "jquery.js"
+
+    def fail(*args, **kwargs):
+        raise AssertionError("unexpected temporary directory")
+
+    with monkeypatch.context() as m:
+        m.setattr(tempfile, "mkdtemp", fail)
+        morepath.commit(App)
+
+        registry = App().config.webasset_registry
+        assert registry._output_path is None
+
+    assert os.path.isdir(registry.output_path)
+    assert registry.get_environment().directory == registry.output_path
@@ -0,0 +1,149 @@
+import morepath
+import os
+import time
+
+from more.webassets import WebassetsApp
+from more.webassets.filters import IncrementalFilter
+from webassets.filter import Filter
+
+
+class RecordingFilter(Filter):
+    """Records the data passed through it and replaces a token."""
+
+    name = "recording"
+
+    def __init__(self, old, new):
+        super().__init__()
+        self.old = old
+        self.new = new
+        self.calls = []
+
+    def unique(self):
+        return self.old, self.new
+
+    def output(self, _in, out, **kwargs):
+        data = _in.read()
+        self.calls.append(data)
+        out.write(data.replace(self.old, self.new))
+
+
+class PathFilter(Filter):
+    """Prepends the name of the source file."""
+
+    name = "path"
+
+    def output(self, _in, out, **kwargs):
+        name = os.path.basename(kwargs["source_path"])
+        out.write(f"// {name}\n{_in.read()}")
+
+
+def write(path, content):
+    with open(path, "w") as f:
+        f.write(content)
+
+    # make sure the timestamp based updater notices the change
+    future = time.time() + len(content)
+    os.utime(path, (future, future))
+
+
+def spawn_incremental_app(tempdir, compiler, minifier):
+    os.mkdir(os.path.join(tempdir, "src"))
+    os.mkdir(os.path.join(tempdir, "out"))
+
+    write(os.path.join(tempdir, "src", "a.jsx"), "var a = <A/>;\n")
+    write(os.path.join(tempdir, "src", "b.jsx"), "var b = <B/>;\n")
+
+    class App(WebassetsApp):
+        pass
+
+    @App.webasset_path()
+    def get_path():
+        return os.path.join(tempdir, "src")
+
+    @App.webasset_output()
+    def get_output_path():
+        return os.path.join(tempdir, "out")
+
+    @App.webasset_filter("jsx", produces="js", incremental=True)
+    def get_jsx_filter():
+        return compiler
+
+    @App.webasset_filter("js")
+    def get_js_filter():
+        return minifier
+
+    @App.webasset("common")
+    def get_common_asset():
+        yield "a.jsx"
+        yield "b.jsx"
+
+    morepath.commit(App)
+
+    return App()
+
+
+def test_incremental_filter_chain(tempdir):
+    compiler = RecordingFilter("<", "jsx(")
+    minifier = RecordingFilter(" ", "")
+    app = spawn_incremental_app(tempdir, compiler, minifier)
+
+    bundles = list(app.config.webasset_registry.get_bundles("common"))
+    assert len(bundles) == 1
+    assert isinstance(bundles[0].filters[0], IncrementalFilter)
+    assert bundles[0].filters[0].filters == [compiler]
+    assert bundles[0].filters[1] is minifier
+
+
+def test_incremental_rebuild(tempdir):
+    compiler = RecordingFilter("<", "jsx(")
+    minifier = RecordingFilter(" ", "")
+    app = spawn_incremental_app(tempdir, compiler, minifier)
+
+    env = app.config.webasset_registry.get_environment()
+    env["common"].urls()
+
+    assert compiler.calls == ["var a = <A/>;\n", "var b = <B/>;\n"]
+    assert len(minifier.calls) == 1
+
+    write(os.path.join(tempdir, "src", "b.jsx"), "var b = <C/>;\n")
+    env["common"].urls()
+
+    # only the changed file is compiled, the bundle is minified as a whole
+    assert compiler.calls[2:] == ["var b = <C/>;\n"]
+    assert len(minifier.calls) == 2
+
+    with open(os.path.join(tempdir, "out", "common.bundle.js")) as f:
+        assert f.read() == "vara=jsx(A/>;\n\nvarb=jsx(C/>;\n"
+
+    # the results are stored in the cache of the environment, so they are
+    # shared with other processes
+    env = app.config.webasset_registry.get_environment()
+    env["common"].build(force=True)
+
+    assert len(compiler.calls) == 3
+
+
+def test_incremental_filter_paths(tempdir):
+    app = spawn_incremental_app(tempdir, PathFilter(), None)
+    write(os.path.join(tempdir, "src", "b.jsx"), "var a = <A/>;\n")
+
+    env = app.config.webasset_registry.get_environment()
+    env["common"].urls()
+
+    # files with the same content are still filtered on their own
+    with open(os.path.join(tempdir, "out", "common.bundle.js")) as f:
+        assert f.read() == "// a.jsx\nvar a = <A/>;\n\n// b.jsx\nvar a = <A/>;\n"
+
+
+def test_incremental_filter_without_cache(tempdir):
+    compiler = RecordingFilter("<", "jsx(")
+    app = spawn_incremental_app(tempdir, compiler, None)
+
+    env = app.config.webasset_registry.get_environment()
+    env.cache = False
+    env.manifest = False
+
+    env["common"].build(force=True)
+    env["common"].build(force=True)
+
+    assert len(compiler.calls) == 2
@@ -0,0 +1,144 @@
+import morepath
+import os
+import re
+
+from more.webassets import WebassetsApp
+from more.webassets.pruning import PRUNING_REPORT, Pruner
+from more.webassets.pruning import prune_css, selector_names, split_selectors
+from more.webassets.report import build_report, format_report
+from webtest import TestApp as Client
+
+
+CSS = """\
+/* .comment { } */
+@charset "utf-8";
+.used, .unused > a { color: red; }
+#app .btn:not(.disabled)[data-x="a{b}"] { margin: 0; }
+@media (max-width: 10px) { .unused { color: blue; } }
+@media print { .used { color: black; } .gone { color: white; } }
+@font-face { font-family: icons; src: url(icons.woff); }
+.md\\:flex { display: flex; }
+.is-open { display: block; }
+div { padding: 0; }
+"""
+
+
+def test_split_selectors():
+    assert split_selectors(".a, .b:is(.c, .d) ,[x='a,b']") == [
+        ".a",
+        ".b:is(.c, .d)",
+        "[x='a,b']",
+    ]
+
+
+def test_selector_names():
+    assert selector_names("#app .btn:not(.disabled)[data-x='.y']") == {
+        "app",
+        "btn",
+    }
+    assert selector_names(".md\\:flex > a") == {"md:flex"}
+    assert selector_names("div > a") == set()
+
+
+def test_prune_css():
+    used = {"used", "app", "btn", "md:flex"}
+    css = prune_css(CSS, lambda name: name in used)
+
+    assert css.splitlines() == [
+        '@charset "utf-8";',
+        ".used{ color: red; }",
+        '#app .btn:not(.disabled)[data-x="a{b}"]{ margin: 0; }',
+        "@media print{.used{ color: black; }}",
+        "@font-face{ font-family: icons; src: url(icons.woff); }",
+        ".md\\:flex{ display: flex; }",
+        "div{ padding: 0; }",
+    ]
+
+
+def test_pruner(tempdir):
+    templates = os.path.join(tempdir, "templates")
+    os.mkdir(templates)
+
+    with open(os.path.join(templates, "index.pt"), "w") as f:
+        f.write('<div id="app" class="used md:flex"><a class="btn"></a></div>')
+
+    with open(os.path.join(templates, "ignored.css"), "w") as f:
+        f.write(".gone {}")
+
+    pruner = Pruner([templates], allow=("is-*",))
+
+    assert pruner.files() == [os.path.join(templates, "index.pt")]
+    assert {"app", "used", "md:flex", "btn"} <= pruner.words()
+
+    css = pruner.prune(CSS)
+    assert ".is-open" in css
+    assert ".unused" not in css
+    assert ".gone" not in css
+
+
+def test_prune_bundles(tempdir):
+    for directory in ("src", "templates", "output"):
+        os.mkdir(os.path.join(tempdir, directory))
+
+    with open(os.path.join(tempdir, "src", "app.css"), "w") as f:
+        f.write(CSS)
+
+    with open(os.path.join(tempdir, "templates", "views.py"), "w") as f:
+        f.write("CLASSES = ['used', 'btn']\n")
+
+    class App(WebassetsApp):
+        pass
+
+    @App.webasset_path()
+    def get_src_path():
+        return os.path.join(tempdir, "src")
+
+    @App.webasset_output()
+    def get_output_path():
+        return os.path.join(tempdir, "output")
+
+    @App.webasset_prune(allow=("is-*",))
+    def get_prune_paths():
+        return os.path.join(tempdir, "templates")
+
+    @App.webasset("app")
+    def get_app():
+        yield "app.css"
+
+    @App.path("")
+    class Root:
+        pass
+
+    @App.html(model=Root)
+    def index(self, request):
+        request.include("app")
+        return "<html><head></head><body></body></html>"
+
+    morepath.commit(App)
+
+    app = App()
+    client = Client(app)
+
+    url = re.search(r'href="([^"]+)"', client.get("/").text).group(1)
+    css = client.get(url).text
+
+    assert ".used{" in css
+    assert ".is-open{" in css
+    assert "#app" not in css
+    assert ".unused" not in css
+
+    report = build_report(app.config.webasset_registry)
+    sizes = report["pruned"]["app.bundle.css"]
+    assert sizes["original"] == len(CSS)
+    assert sizes["pruned"] == len(css)
+
+    assert os.path.isfile(os.path.join(tempdir, "output", PRUNING_REPORT))
+    assert "app.bundle.css: " in format_report(report)
+
+    # using a class in a template brings its rules back
+    with open(os.path.join(tempdir, "templates", "views.py"), "a") as f:
+        f.write("APP = 'app'\n")
+
+    client = Client(App())
+    url = re.search(r'href="([^"]+)"', client.get("/").text).group(1)
+    assert "#app" in client.get(url).text
@@ -0,0 +1,182 @@
+import os
+import pytest
+import re
+import signal
+import subprocess
+import sys
+import threading
+
+from more.webassets.reload import RELEASES, reload_on_signal
+from more.webassets.tests.test_webassets import spawn_test_app
+from webtest import TestApp as Client
+
+
+def script_url(client):
+    page = client.get("?bundle=common").text
+    return re.search(r'src="([^"]+)"', page).group(1)
+
+
+def change_jquery(tempdir):
+    with open(os.path.join(tempdir, "common", "jquery.js"), "w") as f:
+        f.write("var $ = function(){ return 1; };")
+
+
+def test_reload(tempdir):
+    app = spawn_test_app(tempdir)
+    client = Client(app)
+
+    # nothing to reload before the first request
+    assert app.reload_webassets() is None
+
+    old = script_url(client)
+    assert old == "/assets/common.bundle.js?ddc71aa3"
+
+    change_jquery(tempdir)
+    app.reload_webassets(wait=True)
+
+    new = script_url(client)
+    assert new != old
+    assert "return 1" in client.get(new).text
+
+    # the new bundles are written to a release directory
+    releases = os.path.join(tempdir, "output", RELEASES)
+    assert len(os.listdir(releases)) == 1
+
+    # the previous bundles are still served during the grace period
+    assert "return 1" not in client.get(old).text
+
+
+def test_reload_grace_period(tempdir):
+    app = spawn_test_app(tempdir)
+    client = Client(app)
+    old = script_url(client)
+
+    registry = app.config.webasset_registry
+    registry.reloader.grace_period = 0
+
+    change_jquery(tempdir)
+    app.reload_webassets(wait=True)
+
+    # after the grace period, the current file is served for old urls
+    assert "return 1" in client.get(old).text
+
+    # and the directories of the previous releases are removed
+    app.reload_webassets(wait=True)
+    releases = os.path.join(tempdir, "output", RELEASES)
+    assert len(os.listdir(releases)) == 1
+
+
+def test_reload_failure(tempdir, monkeypatch):
+    app = spawn_test_app(tempdir)
+    client = Client(app)
+    old = script_url(client)
+
+    registry = app.config.webasset_registry
+
+    def fail(directory=None):
+        raise RuntimeError("build failed")
+
+    monkeypatch.setattr(registry, "get_environment", fail)
+
+    with pytest.raises(RuntimeError):
+        app.reload_webassets(wait=True)
+
+    # the failed reload does not affect the current bundles
+    app.reload_webassets().join()
+    assert isinstance(registry.reloader.error, RuntimeError)
+    assert script_url(client) == old
+    assert client.get(old).status_code == 200
+
+
+def test_reload_on_signal(tempdir):
+    app = spawn_test_app(tempdir)
+    client = Client(app)
+    old = script_url(client)
+
+    change_jquery(tempdir)
+
+    previous = signal.getsignal(signal.SIGUSR1)
+    reload_on_signal(app, signal.SIGUSR1)
+
+    try:
+        os.kill(os.getpid(), signal.SIGUSR1)
+    finally:
+        signal.signal(signal.SIGUSR1, previous)
+
+    for thread in threading.enumerate():
+        if thread.name == "more-webassets-reload":
+            thread.join()
+
+    assert app.config.webasset_registry.reloader.release == 1
+    assert script_url(client) != old
+
+
+@pytest.mark.skipif(not hasattr(signal, "SIGHUP"), reason="no SIGHUP")
+def test_reload_on_signal_default(tempdir):
+    app = spawn_test_app(tempdir)
+    previous = signal.getsignal(signal.SIGHUP)
+    reload_on_signal(app)
+
+    try:
+        assert signal.getsignal(signal.SIGHUP) is not previous
+    finally:
+        signal.signal(signal.SIGHUP, previous)
+
+
+def test_reload_debug_mode(tempdir, monkeypatch):
+    monkeypatch.setenv("MORE_WEBASSETS_DEBUG", "1")
+    monkeypatch.setenv("MORE_WEBASSETS_CHECK_INTERVAL", "0")
+
+    app = spawn_test_app(tempdir)
+    client = Client(app)
+    client.get("?bundle=common")
+
+    app.reload_webassets(wait=True)
+    injector = app.config.webasset_registry.reloader.tweens[-1][0]
+
+    # the source files are still checked for changes after a reload
+    client.get("?bundle=common")
+    assert "common" in injector._signatures
+
+    change_jquery(tempdir)
+    client.get("?bundle=common")
+    assert "return 1" in client.get(script_url(client)).text
+
+
+def test_reload_swaps_state(tempdir):
+    app = spawn_test_app(tempdir)
+    client = Client(app)
+    old = script_url(client)
+
+    publisher = app.config.webasset_registry.reloader.tweens[-1][1]
+    state = publisher.state
+
+    change_jquery(tempdir)
+    app.reload_webassets(wait=True)
+
+    # requests which started before the swap keep using the old state
+    assert state.environment is not publisher.environment
+    assert "common.bundle.js" in state.published
+    assert state.previous == ()
+
+    assert publisher.previous[-1][0] == state.environment.directory
+    assert script_url(client) != old
+
+
+def test_reload_removes_orphans(tempdir):
+    app = spawn_test_app(tempdir)
+    client = Client(app)
+    script_url(client)
+
+    # a process which is no longer running
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+
+    releases = os.path.join(tempdir, "output", RELEASES)
+    orphan = os.path.join(releases, f"{process.pid}-1")
+    os.makedirs(orphan)
+
+    app.reload_webassets(wait=True)
+
+    assert not os.path.exists(orphan)
+    assert os.listdir(releases) == [f"{os.getpid()}-1"]
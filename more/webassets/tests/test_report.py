@@ -0,0 +1,119 @@
+import gzip
+import json
+import morepath
+import os.path
+import pytest
+
+from more.webassets import WebassetsApp
+from more.webassets.cli import main
+from more.webassets.report import BudgetExceeded, BudgetWarning
+from more.webassets.report import build_report, check_budgets, format_report
+
+
+class ReportApp(WebassetsApp):
+    pass
+
+
+@ReportApp.webasset_path()
+def get_path():
+    return "fixtures"
+
+
+@ReportApp.webasset("jquery")
+def get_jquery_asset():
+    yield "jquery.js"
+
+
+@ReportApp.webasset("common")
+def get_common_asset():
+    yield "jquery"
+    yield "underscore.js"
+
+
+@ReportApp.webasset("other")
+def get_other_asset():
+    yield "jquery.js"
+    yield "extra.js"
+
+
+@ReportApp.webasset_budget("common")
+def get_common_budget():
+    return 1024
+
+
+@ReportApp.webasset_budget("other", measure="raw", warn=True)
+def get_other_budget():
+    return 1
+
+
+class ExceedingApp(ReportApp):
+    pass
+
+
+@ExceedingApp.webasset_budget("common")
+def get_exceeded_common_budget():
+    return 1
+
+
+def test_build_report(fixtures_path):
+    morepath.commit(ReportApp)
+    registry = ReportApp().config.webasset_registry
+
+    report = build_report(registry)
+    common = report["assets"]["common"]
+
+    jquery = os.path.join(fixtures_path, "jquery.js")
+    underscore = os.path.join(fixtures_path, "underscore.js")
+
+    assert [f["path"] for f in common["files"]] == [jquery, underscore]
+    assert common["raw"] == os.path.getsize(jquery) + os.path.getsize(underscore)
+    assert sum(f["share"] for f in common["files"]) == pytest.approx(1.0)
+
+    environment = registry.get_environment()
+    output = environment["common"].resolve_output()
+
+    with open(output, "rb") as f:
+        data = f.read()
+
+    assert common["minified"] == len(data)
+    assert common["compressed"] == len(gzip.compress(data))
+
+    # common includes jquery, but other does not
+    assert report["duplicates"] == {jquery: ["common", "other"]}
+
+    text = format_report(report, registry.budgets)
+    assert "common: raw" in text
+    assert "(budget 1.0 KiB compressed)" in text
+    assert f"{jquery}: common, other" in text
+
+
+def test_check_budgets():
+    morepath.commit(ReportApp)
+    registry = ReportApp().config.webasset_registry
+    report = build_report(registry)
+
+    with pytest.warns(BudgetWarning, match="other: raw size"):
+        check_budgets(registry, report)
+
+    registry.budgets["common"].limit = 1
+
+    with pytest.warns(BudgetWarning):
+        with pytest.raises(BudgetExceeded, match="common: compressed size"):
+            check_budgets(registry, report)
+
+
+def test_report_command(tempdir, capsys):
+    with pytest.warns(BudgetWarning):
+        main(["report", "more.webassets.tests.test_report:ReportApp", "--json"])
+
+    report = json.loads(capsys.readouterr().out)
+    assert set(report["assets"]) == {"common", "jquery", "other"}
+
+
+def test_export_fails_on_exceeded_budget(tempdir, capsys):
+    with pytest.raises(SystemExit):
+        with pytest.warns(BudgetWarning):
+            main(["export", "more.webassets.tests.test_report:ExceedingApp", tempdir])
+
+    assert "common: compressed size" in capsys.readouterr().err
+    assert not os.listdir(tempdir)
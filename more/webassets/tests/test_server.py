@@ -0,0 +1,78 @@
+import os
+
+from more.webassets.manifest import MANIFEST, build_manifest, read_manifest
+from more.webassets.manifest import write_manifest
+from more.webassets.server import AssetServer
+from more.webassets.tests.test_webassets import spawn_test_app
+from webtest import TestApp as Client
+
+
+def test_build_manifest(tempdir):
+    registry = spawn_test_app(tempdir).config.webasset_registry
+    environment = registry.get_environment()
+
+    manifest = build_manifest(registry, environment)
+
+    assert manifest["url"] == "assets"
+    assert manifest["assets"]["common"] == ["assets/common.bundle.js?ddc71aa3"]
+    assert manifest["assets"]["theme"] == ["assets/theme.bundle.css?32fda411"]
+    assert manifest["files"]["common.bundle.js"] == {
+        "version": "ddc71aa3",
+        "size": 38,
+    }
+
+    assert manifest["files"]["theme.bundle.css"]["version"] == "32fda411"
+
+    # the bundles of the files of the assets are not built on their own
+    assert "main.scss.bundle.css" not in manifest["files"]
+    assert MANIFEST not in manifest["files"]
+
+    path = write_manifest(manifest, environment.directory)
+    assert path == os.path.join(tempdir, "output", MANIFEST)
+    assert read_manifest(path) == manifest
+    assert read_manifest(environment.directory) == manifest
+
+
+def test_asset_server_from_app(tempdir):
+    app = spawn_test_app(tempdir)
+    client = Client(AssetServer.from_app(app, fallback=app))
+
+    response = client.get("/assets/common.bundle.js?ddc71aa3")
+    assert response.text == "var $=function(){};var _=function(){};"
+    assert response.content_type in ("text/javascript", "application/javascript")
+    assert response.cache_control.max_age == 10 * 365 * 24 * 60 * 60
+    assert response.etag == "ddc71aa3"
+
+    response = client.get(
+        "/assets/common.bundle.js",
+        headers={"If-None-Match": '"ddc71aa3"'},
+        status=304,
+    )
+    assert not response.body
+
+    assert not client.head("/assets/common.bundle.js").body
+    assert client.post("/assets/common.bundle.js", status=405)
+
+    # unknown files and the manifest itself are not served
+    assert client.get("/assets/foo.js", status=404)
+    assert client.get("/assets/manifest.json", status=404)
+    assert client.get("/assets/../output/common.bundle.js", status=404)
+
+    # everything else is passed to the application
+    assert "<head></head>" in client.get("/").text
+
+
+def test_asset_server_from_manifest(tempdir):
+    app = spawn_test_app(tempdir)
+    AssetServer.from_app(app)
+
+    output = os.path.join(tempdir, "output")
+    client = Client(AssetServer.from_manifest(os.path.join(output, MANIFEST)))
+
+    assert client.get("/assets/theme.bundle.css").text == (
+        "body a {\n  color: blue; }\n"
+    )
+    assert client.get("/", status=404)
+
+    client = Client(AssetServer.from_manifest(output))
+    assert client.get("/assets/theme.bundle.css").status_code == 200
@@ -0,0 +1,111 @@
+import json
+import morepath
+import os.path
+
+from more.webassets.serviceworker import PRECACHE_MANIFEST, SERVICE_WORKER
+from more.webassets.serviceworker import build_precache_manifest
+from more.webassets.tests.test_webassets import spawn_test_app
+from more.webassets.tweens import InjectorTween
+from webtest import TestApp as Client
+
+
+def spawn_service_worker_app(tempdir):
+    app = spawn_test_app(tempdir)
+
+    @app.__class__.webasset_service_worker()
+    def get_service_worker_scope():
+        return "/"
+
+    morepath.commit(app.__class__)
+
+    return app.__class__()
+
+
+def test_precache_manifest(tempdir):
+    app = spawn_service_worker_app(tempdir)
+    registry = app.config.webasset_registry
+    env = registry.get_environment()
+
+    manifest = build_precache_manifest(registry, env)
+
+    assert manifest["assets"]["common"] == ["/assets/common.bundle.js?ddc71aa3"]
+    assert manifest["assets"]["theme"] == ["/assets/theme.bundle.css?32fda411"]
+    assert len(manifest["version"]) == 12
+
+    # the bundles of the files of the assets are never loaded on their own
+    assert set(manifest["assets"]) == {"common", "extra", "theme"}
+
+    # the version changes with the urls
+    cdn = build_precache_manifest(registry, env, "https://cdn.example.org/")
+    assert cdn["assets"]["common"] == [
+        "https://cdn.example.org/assets/common.bundle.js?ddc71aa3"
+    ]
+    assert cdn["version"] != manifest["version"]
+
+
+def test_serve_service_worker(tempdir):
+    client = Client(spawn_service_worker_app(tempdir))
+
+    page = client.get("?bundle=common").text
+    assert (
+        'navigator.serviceWorker.register("/assets/service-worker.js", '
+        '{"scope": "/"});'
+    ) in page
+
+    response = client.get("/assets/service-worker.js")
+    assert response.content_type == "application/javascript"
+    assert response.headers["Cache-Control"] == "no-cache"
+    assert response.headers["Service-Worker-Allowed"] == "/"
+    assert response.expires is None
+    assert '"/assets/common.bundle.js?ddc71aa3"' in response.text
+    assert "caches.delete(key)" in response.text
+
+    etag = response.headers["ETag"]
+    response = client.get(
+        "/assets/service-worker.js", headers={"If-None-Match": etag}, status=304
+    )
+
+    manifest = client.get("/assets/precache-manifest.json").json
+    assert manifest["version"] == etag.strip('"')
+    assert manifest["assets"]["extra"] == ["/assets/extra.bundle.js?09ff425f"]
+
+    # both are written to the output directory as well
+    output = os.path.join(tempdir, "output")
+
+    with open(os.path.join(output, PRECACHE_MANIFEST)) as f:
+        assert json.load(f) == manifest
+
+    with open(os.path.join(output, SERVICE_WORKER)) as f:
+        assert f.read() == client.get("/assets/service-worker.js").text
+
+
+def test_service_worker_injector_locks(tempdir, monkeypatch):
+    calls = []
+    original = InjectorTween.building
+
+    def building(self, environment, resources):
+        calls.append(set(resources))
+        return original(self, environment, resources)
+
+    monkeypatch.setattr(InjectorTween, "building", building)
+
+    # the bundles are not built by a request at the same time
+    client = Client(spawn_service_worker_app(tempdir))
+    client.get("/assets/service-worker.js")
+
+    assert calls == [{"common", "extra", "theme"}]
+
+
+def test_service_worker_debug_mode(tempdir, monkeypatch):
+    monkeypatch.setenv("MORE_WEBASSETS_DEBUG", "1")
+    client = Client(spawn_service_worker_app(tempdir))
+
+    assert "serviceWorker" not in client.get("?bundle=common").text
+    client.get("/assets/service-worker.js", status=404)
+
+
+def test_service_worker_disabled(tempdir):
+    client = Client(spawn_test_app(tempdir))
+
+    assert "serviceWorker" not in client.get("?bundle=common").text
+    client.get("/assets/service-worker.js", status=404)
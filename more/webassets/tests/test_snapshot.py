@@ -0,0 +1,113 @@
+import json
+import morepath
+import os.path
+import pytest
+
+from more.webassets import WebassetsApp
+from more.webassets.cli import main
+from more.webassets.directives import WebassetRegistry
+from more.webassets.snapshot import fingerprint, read_snapshot, write_snapshot
+
+
+def spawn_snapshot_app(tempdir, snapshot=None):
+    class App(WebassetsApp):
+        pass
+
+    if snapshot:
+
+        @App.webasset_snapshot()
+        def get_snapshot_path():
+            return snapshot
+
+    @App.webasset_path()
+    def get_path():
+        return os.path.join(tempdir, "src")
+
+    @App.webasset("common")
+    def get_common():
+        yield "a.js"
+        yield "b.css"
+
+    morepath.commit(App)
+
+    return App()
+
+
+@pytest.fixture
+def sources(tempdir):
+    os.mkdir(os.path.join(tempdir, "src"))
+
+    for name in ("a.js", "b.css"):
+        with open(os.path.join(tempdir, "src", name), "w") as f:
+            f.write(name)
+
+    return os.path.join(tempdir, "src")
+
+
+def test_fingerprint():
+    def make(value):
+        def get_value():
+            return value
+
+        return get_value
+
+    assert fingerprint(make("a")) == fingerprint(make("a"))
+    assert fingerprint(make("a")) != fingerprint(make("b"))
+    assert fingerprint(make("a"), 1) != fingerprint(make("a"), 2)
+
+    # values without a stable description can't be fingerprinted
+    assert fingerprint(make(object())) is None
+    assert fingerprint(make(["a"])) is None
+
+
+def test_snapshot(tempdir, sources, monkeypatch):
+    path = os.path.join(tempdir, "snapshot.json")
+
+    registry = spawn_snapshot_app(tempdir).config.webasset_registry
+    snapshot = write_snapshot(registry, path)
+
+    assert len(snapshot["results"]) == 2
+    assert read_snapshot(path) == snapshot["results"]
+
+    # with the snapshot, the filesystem is not touched
+    def find_file(self, name):
+        raise AssertionError(f"searched for {name}")
+
+    monkeypatch.setattr(WebassetRegistry, "find_file", find_file)
+    monkeypatch.setattr(os.path, "isdir", lambda path: False)
+
+    registry = spawn_snapshot_app(tempdir, path).config.webasset_registry
+    assert registry.paths == [sources]
+    assert registry.assets["a.js"].path == os.path.join(sources, "a.js")
+    assert registry.results == snapshot["results"]
+
+    # changed directives are performed as usual
+    with pytest.raises(AssertionError):
+        spawn_snapshot_app(tempdir + "/other", path)
+
+
+def test_snapshot_incompatible(tempdir, sources):
+    path = os.path.join(tempdir, "snapshot.json")
+    write_snapshot(spawn_snapshot_app(tempdir).config.webasset_registry, path)
+
+    with open(path) as f:
+        snapshot = json.load(f)
+
+    snapshot["python"] = [2, 7]
+
+    with open(path, "w") as f:
+        json.dump(snapshot, f)
+
+    assert read_snapshot(path) == {}
+    assert read_snapshot(os.path.join(tempdir, "missing.json")) == {}
+
+
+def test_snapshot_command(tempdir, capsys):
+    path = os.path.join(tempdir, "snapshot.json")
+    main(["snapshot", "more.webassets.tests.test_cli:ExportApp", path])
+
+    assert capsys.readouterr().out == f"{path}: 2 directive results\n"
+    assert len(read_snapshot(path)) == 2
+
+    with pytest.raises(SystemExit):
+        main(["snapshot", "more.webassets.tests.test_cli:ExportApp"])
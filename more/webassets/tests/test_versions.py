@@ -0,0 +1,131 @@
+import hashlib
+import more.webassets.versions
+import os
+import pytest
+
+from more.webassets.tests.test_webassets import spawn_test_app
+from more.webassets.tweens import save_versions
+from more.webassets.versions import VERSIONS, VersionCache, hash_file
+from webtest import TestApp as Client
+
+
+def test_hash_file(tempdir, monkeypatch):
+    path = os.path.join(tempdir, "file.js")
+
+    with open(path, "wb") as f:
+        f.write(b"var a = 1;")
+
+    expected = hashlib.md5(b"var a = 1;").hexdigest()
+    assert hash_file(path) == expected
+
+    monkeypatch.setattr(more.webassets.versions, "MMAP_THRESHOLD", 0)
+    assert hash_file(path) == expected
+
+
+def test_version_cache(tempdir, monkeypatch):
+    path = os.path.join(tempdir, "file.js")
+
+    with open(path, "wb") as f:
+        f.write(b"var a = 1;")
+
+    cache = VersionCache(tempdir)
+    digest = cache.hash(path)
+    assert digest == hashlib.md5(b"var a = 1;").hexdigest()
+
+    # the hashes are written once they are saved
+    assert not os.path.isfile(os.path.join(tempdir, VERSIONS))
+    cache.save()
+    assert os.path.isfile(os.path.join(tempdir, VERSIONS))
+
+    def fail(*args, **kwargs):
+        raise AssertionError("unexpected hashing")
+
+    # another process loads the hashes from the cache file
+    with monkeypatch.context() as m:
+        m.setattr(more.webassets.versions, "hash_file", fail)
+        assert VersionCache(tempdir).hash(path) == digest
+
+    # changed files are hashed again
+    with open(path, "wb") as f:
+        f.write(b"var a = 2;")
+
+    cache = VersionCache(tempdir)
+    assert cache.hash(path) == hashlib.md5(b"var a = 2;").hexdigest()
+
+    os.remove(path)
+
+    with pytest.raises(OSError):
+        cache.hash(path)
+
+
+def test_version_cache_saves_once(tempdir, monkeypatch):
+    paths = []
+
+    for index in range(10):
+        paths.append(os.path.join(tempdir, f"file{index}.js"))
+
+        with open(paths[-1], "wb") as f:
+            f.write(b"var a = %d;" % index)
+
+    writes = []
+    original = os.replace
+
+    def replace(source, target):
+        writes.append(target)
+        original(source, target)
+
+    monkeypatch.setattr(more.webassets.versions.os, "replace", replace)
+
+    cache = VersionCache(tempdir)
+
+    for path in paths:
+        cache.hash(path)
+
+    cache.save()
+    cache.save()  # nothing new to write
+
+    assert writes == [os.path.join(tempdir, VERSIONS)]
+
+
+def test_version_cache_etag(tempdir, monkeypatch):
+    app = spawn_test_app(tempdir)
+    client = Client(app)
+    client.get("?bundle=common")
+
+    url = "/assets/common.bundle.js?ddc71aa3"
+    etag = client.get(url).etag
+
+    assert etag.startswith("ddc71aa3")
+
+    response = client.get(url, headers={"If-None-Match": f'"{etag}"'}, status=304)
+    assert response.etag == etag
+    assert response.cache_control.max_age
+
+    # new processes reuse the hashes of the cache
+    def fail(*args, **kwargs):
+        raise AssertionError("unexpected hashing")
+
+    monkeypatch.setattr(more.webassets.versions, "hash_file", fail)
+
+    client = Client(app.__class__())
+    client.get("?bundle=common")
+
+    assert client.get(url).etag == etag
+
+
+def test_cached_hash_version(tempdir, monkeypatch):
+    registry = spawn_test_app(tempdir).config.webasset_registry
+
+    env = registry.get_environment()
+    env.manifest = False
+    assert env["common"].urls() == ["assets/common.bundle.js?ddc71aa3"]
+    save_versions(env)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("unexpected hashing")
+
+    monkeypatch.setattr(more.webassets.versions, "hash_file", fail)
+
+    env = registry.get_environment()
+    env.manifest = False
+    assert env["common"].urls() == ["assets/common.bundle.js?ddc71aa3"]
@@ -2,10 +2,22 @@ import more.webassets
 import morepath
 import os
 import pytest
+import re
+import threading
+import time
+import webob
 
 from datetime import datetime
 from more.webassets import WebassetsApp
+from more.webassets.core import IncludeRequest
+from more.webassets.manifest import export
+from more.webassets.report import build_report
+from more.webassets.serviceworker import build_precache_manifest
+from more.webassets.tweens import CHDIR_FILTERS, InjectorTween, PublisherTween
+from more.webassets.tweens import bundle_filter_names
 from more.webassets.tweens import is_subpath, has_insecure_path_element
+from more.webassets.tweens import published_files
+from webassets.filter import Filter
 from webtest import TestApp as Client
 
 
@@ -136,6 +148,22 @@ def spawn_test_app(tempdir):
         request.include("common")
         return html
 
+    @App.html(model=Root, name="hints")
+    def hints(self, request):
+        for bundle, hints in request.params.items():
+            request.include(bundle, *(hints.split(",") if hints else ()))
+
+        return html
+
+    @App.html(model=Root, name="prefetch")
+    def prefetch(self, request):
+        request.include("common")
+        request.prefetch("common")
+        request.prefetch("extra", "module")
+        request.prefetch("theme")
+        request.prefetch("theme")
+        return html
+
     @App.html(model=Root, name="alljs")
     def alljs(self, request):
         request.include("common")
@@ -176,6 +204,74 @@ def test_inject_webassets(tempdir):
     assert page.find("common.bundle.js") < page.find("extra.bundle.js")
 
 
+def test_inject_webassets_with_hints(tempdir):
+    client = Client(spawn_test_app(tempdir))
+
+    page = client.get("/hints?common=defer&extra=async,module").text
+    assert (
+        '<script type="text/javascript" '
+        'src="/assets/common.bundle.js?ddc71aa3" defer></script>'
+    ) in page
+    assert '<script type="module" src="/assets/extra.bundle.js?' in page
+    assert 'extra.bundle.js?09ff425f" async></script>' in page
+
+    page = client.get("/hints?theme=nonblocking").text
+    assert (
+        '<link rel="stylesheet" type="text/css" '
+        'href="/assets/theme.bundle.css?32fda411" '
+        'media="print" onload="this.media=\'all\'">'
+        '<noscript><link rel="stylesheet" type="text/css" '
+        'href="/assets/theme.bundle.css?32fda411"></noscript></head>'
+    ) in page
+
+    # lazy assets are only loaded once the loader is asked for them
+    page = client.get("/hints?common=&extra=lazy").text
+    assert 'src="/assets/common.bundle.js' in page
+    assert 'src="/assets/extra.bundle.js' not in page
+    assert (
+        '{"extra": {"module": false, "urls": ["/assets/extra.bundle.js?09ff425f"]}}'
+    ) in page
+    assert page.find("moreWebassets") < page.find('src="/assets/common.bundle.js')
+
+    assert "moreWebassets" not in client.get("?bundle=common").text
+
+
+def test_prefetch_webassets(tempdir):
+    client = Client(spawn_test_app(tempdir))
+    page = client.get("/prefetch").text
+
+    head = page.split("</head>")[0]
+    assert head.count("<link") == 2
+    assert '<link rel="modulepreload" href="/assets/extra.bundle.js?09ff425f">' in head
+    assert '<link rel="prefetch" href="/assets/theme.bundle.css?32fda411">' in head
+
+    # included bundles are not prefetched
+    assert "common" not in head
+    assert 'src="/assets/common.bundle.js?ddc71aa3"' in page
+
+    assert "prefetch" not in client.get("?bundle=common").text
+
+
+def test_include_hints():
+    request = IncludeRequest.blank("/", app=None)
+
+    request.include("a", "defer", "module")
+    request.include("a", "defer")
+    request.include("b", "lazy")
+    request.include("b")
+    request.include("c", "async")
+
+    assert list(request.included_assets) == ["a", "b", "c"]
+    assert request.asset_hints == {
+        "a": {"defer", "module"},
+        "b": set(),
+        "c": {"async"},
+    }
+
+    with pytest.raises(AssertionError):
+        request.include("d", "later")
+
+
 def test_publish_webassets(tempdir):
     client = Client(spawn_test_app(tempdir))
 
@@ -229,3 +325,776 @@ def test_insecure_path_element():
     assert has_insecure_path_element("/test.txt")
     assert not has_insecure_path_element("test.txt")
     assert not has_insecure_path_element("asdf/asdf/test.txt")
+
+
+def test_published_files(tempdir):
+    app = spawn_test_app(tempdir)
+    env = app.config.webasset_registry.get_environment()
+
+    assert published_files(env) == {
+        "common.bundle.js",
+        "extra.bundle.js",
+        "extra.js.bundle.js",
+        "jquery.js.bundle.js",
+        "main.scss.bundle.css",
+        "theme.bundle.css",
+        "underscore.js.bundle.js",
+    }
+
+
+def test_publish_unknown_files_without_filesystem_access(tempdir, monkeypatch):
+    client = Client(spawn_test_app(tempdir))
+    client.get("?bundle=common")
+
+    def fail(*args, **kwargs):
+        raise AssertionError("unexpected filesystem access")
+
+    monkeypatch.setattr(os, "lstat", fail)
+    monkeypatch.setattr(os.path, "realpath", fail)
+    monkeypatch.setattr(os.path, "isfile", fail)
+
+    for url in (
+        "/assets/foo.js",
+        "/assets/../output/common.bundle.js",
+        "/assets/.webassets-cache",
+        "/assets/common.bundle.js/x",
+    ):
+        assert client.get(url, expect_errors=True).status_code == 404
+
+
+def test_publish_refresh(tempdir):
+    app = spawn_test_app(tempdir)
+    env = app.config.webasset_registry.get_environment()
+    publisher = PublisherTween(env, lambda request: webob.Response("app"))
+
+    def get(url):
+        return publisher(webob.Request.blank(url))
+
+    with open(os.path.join(tempdir, "output", "robots.txt"), "w") as f:
+        f.write("User-agent: *")
+
+    assert get("/assets/robots.txt").status_code == 404
+    assert get("/").text == "app"
+
+    publisher.publish("robots.txt")
+    assert get("/assets/robots.txt").text == "User-agent: *"
+    assert get("/assets/robots.txt").expires.year == datetime.utcnow().year + 10
+
+    publisher.refresh()
+    assert get("/assets/robots.txt").status_code == 404
+
+    with pytest.raises(AssertionError):
+        publisher.publish("../robots.txt")
+
+
+@pytest.mark.parametrize(
+    "header,prefix,expected",
+    [
+        ("X-Accel-Redirect", "/internal-assets/", "/internal-assets"),
+        ("X-Sendfile", "/srv/assets", "/srv/assets"),
+        ("X-Sendfile", None, None),
+    ],
+)
+def test_publish_offload(tempdir, header, prefix, expected):
+    app = spawn_test_app(tempdir)
+
+    @app.__class__.webasset_offload(header)
+    def get_offload_prefix():
+        return prefix
+
+    morepath.commit(app.__class__)
+
+    client = Client(app.__class__())
+    client.get("?bundle=common")
+
+    response = client.get("/assets/common.bundle.js?ddc71aa3")
+    expected = expected or os.path.join(tempdir, "output")
+
+    assert response.body == b""
+    assert response.headers[header] == expected + "/common.bundle.js"
+    assert response.content_type in ("text/javascript", "application/javascript")
+    assert response.expires.year == datetime.utcnow().year + 10
+
+    # files which are not published are still not served
+    assert client.get("/assets/foo.js", expect_errors=True).status_code == 404
+
+
+def test_debug_mode_change_detection(tempdir, monkeypatch):
+    monkeypatch.setenv("MORE_WEBASSETS_DEBUG", "1")
+    monkeypatch.setenv("MORE_WEBASSETS_CHECK_INTERVAL", "0")
+
+    calls = []
+    original = more.webassets.tweens.bundle_urls
+
+    def bundle_urls(environment, name):
+        calls.append(name)
+        return original(environment, name)
+
+    monkeypatch.setattr(more.webassets.tweens, "bundle_urls", bundle_urls)
+
+    client = Client(spawn_test_app(tempdir))
+
+    page = client.get("?bundle=common").text
+    assert calls == ["common"]
+    assert "webassets-external" in page
+
+    # the source files are served as they are, without long term caching
+    url = page.split('src="')[1].split('"')[0]
+    assert "fake jquery" in client.get(url).text
+    assert client.get(url).expires is None
+
+    # unchanged sources do not lead to the urls being resolved again
+    assert client.get("?bundle=common").text == page
+    assert calls == ["common"]
+
+    with open(os.path.join(tempdir, "common", "jquery.js"), "a") as f:
+        f.write("var jQuery = $;")
+
+    client.get("?bundle=common")
+    assert calls == ["common", "common"]
+
+    client.get("?bundle=common")
+    assert calls == ["common", "common"]
+
+
+def test_debug_mode_check_interval(tempdir, monkeypatch):
+    monkeypatch.setenv("MORE_WEBASSETS_DEBUG", "1")
+    monkeypatch.setenv("MORE_WEBASSETS_CHECK_INTERVAL", "3600")
+
+    calls = []
+    original = more.webassets.tweens.bundle_urls
+
+    def bundle_urls(environment, name):
+        calls.append(name)
+        return original(environment, name)
+
+    monkeypatch.setattr(more.webassets.tweens, "bundle_urls", bundle_urls)
+
+    client = Client(spawn_test_app(tempdir))
+    client.get("?bundle=common")
+
+    with open(os.path.join(tempdir, "common", "jquery.js"), "a") as f:
+        f.write("var jQuery = $;")
+
+    client.get("?bundle=common")
+    assert calls == ["common"]
+
+
+def test_invalid_check_interval(tempdir, monkeypatch):
+    monkeypatch.setenv("MORE_WEBASSETS_CHECK_INTERVAL", "soon")
+
+    app = spawn_test_app(tempdir)
+    assert app.config.webasset_registry.get_environment().check_interval == 1.0
+
+    client = Client(app)
+    assert "common.bundle.js" in client.get("?bundle=common").text
+
+
+@pytest.mark.parametrize("debug", [False, True])
+def test_injector_single_flight(tempdir, monkeypatch, debug):
+    app = spawn_test_app(tempdir)
+    env = app.config.webasset_registry.get_environment()
+    env.debug = debug
+
+    calls = []
+    original = more.webassets.tweens.bundle_urls
+
+    def bundle_urls(environment, name):
+        calls.append(name)
+        time.sleep(0.05)  # give the other threads time to pile up
+        return original(environment, name)
+
+    monkeypatch.setattr(more.webassets.tweens, "bundle_urls", bundle_urls)
+
+    injector = InjectorTween(env, None, check_interval=3600)
+    barrier = threading.Barrier(8)
+    results = []
+
+    def resolve(resource):
+        barrier.wait()
+        results.append(injector.urls_by_resource(resource))
+
+    threads = [
+        threading.Thread(target=resolve, args=(resource,))
+        for resource in ("common", "extra") * 4
+    ]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert sorted(calls) == ["common", "extra"]
+    assert len(results) == 8
+    assert len(set(results)) == 2
+
+    # once resolved, the urls are returned without resolving them again
+    assert injector.urls_by_resource("common") in results
+    assert len(calls) == 2
+
+
+def test_injector_parallel_builds(tempdir, monkeypatch):
+    app = spawn_test_app(tempdir)
+    env = app.config.webasset_registry.get_environment()
+
+    running = set()
+    overlaps = []
+    original = more.webassets.tweens.bundle_urls
+
+    def bundle_urls(environment, name):
+        overlaps.append((name, frozenset(running)))
+        running.add(name)
+        time.sleep(0.1)  # give the other threads time to start building
+        running.discard(name)
+        return original(environment, name)
+
+    monkeypatch.setattr(more.webassets.tweens, "bundle_urls", bundle_urls)
+
+    injector = InjectorTween(env, None, check_interval=3600)
+    barrier = threading.Barrier(3)
+
+    def resolve(resource):
+        barrier.wait()
+        injector.urls_by_resource(resource)
+
+    # extra and extra.js share a source file, common is on its own
+    threads = [
+        threading.Thread(target=resolve, args=(resource,))
+        for resource in ("common", "extra", "extra.js")
+    ]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    # common is built at the same time as one of the others
+    overlaps = dict(overlaps)
+    others = overlaps["extra"] | overlaps["extra.js"]
+    assert "common" in others or overlaps["common"]
+    assert "extra" not in overlaps["extra.js"]
+    assert "extra.js" not in overlaps["extra"]
+
+
+def test_bundle_filter_names(tempdir):
+    env = spawn_test_app(tempdir).config.webasset_registry.get_environment()
+
+    # pyscss changes the working directory, those builds are serialised
+    assert "pyscss" in set(bundle_filter_names(env["theme"]))
+    assert CHDIR_FILTERS.isdisjoint(bundle_filter_names(env["common"]))
+
+
+def test_chunked_bundles(tempdir):
+    def write(name, content):
+        with open(os.path.join(tempdir, name), "w") as f:
+            f.write(content)
+
+    write("a.js", "var a = 1;" * 6)
+    write("b.js", "var b = 2;" * 6)
+    write("c.js", "var c = 3;" * 10)
+    write("d.js", "var d = 4;")
+
+    class App(WebassetsApp):
+        pass
+
+    @App.webasset_path()
+    def get_path():
+        return tempdir
+
+    @App.webasset_output()
+    def get_output_path():
+        return os.path.join(tempdir, "output")
+
+    @App.webasset("chunked", chunk_size=150)
+    def get_chunked():
+        yield "a.js"
+        yield "b.js"
+        yield "c.js"
+
+    @App.webasset("page")
+    def get_page():
+        yield "chunked"
+        yield "d.js"
+
+    morepath.commit(App)
+
+    env = App().config.webasset_registry.get_environment()
+    injector = InjectorTween(env, None)
+    urls = injector.urls_by_resource("chunked")
+
+    assert [url.split("?")[0] for url in urls] == [
+        "assets/chunked.1.bundle.js",
+        "assets/chunked.2.bundle.js",
+    ]
+
+    with open(os.path.join(tempdir, "output", "chunked.1.bundle.js")) as f:
+        assert f.read() == "var a = 1;" * 6 + "\n" + "var b = 2;" * 6
+
+    # chunks are not merged with the other bundles of including assets
+    assert [url.split("?")[0] for url in injector.urls_by_resource("page")] == [
+        "assets/chunked.1.bundle.js",
+        "assets/chunked.2.bundle.js",
+        "assets/d.js.bundle.js",
+    ]
+
+    # a change only invalidates the chunk containing the changed file
+    write("c.js", "var c = 4;" * 10)
+    os.utime(os.path.join(tempdir, "c.js"), (time.time() + 10, time.time() + 10))
+
+    env = App().config.webasset_registry.get_environment()
+    changed = InjectorTween(env, None).urls_by_resource("chunked")
+
+    assert changed[0] == urls[0]
+    assert changed[1] != urls[1]
+
+
+def test_vendor_bundles(tempdir):
+    for directory in ("vendor", "src", "output"):
+        os.mkdir(os.path.join(tempdir, directory))
+
+    def write(name, content):
+        with open(os.path.join(tempdir, name), "w") as f:
+            f.write(content)
+
+    write("vendor/react.js", "var React = {};")
+    write("vendor/lodash.js", "var _ = {};")
+    write("src/app.js", "var app = 1;")
+    write("src/app.css", ".app {}")
+
+    class App(WebassetsApp):
+        pass
+
+    @App.webasset_path(vendor=True)
+    def get_vendor_path():
+        return os.path.join(tempdir, "vendor")
+
+    @App.webasset_path()
+    def get_src_path():
+        return os.path.join(tempdir, "src")
+
+    @App.webasset_output()
+    def get_output_path():
+        return os.path.join(tempdir, "output")
+
+    @App.webasset("libs")
+    def get_libs():
+        yield "react.js"
+        yield "lodash.js"
+
+    @App.webasset("bundle")
+    def get_bundle():
+        yield "react.js"
+        yield "lodash.js"
+        yield "app.js"
+
+    @App.webasset("page")
+    def get_page():
+        yield "libs"
+        yield "app.js"
+        yield "app.css"
+
+    morepath.commit(App)
+
+    registry = App().config.webasset_registry
+    assert registry.vendor_paths == {os.path.join(tempdir, "vendor")}
+
+    injector = InjectorTween(registry.get_environment(), None)
+
+    def outputs(resource):
+        return [url.split("?")[0] for url in injector.urls_by_resource(resource)]
+
+    assert outputs("libs") == ["assets/libs.bundle.js"]
+    assert outputs("bundle") == [
+        "assets/bundle.vendor.bundle.js",
+        "assets/bundle.app.bundle.js",
+    ]
+    assert outputs("page") == [
+        "assets/libs.bundle.js",
+        "assets/app.js.bundle.js",
+        "assets/app.css.bundle.css",
+    ]
+
+    with open(os.path.join(tempdir, "output", "bundle.vendor.bundle.js")) as f:
+        assert f.read() == "var React = {};\nvar _ = {};"
+
+
+class LetFilter(Filter):
+    """Replaces let with var, like a (very) poor transpiler."""
+
+    name = "let"
+
+    def output(self, _in, out, **kwargs):
+        out.write(_in.read().replace("let ", "var "))
+
+
+def spawn_legacy_app(tempdir, legacy_browser=None):
+    for directory in ("src", "output"):
+        os.mkdir(os.path.join(tempdir, directory))
+
+    for name, content in (("app.js", "let app = 1;"), ("app.css", ".app {}")):
+        with open(os.path.join(tempdir, "src", name), "w") as f:
+            f.write(content)
+
+    class App(WebassetsApp):
+        pass
+
+    @App.webasset_path()
+    def get_src_path():
+        return os.path.join(tempdir, "src")
+
+    @App.webasset_output()
+    def get_output_path():
+        return os.path.join(tempdir, "output")
+
+    @App.webasset_filter("js", legacy=True)
+    def get_legacy_js_filter():
+        return LetFilter()
+
+    if legacy_browser:
+
+        @App.webasset_legacy_browser()
+        def get_legacy_browser():
+            return legacy_browser
+
+    @App.webasset("page")
+    def get_page():
+        yield "app.js"
+        yield "app.css"
+
+    @App.path("")
+    class Root:
+        pass
+
+    @App.html(model=Root)
+    def index(self, request):
+        request.include("page", "defer")
+        return "<html><head></head><body></body></html>"
+
+    morepath.commit(App)
+
+    return App()
+
+
+def test_legacy_bundles(tempdir):
+    client = Client(spawn_legacy_app(tempdir))
+    page = client.get("/").text
+
+    assert (
+        '<script type="module" src="/assets/app.js.bundle.js?bdbf094f" defer>'
+    ) in page
+    assert (
+        '<script type="text/javascript" '
+        'src="/assets/app.js.legacy.bundle.js?abf10674" defer nomodule>'
+    ) in page
+    assert page.count("app.css.bundle.css") == 1
+
+    assert client.get("/assets/app.js.bundle.js").text == "let app = 1;"
+    assert client.get("/assets/app.js.legacy.bundle.js").text == "var app = 1;"
+
+
+def test_legacy_bundles_export(tempdir):
+    registry = spawn_legacy_app(tempdir).config.webasset_registry
+    manifest = export(registry, os.path.join(tempdir, "exported"))
+
+    # the legacy builds are exported without a page having been rendered
+    assert manifest["assets"]["page.legacy"] == [
+        "assets/app.js.legacy.bundle.js?abf10674"
+    ]
+
+    exported = os.path.join(tempdir, "exported", "assets")
+    assert os.path.isfile(os.path.join(exported, "app.js.legacy.bundle.js"))
+
+
+def test_legacy_browser(tempdir):
+    calls = []
+
+    def is_legacy(user_agent):
+        calls.append(user_agent)
+        return "Trident/" in user_agent
+
+    client = Client(spawn_legacy_app(tempdir, is_legacy))
+
+    for i in range(2):
+        page = client.get("/", headers={"User-Agent": "Mozilla/5.0"}).text
+        assert '<script type="text/javascript" src="/assets/app.js.bundle' in page
+        assert "legacy" not in page
+
+        page = client.get("/", headers={"User-Agent": "Trident/7.0"}).text
+        assert "/assets/app.js.legacy.bundle.js" in page
+        assert "nomodule" not in page
+
+    # the results are cached by user agent
+    assert calls == ["Mozilla/5.0", "Trident/7.0"]
+
+
+def test_legacy_bundles_debug_mode(tempdir, monkeypatch):
+    monkeypatch.setenv("MORE_WEBASSETS_DEBUG", "1")
+    page = Client(spawn_legacy_app(tempdir)).get("/").text
+
+    assert "legacy" not in page
+    assert "nomodule" not in page
+
+
+def spawn_variant_app(tempdir):
+    os.mkdir(os.path.join(tempdir, "src"))
+    os.mkdir(os.path.join(tempdir, "output"))
+
+    with open(os.path.join(tempdir, "src", "theme.scss"), "w") as f:
+        f.write("body { background: $background; }")
+
+    with open(os.path.join(tempdir, "src", "theme.js"), "w") as f:
+        f.write("var theme = 1;")
+
+    class App(WebassetsApp):
+        pass
+
+    @App.webasset_path()
+    def get_src_path():
+        return os.path.join(tempdir, "src")
+
+    @App.webasset_output()
+    def get_output_path():
+        return os.path.join(tempdir, "output")
+
+    @App.webasset_filter("scss", produces="css")
+    def get_scss_filter():
+        return "pyscss"
+
+    @App.webasset(
+        "theme",
+        variants={
+            "light": {"background": "white"},
+            "dark": {"background": "black"},
+        },
+    )
+    def get_theme():
+        yield "theme.scss"
+        yield "theme.js"
+
+    @App.webasset("mode", variants=["compact", "cozy"])
+    def get_mode():
+        yield "theme.js"
+
+    @App.path("")
+    class Root:
+        pass
+
+    @App.html(model=Root)
+    def index(self, request):
+        request.include("theme", variant=request.params.get("variant"))
+        return "<html><head></head><body></body></html>"
+
+    morepath.commit(App)
+
+    return App()
+
+
+def test_variant_bundles(tempdir):
+    app = spawn_variant_app(tempdir)
+    registry = app.config.webasset_registry
+
+    assert registry.variants == {
+        "theme": {"light": "theme", "dark": "theme@dark"},
+        "mode": {"compact": "mode", "cozy": "mode@cozy"},
+    }
+    assert registry.assets["mode"].variants == {
+        "compact": {"variant": "compact"},
+        "cozy": {"variant": "cozy"},
+    }
+
+    client = Client(app)
+
+    def stylesheet(page):
+        url = re.search(r'href="([^"]+)"', page).group(1)
+        return url, client.get(url).text
+
+    url, css = stylesheet(client.get("/").text)
+    assert url.startswith("/assets/theme.scss.light.bundle.css?")
+    assert "background: white" in css
+
+    assert stylesheet(client.get("/?variant=light").text) == (url, css)
+
+    url, css = stylesheet(client.get("/?variant=dark").text)
+    assert url.startswith("/assets/theme.scss.dark.bundle.css?")
+    assert "background: black" in css
+
+    # the scripts are the same (only the stylesheets have a prelude), so
+    # they are published once
+    page = client.get("/?variant=dark").text
+    assert "/assets/theme.js.bundle.js" in page
+    assert "/assets/theme.js.bundle.js" in client.get("/").text
+
+    with pytest.raises(KeyError):
+        client.get("/?variant=blue")
+
+
+def test_variant_bundles_builders(tempdir):
+    app = spawn_variant_app(tempdir)
+    registry = app.config.webasset_registry
+
+    # theme.scss has no default for $background, it is only built as part
+    # of the variants of theme
+    assert registry.resources(registry.get_environment()) == {
+        "theme": "theme",
+        "theme@dark": "theme",
+        "mode": "mode",
+        "mode@cozy": "mode",
+    }
+
+    manifest = export(registry, os.path.join(tempdir, "exported"))
+    exported = os.path.join(tempdir, "exported", "assets")
+
+    assert [url.split("?")[0] for url in manifest["assets"]["theme@dark"]] == [
+        "assets/theme.js.bundle.js",
+        "assets/theme.scss.dark.bundle.css",
+    ]
+    assert os.path.isfile(os.path.join(exported, "theme.scss.light.bundle.css"))
+    assert os.path.isfile(os.path.join(exported, "theme.scss.dark.bundle.css"))
+    assert not os.path.exists(os.path.join(exported, "theme.scss.bundle.css"))
+
+    report = build_report(registry)
+    assert set(report["assets"]) == {"theme", "theme@dark", "mode", "mode@cozy"}
+
+    precache = build_precache_manifest(registry, registry.get_environment())
+    assert set(precache["assets"]) == set(report["assets"])
+
+    client = Client(app)
+    client.get("/?variant=dark")
+    app.reload_webassets(wait=True)
+
+    page = client.get("/?variant=dark").text
+    assert "/assets/theme.scss.dark.bundle.css?" in page
+
+
+def test_build_variants_in_parallel(tempdir, monkeypatch):
+    app = spawn_test_app(tempdir)
+    env = app.config.webasset_registry.get_environment()
+
+    calls = []
+    threads = set()
+
+    def record(environment, name):
+        calls.append(name)
+        threads.add(threading.get_ident())
+        time.sleep(0.05)  # give the other thread time to start building
+        return [name]
+
+    monkeypatch.setattr(more.webassets.tweens, "bundle_urls", record)
+
+    siblings = ("common", "extra")
+    variants = {"common": siblings, "extra": siblings}
+    injector = InjectorTween(env, None, variants=variants)
+
+    assert injector.urls_by_resource("extra") == ("extra",)
+    assert injector._urls == {"common": ("common",), "extra": ("extra",)}
+    assert len(threads) == 2
+
+    assert injector.urls_by_resource("common") == ("common",)
+    assert sorted(calls) == ["common", "extra"]
+
+
+def test_build_variants_chdir_filters(tempdir, monkeypatch):
+    app = spawn_variant_app(tempdir)
+    registry = app.config.webasset_registry
+    env = registry.get_environment()
+
+    running = set()
+    overlaps = []
+    original = more.webassets.tweens.bundle_urls
+
+    def bundle_urls(environment, name):
+        overlaps.append(frozenset(running))
+        running.add(name)
+        time.sleep(0.05)  # give the other thread time to start building
+        running.discard(name)
+        return original(environment, name)
+
+    monkeypatch.setattr(more.webassets.tweens, "bundle_urls", bundle_urls)
+
+    # the stylesheets of the variants, which write different files
+    siblings = ("theme_1", "theme@dark_1")
+    variants = {"theme_1": siblings, "theme@dark_1": siblings}
+    injector = InjectorTween(env, None, variants=variants)
+
+    # pyscss changes the working directory, the variants take turns
+    assert injector.urls_by_resource("theme@dark_1")
+    assert sorted(injector._urls) == ["theme@dark_1", "theme_1"]
+    assert overlaps == [frozenset(), frozenset()]
+
+
+def test_profiles(tempdir):
+    App = spawn_test_app(tempdir).__class__
+
+    @App.webasset_profile("default", "defer")
+    def get_default_profile():
+        yield "common"
+        yield "extra"
+        yield "theme"
+
+    class Page:
+        pass
+
+    @App.path(model=Page, path="page")
+    def get_page():
+        return Page()
+
+    @App.html(model=Page)
+    def view_page(self, request):
+        request.include_profile("default")
+        request.include_profile("default")
+        return "<html><head></head><body></body></html>"
+
+    @App.html(model=Page, name="prefetch")
+    def view_prefetch(self, request):
+        request.include_profile("default")
+        request.prefetch("theme")
+        request.prefetch("extra")
+        return "<html><head></head><body></body></html>"
+
+    morepath.commit(App)
+
+    app = App()
+    registry = app.config.webasset_registry
+    assert registry.profiles == {"default": frozenset({"defer"})}
+
+    client = Client(app)
+    page = client.get("/page").text
+
+    scripts = re.findall(r"<script[^>]*>", page)
+    stylesheets = re.findall(r'<link rel="stylesheet"[^>]*>', page)
+
+    assert scripts == [
+        '<script type="text/javascript" '
+        'src="/assets/default.bundle.js?1d17426a" defer>'
+    ]
+    assert len(stylesheets) == 1
+    assert "/assets/theme.bundle.css" in stylesheets[0]
+
+    script = client.get("/assets/default.bundle.js").text
+    assert "var $=function(){}" in script
+    assert "$(document).ready" in script
+
+    # the tags are rendered once
+    injector = next(iter(registry.reloader.tweens))[0]
+    fragments = dict(injector._fragments)
+
+    assert client.get("/page").text == page
+    assert injector._fragments[("default", False)] is fragments[("default", False)]
+
+    # the bundles loaded by the profile are not prefetched
+    page = client.get("/page/prefetch").text
+    prefetched = re.findall(r'<link rel="prefetch" href="([^"]+)">', page)
+    assert prefetched == ["/assets/extra.bundle.js?09ff425f"]
+
+
+def test_profile_name_conflict(tempdir):
+    App = spawn_test_app(tempdir).__class__
+
+    @App.webasset_profile("common")
+    def get_common_profile():
+        yield "extra"
+
+    with pytest.raises(AssertionError):
+        morepath.commit(App)
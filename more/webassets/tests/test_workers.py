@@ -0,0 +1,92 @@
+import morepath
+import os.path
+import pytest
+import re
+import sys
+
+from more.webassets import WebassetsApp
+from more.webassets.workers import WorkerError, WorkerFilter, WorkerPool
+from more.webassets.workers import get_pool
+
+
+WORKER = (sys.executable, os.path.join(os.path.dirname(__file__), "worker.py"))
+
+
+@pytest.fixture
+def pool():
+    pool = WorkerPool(WORKER, size=2)
+    yield pool
+    pool.close()
+
+
+def pid(result):
+    return re.search(rb"/\* (\d+) \*/", result).group(1)
+
+
+def test_worker_pool_reuses_workers(pool):
+    first = pool.run(b"var a;")
+    second = pool.run(b"var b;")
+
+    assert first.startswith(b"VAR A;")
+    assert second.startswith(b"VAR B;")
+    assert pid(first) == pid(second)
+    assert len(pool.idle) == 1
+
+
+def test_worker_pool_errors(pool):
+    result = pool.run(b"var a;")
+
+    # errors reported by the tool keep the worker alive
+    with pytest.raises(WorkerError, match="failed on purpose"):
+        pool.run(b"fail")
+
+    assert pid(pool.run(b"var a;")) == pid(result)
+
+    # crashing workers are replaced
+    with pytest.raises(WorkerError):
+        pool.run(b"exit")
+
+    assert pid(pool.run(b"var a;")) != pid(result)
+
+
+def test_worker_pool_missing_command():
+    with pytest.raises(WorkerError, match="could not start"):
+        WorkerPool(["/does/not/exist"]).run(b"")
+
+
+def test_worker_filter(tempdir, fixtures_path):
+    class App(WebassetsApp):
+        pass
+
+    @App.webasset_path()
+    def get_path():
+        return fixtures_path
+
+    @App.webasset_output()
+    def get_output_path():
+        return tempdir
+
+    @App.webasset_filter("js")
+    def get_js_filter():
+        return WorkerFilter(WORKER, method="input")
+
+    @App.webasset("common")
+    def get_common_assets():
+        yield "jquery.js"
+        yield "underscore.js"
+
+    morepath.commit(App)
+
+    env = App().config.webasset_registry.get_environment()
+    env["common"].urls()
+
+    with open(os.path.join(tempdir, "common.bundle.js")) as f:
+        content = f.read()
+
+    # each file is passed to a worker on its own, the same worker is reused
+    assert "FAKE JQUERY" in content
+    assert "FAKE UNDERSCORE" in content
+    assert len(re.findall(r"/\* (\d+) \*/", content)) == 2
+    assert len(set(re.findall(r"/\* (\d+) \*/", content))) == 1
+
+    assert get_pool(WORKER).idle
@@ -0,0 +1,25 @@
+"""A stand-in for an external tool, used to test the worker pool.
+
+Uppercases its input and appends the id of the process. Fails if the input
+contains 'fail' and exits if it contains 'exit'.
+
+"""
+
+import os
+import sys
+
+from more.webassets.workers import serve
+
+
+def handle(data):
+    if b"fail" in data:
+        raise ValueError("failed on purpose")
+
+    if b"exit" in data:
+        sys.exit(1)
+
+    return data.upper() + b"/* %d */" % os.getpid()
+
+
+if __name__ == "__main__":
+    serve(handle)
@@ -1,14 +1,23 @@
+import contextlib
+import functools
+import json
+import mimetypes
 import os
+import stat
+import threading
 import time
 import webob
 
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
+from more.webassets.directives import LEGACY_SUFFIX
 from webob.static import FileApp
 
 try:
-    from urllib import unquote
+    from urllib import quote, unquote
 except ImportError:
-    from urllib.parse import unquote
+    from urllib.parse import quote, unquote
 
 
 # content types and methods that get handled by the injector/publisher
@@ -18,6 +27,47 @@ METHODS = {"GET", "POST", "HEAD"}
 # arbitrarily define forever as 10 years in the future
 FOREVER = timedelta(days=365 * 10).total_seconds()
 
+# defines moreWebassets.load(name), which loads the bundles of the assets
+# included with the 'lazy' hint once it is called
+LOADER = """\
+(function(w, d) {
+  var m = w.moreWebassets = w.moreWebassets || {assets: {}, loaded: {}};
+  m.load = m.load || function(name) {
+    var asset = m.assets[name];
+    if (!asset) { return Promise.reject(new Error("unknown asset " + name)); }
+    m.loaded[name] = m.loaded[name] || Promise.all(asset.urls.map(function(url) {
+      return new Promise(function(resolve, reject) {
+        var css = /\\.css(\\?|$)/.test(url);
+        var el = d.createElement(css ? "link" : "script");
+        if (css) { el.rel = "stylesheet"; el.href = url; }
+        else { el.src = url; el.async = false; }
+        if (!css && asset.module) { el.type = "module"; }
+        el.onload = resolve; el.onerror = reject;
+        d.head.appendChild(el);
+      });
+    }));
+    return m.loaded[name];
+  };
+  var assets = %s;
+  for (var name in assets) { m.assets[name] = assets[name]; }
+})(window, document);"""
+
+
+# the webassets filters changing the working directory of the process while
+# they run, only one of them may run at a time (see InjectorTween.building)
+CHDIR_FILTERS = {
+    "autoprefixer",
+    "autoprefixer6",
+    "compass",
+    "less",
+    "node-sass",
+    "node-scss",
+    "postcss",
+    "pyscss",
+}
+
+# held while any of those filters may run, by all environments
+WORKING_DIRECTORY_LOCK = threading.Lock()
 
 # what separators does this operating system provide that are not a slash?
 _os_alt_seps = {sep for sep in [os.path.sep, os.path.altsep] if sep not in (None, "/")}
@@ -46,38 +96,585 @@ def has_insecure_path_element(path):
     return False
 
 
+def bundle_outputs(bundle):
+    """Yields the output of the given bundle and of all its nested bundles."""
+
+    if bundle.output:
+        yield bundle.output
+
+    for content in bundle.contents:
+        if hasattr(content, "contents"):
+            yield from bundle_outputs(content)
+
+
+def bundle_filter_names(bundle):
+    """Yields the names of the filters of the given bundle and of all its
+    nested bundles (including the filters applied by other filters).
+
+    """
+
+    for filter in bundle.filters:
+        yield filter.name
+
+        for inner in getattr(filter, "filters", ()):
+            yield inner.name
+
+    for content in bundle.contents:
+        if hasattr(content, "contents"):
+            yield from bundle_filter_names(content)
+
+
+def bundle_chain(environment, name):
+    """Yields the given bundle and all the bundles following it.
+
+    Assets consisting of javascript and stylesheets are registered as
+    multiple bundles, linked through the ``next_bundle`` attribute.
+
+    """
+
+    bundle = environment[name]
+
+    while bundle is not None:
+        yield bundle
+
+        try:
+            bundle = environment[getattr(bundle, "next_bundle")]
+        except (AttributeError, KeyError):
+            bundle = None
+
+
+def bundle_urls(environment, name):
+    """Returns the urls of the given bundle and all the bundles following it."""
+
+    urls = []
+
+    for bundle in bundle_chain(environment, name):
+        urls.extend(bundle.urls())
+
+    return urls
+
+
+def bundle_sources(environment, name):
+    """Returns the source files of the given bundle and all the bundles
+    following it.
+
+    """
+    from webassets.bundle import get_all_bundle_files
+
+    sources = []
+
+    for bundle in bundle_chain(environment, name):
+        sources.extend(get_all_bundle_files(bundle))
+
+    return sources
+
+
+def file_signature(path):
+    """Returns a tuple which changes if the given file is modified."""
+
+    try:
+        info = os.stat(path)
+    except OSError:
+        return None
+
+    return info.st_mtime_ns, info.st_size
+
+
+def save_versions(environment):
+    """Writes the new hashes of the given environment's version cache (see
+    :class:`more.webassets.versions.VersionCache`), if it has one.
+
+    """
+
+    cache = getattr(environment.versions, "cache", None)
+
+    if cache is not None:
+        cache.save()
+
+
+def published_files(environment):
+    """Returns the set of files the given environment may publish.
+
+    The paths are relative to the environment's directory and are all checked
+    for insecure path elements and for pointing outside the directory. This
+    is done once, when the set is created, so the publisher may serve files
+    by simply looking them up in the set.
+
+    """
+
+    files = set()
+
+    for bundle in environment:
+        for output in bundle_outputs(bundle):
+            if "%(version)s" in output:
+                continue
+
+            if has_insecure_path_element(output):
+                continue
+
+            path = os.path.join(environment.directory, output)
+
+            if not is_subpath(environment.directory, os.path.abspath(path)):
+                continue
+
+            files.add(output)
+
+    # the hashed copies of binary files (see more.webassets.binaries)
+    hashed_files = getattr(environment, "hashed_files", None)
+
+    if hashed_files:
+        files.update(hashed_files.names().values())
+
+    return files
+
+
 class InjectorTween:
-    """Injects the webasset urls into the response."""
+    """Injects the webasset urls into the response.
+
+    The urls are absolute paths, unless a ``base_url`` is given, in which case
+    they are prefixed with it (e.g. to load the bundles from a CDN).
+
+    The urls of each resource are cached. In debug mode, the source files of
+    the cached resources are checked for changes at most every
+    ``check_interval`` seconds. Resources with changed source files are
+    resolved again on their next use.
+
+    If ``service_worker`` is given, it is the scope of the service worker
+    registered by the pages (see :mod:`more.webassets.serviceworker`).
+
+    If ``legacy`` is true, the scripts of resources with a legacy build are
+    injected twice: as modules and as ``nomodule`` scripts of the legacy
+    build. If ``legacy`` is a function, it is called with the user agent and
+    returns True for legacy browsers, which then get the legacy build (the
+    others get the usual scripts).
+
+    If ``variants`` is given, it maps the resources of the variants of an
+    asset to the resources of all its variants. Those are built together.
 
-    def __init__(self, environment, handler):
+    If ``profiles`` is given, it holds the hints of the profiles by name
+    (see :class:`more.webassets.directives.WebassetProfile`). The tags of a
+    profile are rendered once and reused until its urls change.
+
+    The tween may be used by many threads at once. Cached urls are read
+    without locking. Resolving the urls of a resource may build its bundles,
+    so only one thread resolves a given resource, the others wait for it
+    and share its result.
+
+    """
+
+    def __init__(
+        self,
+        environment,
+        handler,
+        base_url=None,
+        check_interval=1.0,
+        service_worker=None,
+        legacy=None,
+        variants=None,
+        profiles=None,
+    ):
         self.environment = environment
         self.handler = handler
+        self.prefix = base_url.rstrip("/") + "/" if base_url else "/"
+        self.check_interval = check_interval
+        self.service_worker = service_worker
+        self.legacy = legacy
+        self.variants = variants or {}
+        self.profiles = profiles or {}
+        self._fragments = {}
+
+        # most requests come from a handful of user agents
+        if callable(legacy):
+            self.is_legacy_browser = functools.lru_cache(maxsize=1024)(legacy)
         self._urls = {}
+        self._signatures = {}
+        self._last_check = time.monotonic()
+
+        # guards the caches and the locks of the resources being resolved
+        # and of the files being built
+        self._lock = threading.Lock()
+        self._resolving = {}
+        self._building = {}
 
     def urls_by_resource(self, resource):
-        if self.environment.debug or resource not in self._urls:
-            self._urls[resource] = []
+        if self.environment.debug:
+            self.check_sources()
+
+        urls = self._urls.get(resource)
+
+        if urls is None:
+            urls = self.resolve(resource)
 
-            bundle = self.environment[resource]
-            while bundle is not None:
-                self._urls[resource].extend(bundle.urls())
+        return urls
 
-                try:
-                    bundle = self.environment[getattr(bundle, "next_bundle")]
-                except (AttributeError, KeyError):
-                    bundle = None
+    def resolve(self, resource):
+        """Resolves the urls of the given resource and caches them.
 
-        return self._urls[resource]
+        Only one thread resolves a given resource, the others wait for it
+        and use its result. Different resources are resolved in parallel,
+        unless they write the same files (see :meth:`building`).
+
+        """
+
+        environment = self.environment
+
+        with self._lock:
+            lock = self._resolving.setdefault(resource, threading.Lock())
+
+        with lock:
+            # another thread may have resolved the resource in the meantime
+            urls = self._urls.get(resource)
+
+            if urls is not None:
+                return urls
+
+            siblings = self.variants.get(resource)
+
+            # the variants are usually all needed sooner or later (the copies
+            # made in debug mode are shared between them though)
+            if siblings and not environment.debug:
+                resolved = self.build_variants(environment, siblings)
+            else:
+                with self.building(environment, (resource,)):
+                    if environment.debug:
+                        signatures = tuple(
+                            (path, file_signature(path))
+                            for path in set(bundle_sources(environment, resource))
+                        )
+
+                    resolved = {resource: tuple(bundle_urls(environment, resource))}
+
+            with self._lock:
+                # the urls of a replaced environment are not cached
+                if self.environment is environment:
+                    if environment.debug:
+                        self._signatures[resource] = signatures
+
+                    self._urls.update(resolved)
+
+            # the hashes of the bundles just built are written at once
+            save_versions(environment)
+
+        return resolved[resource]
+
+    def build_variants(self, environment, resources):
+        """Builds the given variants in parallel and returns their urls by
+        resource.
+
+        The calling thread holds the locks of the source files of all
+        variants, each variant is then built by a thread holding the locks
+        of the files it writes. So the bundles shared by the variants are
+        only built by the first one, and the filters changing the working
+        directory still run one at a time.
+
+        """
+
+        def build(resource):
+            with self.building(environment, (resource,), sources=False):
+                return tuple(bundle_urls(environment, resource))
+
+        with self.building(environment, resources, outputs=False):
+            with ThreadPoolExecutor(max_workers=len(resources)) as pool:
+                return dict(zip(resources, pool.map(build, resources)))
+
+    @contextlib.contextmanager
+    def building(self, environment, resources, sources=True, outputs=True):
+        """Holds the locks of the files read and written while building the
+        given resources (either of which may be left out).
+
+        Webassets does not build a bundle safely from multiple threads. The
+        bundles of different assets write the same files if they share
+        nested bundles or source files (which are copied to the output
+        directory in debug mode), so those are built one at a time.
+        So are the bundles using filters which change the working directory
+        (see ``CHDIR_FILTERS``).
+
+        """
+
+        read = set()
+        written = set()
+        chdir = False
+
+        for resource in resources:
+            if outputs:
+                for bundle in bundle_chain(environment, resource):
+                    written.update(bundle_outputs(bundle))
+                    chdir = chdir or not CHDIR_FILTERS.isdisjoint(
+                        bundle_filter_names(bundle)
+                    )
+
+            if sources:
+                read.update(bundle_sources(environment, resource))
+
+        # the locks are always acquired in the same order, the sources (which
+        # are absolute paths) before the outputs (which are relative paths)
+        with self._lock:
+            locks = [
+                self._building.setdefault(path, threading.Lock())
+                for path in sorted(read) + sorted(written)
+            ]
+
+        # some compilers change the working directory of the process
+        if chdir:
+            locks.append(WORKING_DIRECTORY_LOCK)
+
+        # webassets creates the directory of the copies if it is missing,
+        # which fails if another thread creates it at the same time
+        if environment.debug:
+            os.makedirs(
+                os.path.join(environment.directory, "webassets-external"),
+                exist_ok=True,
+            )
+
+        with contextlib.ExitStack() as stack:
+            for lock in locks:
+                stack.enter_context(lock)
+
+            yield
+
+    def swap(self, environment, urls=None):
+        """Replaces the environment, together with the cached urls (which
+        may be passed if they are known already).
+
+        Pages which are being rendered keep the urls of the previous
+        environment, so those are still served for a while (see
+        :meth:`PublisherTween.swap`).
+
+        """
+
+        with self._lock:
+            self.environment = environment
+            self._urls = dict(urls or {})
+            self._signatures = {}
+            self._fragments = {}
+
+    def check_sources(self):
+        """Drops the cached urls of all resources whose source files changed.
+
+        Each source file is only looked at once, even if it is part of many
+        resources. Does nothing if the last check is more recent than
+        the check interval.
+
+        """
+
+        now = time.monotonic()
+
+        if now - self._last_check < self.check_interval:
+            return
+
+        with self._lock:
+            # another thread is checking or has just checked
+            if now - self._last_check < self.check_interval:
+                return
+
+            self._last_check = now
+            cached = tuple(self._signatures.items())
+
+        signatures = {}
+        changed = []
+
+        for resource, sources in cached:
+            for path, signature in sources:
+                if path not in signatures:
+                    signatures[path] = file_signature(path)
+
+                if signatures[path] != signature:
+                    changed.append((resource, sources))
+                    break
+
+        with self._lock:
+            for resource, sources in changed:
+                # the resource may have been resolved again in the meantime
+                if self._signatures.get(resource) is sources:
+                    del self._signatures[resource]
+                    self._urls.pop(resource, None)
+
+    def resource_urls(self, resource, suffix=None):
+        """Yields the prefixed urls of the given resource."""
+
+        for url in self.urls_by_resource(resource):
+            filename = url.split("?")[0]
+
+            if suffix and not filename.endswith(suffix):
+                continue
+
+            yield self.prefix + url
 
     def urls_to_inject(self, request, suffix=None):
+        """Yields the urls of the included resources, except for the ones
+        loaded on demand.
+
+        """
+
+        for resource, hints in self.included(request):
+            if "lazy" not in hints:
+                yield from self.resource_urls(resource, suffix)
+
+    def included(self, request):
+        """Yields the included resources together with their hints."""
+
+        hints = getattr(request, "asset_hints", {})
+
         for resource in request.included_assets:
-            for url in self.urls_by_resource(resource):
-                filename = url.split("?")[0]
+            yield resource, hints.get(resource, frozenset())
+
+    def prefetch_tags(self, request):
+        """Yields the prefetch links of the prefetched resources, skipping
+        the bundles loaded by the page anyway.
 
-                if suffix and not filename.endswith(suffix):
+        """
+
+        prefetched = getattr(request, "prefetched_assets", ())
+
+        if not prefetched:
+            return
+
+        loaded = set(self.urls_to_inject(request))
+
+        for profile in getattr(request, "included_profiles", ()):
+            loaded.update(self.resource_urls(profile))
+
+        hints = request.prefetch_hints
+
+        for resource in prefetched:
+            for url in self.resource_urls(resource):
+                if url in loaded:
                     continue
 
-                yield "/" + url
+                loaded.add(url)
+
+                is_script = url.split("?")[0].endswith(".js")
+
+                if is_script and "module" in hints[resource]:
+                    yield f'<link rel="modulepreload" href="{url}">'
+                else:
+                    yield f'<link rel="prefetch" href="{url}">'
+
+    def legacy_resource(self, resource):
+        """Returns the name of the legacy build of the given resource, or
+        None if there is none.
+
+        """
+
+        if not self.legacy:
+            return None
+
+        name = f"{resource}{LEGACY_SUFFIX}"
+        return name if name in self.environment else None
+
+    def script_tags(self, request, resource, hints):
+        """Yields the script tags of the given resource."""
+
+        legacy = self.legacy_resource(resource)
+
+        if legacy is None or callable(self.legacy):
+            if legacy and self.is_legacy_browser(request.user_agent or ""):
+                resource = legacy
+
+            for url in self.resource_urls(resource, ".js"):
+                yield self.script_tag(url, hints)
+
+            return
+
+        # browsers supporting modules ignore nomodule scripts, the others
+        # ignore modules
+        for url in self.resource_urls(resource, ".js"):
+            yield self.script_tag(url, hints | {"module"})
+
+        for url in self.resource_urls(legacy, ".js"):
+            yield self.script_tag(url, (hints - {"module"}) | {"nomodule"})
+
+    def script_tag(self, url, hints):
+        kind = "module" if "module" in hints else "text/javascript"
+        flags = "".join(
+            f" {flag}" for flag in ("async", "defer", "nomodule") if flag in hints
+        )
+
+        return f'<script type="{kind}" src="{url}"{flags}></script>'
+
+    def stylesheet_tag(self, url, hints):
+        tag = f'<link rel="stylesheet" type="text/css" href="{url}">'
+
+        if "nonblocking" not in hints:
+            return tag
+
+        # load the stylesheet without blocking, then apply it
+        return (
+            f'<link rel="stylesheet" type="text/css" href="{url}" '
+            f'media="print" onload="this.media=\'all\'">'
+            f"<noscript>{tag}</noscript>"
+        )
+
+    def profile_fragments(self, request, profile):
+        """Returns the rendered script and stylesheet tags of the given
+        profile.
+
+        The tags are cached together with the urls they were rendered from,
+        so they are rendered again once the urls are resolved again.
+
+        """
+
+        urls = self.urls_by_resource(profile)
+
+        # legacy browsers may get other scripts (see script_tags)
+        legacy = callable(self.legacy) and self.is_legacy_browser(
+            request.user_agent or ""
+        )
+
+        fragments = self._fragments.get((profile, legacy))
+
+        if fragments is None or fragments[0] is not urls:
+            hints = self.profiles[profile]
+            fragments = (
+                urls,
+                "\n".join(self.script_tags(request, profile, hints)),
+                "\n".join(
+                    self.stylesheet_tag(url, hints)
+                    for url in self.resource_urls(profile, ".css")
+                ),
+            )
+
+            self._fragments[(profile, legacy)] = fragments
+
+        return fragments[1:]
+
+    def loader_script(self, request):
+        """Returns the loader of the resources included with the 'lazy'
+        hint (or an empty string if there are none).
+
+        """
+
+        assets = {
+            resource: {
+                "urls": list(self.resource_urls(resource)),
+                "module": "module" in hints,
+            }
+            for resource, hints in self.included(request)
+            if "lazy" in hints
+        }
+
+        if not assets:
+            return ""
+
+        # the json ends up in a script tag, which must not be closed early
+        data = json.dumps(assets, sort_keys=True).replace("</", "<\\/")
+        return f'<script type="text/javascript">{LOADER % data}</script>'
+
+    def service_worker_script(self):
+        """Returns the script registering the service worker."""
+
+        from more.webassets.serviceworker import SERVICE_WORKER
+
+        # service workers are always served by the app (same origin)
+        url = f"/{self.environment.url.strip('/')}/{SERVICE_WORKER}"
+        options = json.dumps({"scope": self.service_worker})
+
+        return (
+            '<script type="text/javascript">'
+            'if ("serviceWorker" in navigator) { '
+            f'navigator.serviceWorker.register("{url}", {options}); '
+            "}</script>"
+        )
 
     def __call__(self, request):
         response = self.handler(request)
@@ -91,15 +688,41 @@ class InjectorTween:
         if response.content_type.lower() not in CONTENT_TYPES:
             return response
 
-        scripts = "\n".join(
-            f'<script type="text/javascript" src="{url}"></script>'
-            for url in self.urls_to_inject(request, ".js")
-        )
+        scripts = []
+        stylesheets = []
 
-        stylesheets = "\n".join(
-            f'<link rel="stylesheet" type="text/css" href="{url}">'
-            for url in self.urls_to_inject(request, ".css")
-        )
+        for profile in getattr(request, "included_profiles", ()):
+            profile_scripts, profile_stylesheets = self.profile_fragments(
+                request, profile
+            )
+
+            if profile_scripts:
+                scripts.append(profile_scripts)
+
+            if profile_stylesheets:
+                stylesheets.append(profile_stylesheets)
+
+        for resource, hints in self.included(request):
+            if "lazy" in hints:
+                continue
+
+            scripts.extend(self.script_tags(request, resource, hints))
+
+            for url in self.resource_urls(resource, ".css"):
+                stylesheets.append(self.stylesheet_tag(url, hints))
+
+        stylesheets.extend(self.prefetch_tags(request))
+
+        loader = self.loader_script(request)
+
+        if loader:
+            scripts.insert(0, loader)
+
+        if self.service_worker:
+            scripts.append(self.service_worker_script())
+
+        scripts = "\n".join(scripts)
+        stylesheets = "\n".join(stylesheets)
 
         if scripts:
             response.body = response.body.replace(
@@ -114,52 +737,368 @@ class InjectorTween:
         return response
 
 
+#: Everything the publisher serves, replaced as a whole (see
+#: :meth:`PublisherTween.swap`)
+PublisherState = namedtuple(
+    "PublisherState",
+    ("environment", "published", "versions", "service_worker", "archive", "previous"),
+)
+
+
 class PublisherTween:
     """Returns the webassets if the request begins with the
     :attr:`WebassetsApp.webassets_url`.
 
+    Only files found in :attr:`published` are served. The set is created from
+    the bundles of the environment (see :func:`published_files`), so requests
+    for unknown files are answered without touching the filesystem.
+
+    If ``offload`` is given, it is a tuple of header and path prefix (see
+    :class:`more.webassets.directives.WebassetOffload`). Files are then not
+    read by the publisher, but sent by the web server in front of it.
+
+    If ``service_worker`` is given, it is a
+    :class:`more.webassets.serviceworker.ServiceWorker` serving the worker
+    script and its precache manifest.
+
+    If ``archive`` is given, it is a :class:`more.webassets.archive.Archive`
+    whose files are served from memory (see :meth:`archive_response`).
+
+    The environment, its published files and the rest of what is served are
+    kept in a single :class:`PublisherState`, which is replaced as a whole.
+    Each request uses the state it started with.
+
     """
 
-    def __init__(self, environment, handler):
-        self.environment = environment
+    def __init__(
+        self,
+        environment,
+        handler,
+        published=None,
+        offload=None,
+        service_worker=None,
+        archive=None,
+    ):
         self.handler = handler
+        self.offload = offload
+
+        if published is None:
+            published = published_files(environment)
+
+        #: The output directory of the first environment, which contains the
+        #: directories of the environments swapped in later
+        self.root = environment.directory
+
+        # only guards the replacement of the state, it is read without it
+        self._lock = threading.Lock()
+
+        self.state = PublisherState(
+            environment=environment,
+            published=published,
+            versions=getattr(environment.versions, "cache", None),
+            service_worker=service_worker,
+            archive=archive,
+            previous=(),
+        )
+
+    @property
+    def environment(self):
+        return self.state.environment
+
+    @property
+    def published(self):
+        """The paths (relative to the output directory) which may be served."""
+        return self.state.published
+
+    @property
+    def versions(self):
+        """The cache of file hashes used as ETags (if the environment has
+        one).
+
+        """
+        return self.state.versions
+
+    @property
+    def service_worker(self):
+        return self.state.service_worker
+
+    @property
+    def archive(self):
+        return self.state.archive
+
+    @property
+    def previous(self):
+        """The output directories, published files and hashes of the
+        environments replaced by :meth:`swap`, together with the time until
+        they are still served.
+
+        """
+        return self.state.previous
+
+    def publish(self, *paths):
+        """Adds the given paths to the published files.
+
+        Paths are relative to the output directory and they are subject to
+        the same checks as the ones found by :func:`published_files`.
+
+        """
+
+        for path in paths:
+            assert self.is_safe(path), f"{path} may not be published"
+
+        with self._lock:
+            self.state = self.state._replace(
+                published=self.state.published | set(paths)
+            )
+
+    def swap(self, environment, published=None, grace_period=300):
+        """Replaces the environment with a new one (with all its bundles
+        built already).
+
+        The files of the previous environment are still served for the
+        given grace period (in seconds), so pages rendered before the swap
+        may still load them. As the bundles keep their name, the version in
+        the url decides which file is served.
+
+        """
+
+        if published is None:
+            published = published_files(environment)
+
+        with self._lock:
+            state = self.state
+            now = time.monotonic()
+
+            previous = (
+                state.environment.directory,
+                state.published,
+                state.versions,
+                now + grace_period,
+            )
+
+            service_worker = state.service_worker
+
+            if service_worker:
+                service_worker = service_worker.replace(environment)
+
+            self.state = state._replace(
+                environment=environment,
+                published=published,
+                versions=getattr(environment.versions, "cache", None),
+                service_worker=service_worker,
+                previous=(*(e for e in state.previous if e[3] > now), previous),
+            )
+
+    def previous_asset(self, subpath, version=None, state=None):
+        """Returns the file of the latest previous environment publishing
+        the given path, if it is still served.
+
+        If a version is given, only a file with a matching hash is returned.
+
+        """
+
+        state = state or self.state
+        now = time.monotonic()
+
+        for directory, published, versions, until in reversed(state.previous):
+            if until <= now or subpath not in published:
+                continue
+
+            asset = os.path.join(directory, subpath)
+
+            if not version:
+                return asset
+
+            if versions and os.path.isfile(asset):
+                if versions.hash(asset).startswith(version):
+                    return asset
+
+        return None
+
+    def use_archive(self, archive):
+        """Serves the files of the given archive from now on (None to stop
+        using an archive).
+
+        """
+
+        with self._lock:
+            self.state = self.state._replace(archive=archive)
+
+    def archive_response(self, request, archive, entry):
+        """Returns the response for the given file of the given archive.
+
+        The gzip variant is sent to clients accepting it. The ETag is the
+        hash of the file, like for the files served from the filesystem.
+
+        """
+
+        accept = request.headers.get("Accept-Encoding", "")
+
+        response = webob.Response(conditional_response=True)
+        response.headers["Content-Type"] = entry.content_type
+
+        if entry.gzip and "gzip" in accept:
+            location = entry.gzip
+            response.content_encoding = "gzip"
+        else:
+            location = entry.data
+
+        if entry.gzip:
+            response.vary = ("Accept-Encoding",)
+
+        response.app_iter = [archive.body(location)]
+        response.content_length = location[1]
+        response.etag = entry.etag
+        response.cache_control.max_age = FOREVER
+        response.expires = time.time() + FOREVER
+
+        return request.get_response(response)
+
+    def refresh(self):
+        """Recreates the published files from the environment, for example
+        after bundles have been added or rebuilt.
+
+        """
+
+        with self._lock:
+            self.state = self.state._replace(
+                published=published_files(self.state.environment)
+            )
 
     def __call__(self, request):
+        # the state may be replaced while the request is handled
+        state = self.state
+        environment = state.environment
         publisher_signature = request.path_info_peek()
 
-        if publisher_signature != self.environment.url:
+        if publisher_signature != environment.url:
             return self.handler(request)
 
-        subpath = request.path_info.replace(publisher_signature, "").strip("/")
+        # only remove the prefix, it may also occur later in the path
+        subpath = request.path_info.lstrip("/")[len(publisher_signature) :]
+        subpath = subpath.strip("/")
         subpath = unquote(subpath)
 
-        if has_insecure_path_element(subpath):
-            return webob.exc.HTTPNotFound()
+        if state.service_worker and subpath in state.service_worker.names:
+            return state.service_worker(request, subpath)
 
-        asset = os.path.join(self.environment.directory, subpath)
-        asset = os.path.abspath(asset)
+        archive = state.archive
 
-        # I'm not entirely at ease with loading a file from disk and returning
-        # it over the web. So as an extra precaution I want to make sure
-        # that only files *inside* the assets folder will be served.
-        #
-        # I doubt webob let's this happen, but if somebody is ever able to
-        # create an url resulting in a path that points outside the assets
-        # directory this check might help.
-        if not is_subpath(self.environment.directory, asset):
+        if archive:
+            entry = archive.files.get(subpath)
+
+            # the urls contain the version, which changes if the bundles are
+            # built again after the archive was written
+            if entry and entry.etag.startswith(request.query_string):
+                return self.archive_response(request, archive, entry)
+
+        # the published files have been checked for insecure path elements
+        # and for pointing outside the assets directory when they were added,
+        # so anything in the set is safe and anything else is not served
+        if subpath in state.published or (
+            # in debug mode, webassets copies the source files into the
+            # output directory and returns their urls, so those files are
+            # checked each time they are requested
+            environment.debug
+            and self.is_safe(subpath, environment.directory)
+        ):
+            asset = os.path.join(environment.directory, subpath)
+
+            # pages rendered before a swap refer to the previous version
+            if state.previous and request.query_string:
+                asset = self.versioned_asset(
+                    asset, subpath, request.query_string, state
+                )
+
+        elif state.previous:
+            asset = self.previous_asset(subpath, state=state)
+        else:
+            asset = None
+
+        if asset is None:
             return webob.exc.HTTPNotFound()
 
-        # This is possibly too paranoid
-        if os.path.islink(asset):
+        # the file might not be built yet and symlinks are never followed
+        # (this is possibly too paranoid), both is checked by a single lstat
+        try:
+            mode = os.lstat(asset).st_mode
+        except OSError:
             return webob.exc.HTTPNotFound()
 
-        if not os.path.isfile(asset):
+        if not stat.S_ISREG(mode):
             return webob.exc.HTTPNotFound()
 
-        response = request.get_response(FileApp(asset))
+        etag = state.versions and state.versions.hash(asset)
+
+        if etag and etag in request.if_none_match:
+            response = webob.exc.HTTPNotModified()
+        elif self.offload:
+            response = self.offload_response(os.path.relpath(asset, self.root))
+        else:
+            response = request.get_response(FileApp(asset))
+
+        if etag:
+            response.etag = etag
 
-        if response.status_code == 200:
+        # in debug mode the files change without their url changing
+        if response.status_code in (200, 304) and not environment.debug:
             response.cache_control.max_age = FOREVER
             response.expires = time.time() + FOREVER
 
         return response
+
+    def versioned_asset(self, asset, subpath, version, state=None):
+        """Returns the given file of the current environment, or the file of
+        a previous environment if only the latter matches the version.
+
+        """
+
+        state = state or self.state
+
+        if not state.versions:
+            return asset
+
+        try:
+            if state.versions.hash(asset).startswith(version):
+                return asset
+        except OSError:
+            return asset
+
+        return self.previous_asset(subpath, version, state) or asset
+
+    def is_safe(self, subpath, directory=None):
+        """Returns true if the given path may be served from the output
+        directory.
+
+        """
+        if has_insecure_path_element(subpath):
+            return False
+
+        directory = directory or self.environment.directory
+
+        # I'm not entirely at ease with loading a file from disk and returning
+        # it over the web. So as an extra precaution I want to make sure
+        # that only files *inside* the assets folder will be served.
+        asset = os.path.abspath(os.path.join(directory, subpath))
+        return is_subpath(directory, asset)
+
+    def offload_response(self, subpath):
+        """Returns an empty response pointing the web server to the file."""
+
+        header, prefix = self.offload
+
+        if prefix is None:
+            prefix = self.root
+
+        response = webob.Response()
+        response.content_type = mimetypes.guess_type(subpath)[0] or (
+            "application/octet-stream"
+        )
+
+        # nginx expects an uri, the others expect a path on the filesystem
+        if header == "X-Accel-Redirect":
+            subpath = quote(subpath)
+
+        response.headers[header] = prefix.rstrip("/") + "/" + subpath
+
+        return response
@@ -0,0 +1,142 @@
+"""Caches the hashes used as bundle versions and ETags.
+
+Webassets determines the version of a bundle by hashing its output file,
+which happens in every process for every bundle. The :class:`VersionCache`
+stores the hashes in a json file in the output directory, keyed by the
+identity of the file (path, size, modification time and inode). Files are
+only hashed again if their identity changes.
+
+New hashes are kept in memory until :meth:`VersionCache.save` is called
+(once the bundles are built, and at exit), so building many bundles writes
+the file once rather than once per bundle.
+
+"""
+
+import atexit
+import hashlib
+import json
+import mmap
+import os.path
+import threading
+import weakref
+
+from webassets.version import HashVersion, VersionIndeterminableError
+
+
+#: The name of the cache file inside the output directory
+VERSIONS = ".webassets-versions.json"
+
+#: Files larger than this are hashed through mmap instead of being read
+MMAP_THRESHOLD = 1024 * 1024
+
+
+def hash_file(path, size=None):
+    """Returns the md5 hex digest of the given file."""
+
+    size = os.path.getsize(path) if size is None else size
+
+    with open(path, "rb") as f:
+        if size < MMAP_THRESHOLD:
+            return hashlib.md5(f.read()).hexdigest()
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return hashlib.md5(m).hexdigest()
+
+
+def save_at_exit(reference):
+    cache = reference()
+
+    if cache is not None:
+        cache.save()
+
+
+class VersionCache:
+    """Stores file hashes in the given directory."""
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, VERSIONS)
+        self.lock = threading.Lock()
+        self.entries = self.load()
+
+        #: True if there are hashes which are not saved yet
+        self.dirty = False
+
+        # caches of replaced environments may be garbage collected
+        atexit.register(save_at_exit, weakref.ref(self))
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        """Writes the hashes to the cache file, if there are new ones."""
+
+        with self.lock:
+            if not self.dirty:
+                return
+
+            self.dirty = False
+            temporary = f"{self.path}.{os.getpid()}.tmp"
+
+            try:
+                with open(temporary, "w", encoding="utf-8") as f:
+                    json.dump(self.entries, f)
+
+                os.replace(temporary, self.path)
+            except OSError:
+                pass  # the cache is an optimisation, it may not be writable
+
+    def hash(self, path):
+        """Returns the md5 hex digest of the given file, hashing it only if
+        its identity changed since it was last hashed.
+
+        """
+
+        info = os.stat(path)
+        identity = [info.st_size, info.st_mtime_ns, info.st_ino]
+        entry = self.entries.get(path)
+
+        if entry and entry[0] == identity:
+            return entry[1]
+
+        digest = hash_file(path, info.st_size)
+
+        with self.lock:
+            self.entries[path] = [identity, digest]
+            self.dirty = True
+
+        return digest
+
+
+class CachedHashVersion(HashVersion):
+    """A webassets versioner using the hashes of a :class:`VersionCache`.
+
+    The versions are the same as the ones of the default hash versioner.
+
+    """
+
+    id = "cached-hash"
+
+    def __init__(self, cache, length=8):
+        super().__init__(length)
+        self.cache = cache
+
+    def determine_version(self, bundle, ctx, hunk=None):
+        # the bundle has just been built and is not written yet
+        if hunk is not None:
+            return super().determine_version(bundle, ctx, hunk)
+
+        if "%(version)s" in bundle.output:
+            raise VersionIndeterminableError("output target has a placeholder")
+
+        try:
+            return self.cache.hash(bundle.resolve_output(ctx))[: self.length]
+        except OSError as e:
+            raise VersionIndeterminableError(str(e))
+
+    def set_version(self, bundle, ctx, filename, version):
+        # remember the hash of freshly built bundles for other processes
+        self.cache.hash(filename)
@@ -0,0 +1,262 @@
+"""Runs filters through a pool of long-lived worker processes.
+
+Many filters wrap external tools (babel, sass, terser). Starting such a tool
+for every file and every build is slow, as the startup of the interpreter
+or the VM usually dominates the time spent. :class:`WorkerFilter` instead
+sends the content to a pool of worker processes, which are started once and
+kept around for the lifetime of the application::
+
+    from more.webassets.workers import WorkerFilter
+
+    @App.webasset_filter('js')
+    def get_js_filter():
+        return WorkerFilter(['node', 'terser-worker.js'])
+
+The workers talk to the pool through a simple framing protocol on stdin and
+stdout. Each request is the length of the payload in bytes, followed by a
+newline and the payload::
+
+    12\\n
+    var a = 1;\\n
+
+Each response is a status (``ok`` or ``error``), a space, the length of the
+payload, a newline and the payload. If the status is ``error``, the payload
+is the error message::
+
+    ok 10\\n
+    var a=1;\\n
+
+Workers written in Python may use :func:`serve` to implement the protocol.
+
+"""
+
+import atexit
+import subprocess
+import sys
+import threading
+
+from webassets.exceptions import FilterError
+from webassets.filter import Filter
+
+
+class WorkerError(FilterError):
+    """Raised if a worker fails to process a request."""
+
+
+def read_frame_payload(stream, length):
+    """Reads exactly ``length`` bytes from the stream."""
+
+    chunks = []
+
+    while length > 0:
+        chunk = stream.read(length)
+
+        if not chunk:
+            raise EOFError("unexpected end of stream")
+
+        chunks.append(chunk)
+        length -= len(chunk)
+
+    return b"".join(chunks)
+
+
+def serve(handler, stdin=None, stdout=None):
+    """Implements the worker side of the protocol.
+
+    Reads requests from stdin until it is closed, passing each payload to
+    the handler and writing its result to stdout. Exceptions raised by the
+    handler are sent back as errors::
+
+        from more.webassets.workers import serve
+
+        def uppercase(data):
+            return data.upper()
+
+        if __name__ == '__main__':
+            serve(uppercase)
+
+    """
+
+    stdin = stdin or sys.stdin.buffer
+    stdout = stdout or sys.stdout.buffer
+
+    while True:
+        header = stdin.readline()
+
+        if not header:
+            break
+
+        payload = read_frame_payload(stdin, int(header))
+
+        try:
+            status, result = b"ok", handler(payload)
+        except Exception as e:
+            status, result = b"error", str(e).encode("utf-8")
+
+        stdout.write(b"%s %d\n" % (status, len(result)))
+        stdout.write(result)
+        stdout.flush()
+
+
+class Worker:
+    """A single worker process."""
+
+    def __init__(self, command):
+        self.process = subprocess.Popen(
+            command, stdin=subprocess.PIPE, stdout=subprocess.PIPE
+        )
+
+    @property
+    def alive(self):
+        return self.process.poll() is None
+
+    def call(self, data):
+        """Sends the data to the worker and returns the result.
+
+        Raises a :class:`WorkerError` with the message of the worker if it
+        reports an error. Other exceptions mean the worker is broken.
+
+        """
+
+        self.process.stdin.write(b"%d\n" % len(data))
+        self.process.stdin.write(data)
+        self.process.stdin.flush()
+
+        header = self.process.stdout.readline()
+
+        if not header:
+            raise EOFError("worker exited")
+
+        status, length = header.split()
+        payload = read_frame_payload(self.process.stdout, int(length))
+
+        if status != b"ok":
+            raise WorkerError(payload.decode("utf-8", "replace"))
+
+        return payload
+
+    def close(self, timeout=5):
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+
+        self.process.stdout.close()
+
+
+class WorkerPool:
+    """Keeps up to ``size`` workers running the given command.
+
+    Workers are started when they are first needed and reused afterwards.
+    Workers which crash or break the protocol are replaced.
+
+    """
+
+    def __init__(self, command, size=2):
+        self.command = tuple(command)
+        self.size = size
+        self.idle = []
+        self.lock = threading.Lock()
+        self.available = threading.BoundedSemaphore(size)
+
+    def checkout(self):
+        with self.lock:
+            while self.idle:
+                worker = self.idle.pop()
+
+                if worker.alive:
+                    return worker
+
+                worker.close()
+
+        return Worker(self.command)
+
+    def checkin(self, worker):
+        with self.lock:
+            self.idle.append(worker)
+
+    def run(self, data):
+        """Processes the given bytes with one of the workers."""
+
+        with self.available:
+            try:
+                worker = self.checkout()
+            except OSError as e:
+                raise WorkerError(f"could not start {self.command[0]}: {e}") from e
+
+            try:
+                result = worker.call(data)
+            except WorkerError:
+                self.checkin(worker)
+                raise
+            except (OSError, EOFError, ValueError) as e:
+                worker.close()
+                raise WorkerError(f"{' '.join(self.command)} failed: {e}") from e
+
+            self.checkin(worker)
+
+        return result
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+
+        for worker in idle:
+            worker.close()
+
+
+#: The pools shared by all filters, keyed by command
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_pool(command, size=2):
+    """Returns the pool for the given command, creating it if necessary."""
+
+    command = tuple(command)
+
+    with pools_lock:
+        if command not in pools:
+            pools[command] = WorkerPool(command, size)
+
+        return pools[command]
+
+
+@atexit.register
+def close_pools():
+    with pools_lock:
+        for pool in pools.values():
+            pool.close()
+
+
+class WorkerFilter(Filter):
+    """A webassets filter sending the content to a :class:`WorkerPool`.
+
+    By default, the filter is applied once per bundle (``method='output'``).
+    Tools which need to process each file on its own (like transpilers)
+    should use ``method='input'``.
+
+    """
+
+    name = "worker"
+
+    def __init__(self, command, size=2, method="output"):
+        super().__init__()
+
+        assert method in ("input", "output"), f"unknown method {method}"
+
+        self.command = tuple(command)
+        self.size = size
+        self.method = method
+
+        # webassets only calls the methods a filter has
+        setattr(self, method, self.apply)
+
+    def unique(self):
+        return self.command, self.method
+
+    def apply(self, _in, out, **kwargs):
+        pool = get_pool(self.command, self.size)
+        out.write(pool.run(_in.read().encode("utf-8")).decode("utf-8"))
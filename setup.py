@@ -30,6 +30,7 @@ setup(
     zip_safe=False,
     platforms="any",
     install_requires=["morepath>=0.16", "ordered-set", "webassets", "webob"],
+    entry_points={"console_scripts": ["more-webassets = more.webassets.cli:main"]},
     extras_require=dict(
         test=[
             "pytest >= 2.9.0",